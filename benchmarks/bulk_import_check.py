@@ -0,0 +1,139 @@
+"""
+Checks the bulk importer against a local stub OMDb (see stub_server.py), no network or API key needed.
+Run from the repository root:  python -m benchmarks.bulk_import_check [--titles 120] [--workers 8] [--rate 50]
+The import list mixes new titles with ones OMDb doesn't know, ones failing with a server error, the same movie
+twice (different case, or title and IMDb ID) and a movie already in the library. The check runs the import
+without and with a rate limit, while another writer keeps adding movies to the same file, and verifies the
+report, the library (nobody's movies lost), that the requests stayed within the worker and rate limits,
+reused their connections, and that the importer wrote the library once.
+Prints a json report per run and exits with 1 if anything went wrong.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.stub_server import StubServer, omdb_movie, omdb_responder
+from bulk_import import BulkImporter
+from data.storage_json import StorageJson
+
+# answered by the stub with a server error instead of a movie
+BROKEN = "Broken Movie"
+MISSING = ("Missing Movie 1", "Missing Movie 2")
+# the movie the library already holds when the import starts
+EXISTING = 9000
+
+
+def import_list(count):
+    """
+    :return: (tuple) the entries to import and the expected "added", "skipped" and "failed" entries
+    """
+    added = [f"Stub Movie {number}" for number in range(count)]
+    skipped = ["stub movie 1", omdb_movie(2)["imdbID"], f"STUB MOVIE {EXISTING}"]
+    failed = [BROKEN, *MISSING]
+    return added + skipped + failed, added, skipped, failed
+
+
+def other_writer(file_path, stop):
+    """
+    adds movies through its own storage until stop is set, like a second RateFlix process would.
+    :return: (list) the titles it added, filled in while it runs
+    """
+    storage = StorageJson(file_path)
+    titles = []
+
+    def write():
+        while not stop.is_set():
+            title = f"Other Writer {len(titles)}"
+            storage.add_movie(title, "6.0", "1990", "N/A", f"https://www.imdb.com/title/tt8{len(titles):06d}/", "Spain")
+            titles.append(title)
+            time.sleep(0.01)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    return thread, titles
+
+
+def run(count, workers, rate, delay):
+    work_dir = tempfile.mkdtemp(prefix="rateflix-import-")
+    stub = StubServer(omdb_responder([omdb_movie(number) for number in list(range(count)) + [EXISTING]],
+                                     failures={BROKEN: 500}), delay=delay).start()
+    try:
+        storage = StorageJson(os.path.join(work_dir, "movies.json"))
+        existing = omdb_movie(EXISTING)
+        storage.add_movie(existing["Title"], existing["imdbRating"], existing["Year"], existing["Poster"],
+                          f"https://www.imdb.com/title/{existing['imdbID']}/", existing["Country"])
+        writes = []
+        add_movies = storage.add_movies
+        storage.add_movies = lambda movies: writes.append(len(movies)) or add_movies(movies)
+
+        entries, added, skipped, failed = import_list(count)
+        importer = BulkImporter(storage, "stub-key", url=stub.url + "/?apikey=", max_workers=workers, rate_limit=rate)
+        stop = threading.Event()
+        thread, others = other_writer(storage.file_path, stop)
+        start = time.perf_counter()
+        result = importer.import_titles(entries)
+        seconds = time.perf_counter() - start
+        stop.set()
+        thread.join()
+
+        movies = StorageJson(storage.file_path).list_movies()
+        # the movie already in the library is skipped without asking OMDb
+        expected_requests = len(entries) - 1
+        times = stub.request_times
+        report = {
+            "workers": workers, "rate_limit": rate, "seconds": round(seconds, 3),
+            "requests": stub.requests, "connections": stub.connections, "max_in_flight": stub.max_in_flight,
+            "requests_per_second": round((len(times) - 1) / (times[-1] - times[0]), 1) if len(times) > 1 else None,
+            "storage_writes": writes, "other_writes": len(others),
+            "problems": [],
+        }
+        problems = report["problems"]
+        if sorted(result["added"]) != sorted(added):
+            problems.append(f"added {len(result['added'])} movies instead of {len(added)}")
+        if sorted(result["skipped"]) != sorted(skipped):
+            problems.append(f"skipped {result['skipped']} instead of {skipped}")
+        if sorted(result["failed"]) != sorted(failed):
+            problems.append(f"failed {sorted(result['failed'])} instead of {failed}")
+        lost = set(added + others).difference(movies)
+        if lost:
+            problems.append(f"{len(lost)} movies are missing from the library, e.g. {sorted(lost)[:3]}")
+        if writes != [len(added)]:
+            problems.append(f"the library was written {len(writes)} times instead of once")
+        if stub.requests != expected_requests:
+            problems.append(f"{stub.requests} OMDb requests instead of {expected_requests}")
+        if stub.max_in_flight > workers:
+            problems.append(f"{stub.max_in_flight} requests at once with {workers} workers")
+        if not rate and workers > 1 and stub.max_in_flight < 2:
+            problems.append("the requests never ran in parallel")
+        if stub.connections > workers:
+            problems.append(f"{stub.connections} connections for {workers} workers, the pool isn't reused")
+        # the limiter spaces request starts 1/rate apart, allow for timer jitter
+        if rate and len(times) > 1 and (times[-1] - times[0]) < (len(times) - 1) / rate * 0.9:
+            problems.append(f"{report['requests_per_second']} requests per second with a limit of {rate}")
+        report["ok"] = not problems
+        return report
+    finally:
+        stub.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the bulk importer against a local stub OMDb.")
+    parser.add_argument("--titles", type=int, default=120, help="New titles in the import list (default 120).")
+    parser.add_argument("--workers", type=int, default=8, help="Parallel requests (default 8).")
+    parser.add_argument("--rate", type=float, default=50, help="Requests per second of the limited run (default 50).")
+    parser.add_argument("--delay", type=float, default=0.02, help="Seconds the stub takes per answer (default 0.02).")
+    args = parser.parse_args()
+
+    reports = [run(args.titles, args.workers, rate, args.delay) for rate in (0, args.rate)]
+    print(json.dumps(reports, indent=4))
+    sys.exit(0 if all(report["ok"] for report in reports) else 1)
+
+
+if __name__ == "__main__":
+    main()
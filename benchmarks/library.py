@@ -0,0 +1,107 @@
+"""
+Synthetic movie libraries for the benchmarks, shaped like the ones OMDb fills: string ratings and years
+(with "N/A" and series ranges like "2010–2015" mixed in), poster and IMDb urls, one to three countries
+and the odd note. The same count and seed always give the same library.
+Run from the repository root:  python -m benchmarks.library movies.json --count 100000
+"""
+import argparse
+import csv
+import json
+import os
+import random
+
+from data.storage_csv import FIELDNAMES
+
+WORDS = ["Silent", "Last", "Dark", "Golden", "Broken", "Hidden", "Lost", "Crimson", "Midnight", "Eternal",
+         "Wild", "Burning", "Frozen", "Electric", "Secret", "Final", "Savage", "Quiet", "Iron", "Paper",
+         "River", "City", "Night", "Empire", "Garden", "Storm", "Road", "Kingdom", "Heart", "Machine",
+         "Shadow", "Island", "Summer", "Ghost", "Horizon", "Harbor", "Mirror", "Station", "Planet", "Dream"]
+PATTERNS = ["The {0} {1}", "{0} {1}", "A {0} {1}", "{1} of the {0}", "The {1}", "{0} {1}s", "Return to {1}"]
+COUNTRIES = ["United States", "United Kingdom", "France", "Germany", "Japan", "Italy", "India", "Spain",
+             "Canada", "Australia", "South Korea", "Mexico", "Sweden", "Hong Kong", "Brazil", "Ireland"]
+# most movies are American, the rest is spread over the other countries
+COUNTRY_WEIGHTS = [30] + [4] * (len(COUNTRIES) - 1)
+NOTES = ["watch again", "seen in cinema", "recommended by a friend", "better than the book", "fell asleep"]
+
+
+def movie_titles(count, seed=0):
+    """
+    :return: (generator) count unique titles, sequels get a number ("The Dark River 2")
+    """
+    generator = random.Random(seed)
+    seen = set()
+    for _ in range(count):
+        base = generator.choice(PATTERNS).format(generator.choice(WORDS), generator.choice(WORDS))
+        title, number = base, 1
+        while title in seen:
+            number += 1
+            title = f"{base} {number}"
+        seen.add(title)
+        yield title
+
+
+def synthetic_movies(count, seed=0):
+    """
+    :return: (generator) count (title, details) tuples in the format the storages keep
+    """
+    generator = random.Random(seed + 1)
+    for number, title in enumerate(movie_titles(count, seed)):
+        rating = min(10.0, max(1.0, generator.gauss(6.5, 1.2)))
+        year = generator.randint(1920, 2024)
+        if generator.random() < 0.05:
+            year = f"{year}–{min(2024, year + generator.randint(1, 8))}"
+        countries = generator.choices(COUNTRIES, COUNTRY_WEIGHTS, k=generator.choice((1, 1, 1, 2, 3)))
+        yield title, {
+            "rating": "N/A" if generator.random() < 0.03 else f"{rating:.1f}",
+            "year": str(year),
+            "poster": "N/A" if generator.random() < 0.05 else
+            f"https://m.media-amazon.com/images/M/MV5B{generator.getrandbits(64):016x}@._V1_SX300.jpg",
+            "note": generator.choice(NOTES) if generator.random() < 0.1 else "",
+            "imdbID": f"https://www.imdb.com/title/tt{number + 1000000:07d}/",
+            "country": ", ".join(dict.fromkeys(countries)),
+        }
+
+
+def write_library(file_path, count, seed=0):
+    """
+    writes count synthetic movies as a .json, .csv, SQLite .db or .rfx snapshot file, the json, csv and
+    snapshot files are written one movie at a time so even a million movies don't have to fit in memory at once.
+    """
+    movies = synthetic_movies(count, seed)
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".json":
+        with open(file_path, "w") as library_file:
+            library_file.write("{")
+            for position, (title, details) in enumerate(movies):
+                library_file.write(("," if position else "") + f"\n    {json.dumps(title)}: {json.dumps(details)}")
+            library_file.write("\n}\n")
+    elif extension == ".csv":
+        with open(file_path, "w", newline="") as library_file:
+            writer = csv.DictWriter(library_file, fieldnames=FIELDNAMES)
+            writer.writeheader()
+            writer.writerows({"title": title, **details, "op": ""} for title, details in movies)
+    elif extension in (".db", ".sqlite", ".sqlite3"):
+        from data.storage_sqlite import StorageSQLite
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        storage = StorageSQLite(file_path)
+        storage.add_movies(dict(movies))
+    elif extension == ".rfx":
+        from data.snapshot import write_snapshot
+        with open(file_path, "wb") as library_file:
+            write_snapshot(library_file, movies)
+    else:
+        raise ValueError(f"Can't write a library as {extension!r}, use .json, .csv, .db or .rfx")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic movie library.")
+    parser.add_argument("file_path", help="Library to write (.json, .csv, .db or .rfx).")
+    parser.add_argument("--count", type=int, default=1000, help="Number of movies (default 1000).")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_library(args.file_path, args.count, args.seed)
+
+
+if __name__ == "__main__":
+    main()
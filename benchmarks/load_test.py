@@ -0,0 +1,153 @@
+"""
+Load test for the http api (server.py) on localhost.
+Run from the repository root:  python -m benchmarks.load_test [--movies N] [--concurrency C] [--duration S]
+Without --url a server is started on a temporary library of N synthetic movies (see benchmarks/library.py),
+the titles to request are read from the server first. Every client keeps
+one connection open and sends requests back to back, a --writes share of them are note updates.
+Prints requests/sec and the latency percentiles as json.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import quote, urlsplit
+
+from benchmarks.library import write_library
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def request_mix(titles, writes, generator):
+    """
+    :return: (tuple) method, path and body of a random request
+    """
+    title = quote(generator.choice(titles))
+    if generator.random() < writes:
+        return "PATCH", f"/movies/{title}", json.dumps({"note": f"seen {generator.random():.3f}"}).encode()
+    path = generator.choice([
+        f"/movies/{title}",
+        f"/search?q={quote(generator.choice(titles).lower()[:-1])}",
+        f"/filter?min_rating={generator.uniform(8, 9.9):.1f}&start_year={generator.randint(1990, 2020)}",
+        "/sort?by=rating&reverse=1&limit=20",
+        "/stats",
+    ])
+    return "GET", path, b""
+
+
+async def read_response(reader):
+    """
+    :return: (tuple) status code and body of one response
+    """
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.lower() == "content-length":
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def library_titles(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f"GET /movies?fields=rating HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+        await writer.drain()
+        _, body = await read_response(reader)
+        return [movie["title"] for movie in json.loads(body)]
+    finally:
+        writer.close()
+
+
+async def client(host, port, titles, writes, deadline, latencies, errors, seed):
+    generator = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            method, path, body = request_mix(titles, writes, generator)
+            start = time.perf_counter()
+            writer.write(f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Length: {len(body)}\r\n\r\n".encode()
+                         + body)
+            await writer.drain()
+            status, _ = await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+            if status >= 400:
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, concurrency, duration, writes):
+    titles = await library_titles(host, port)
+    latencies, errors = [], []
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(*(client(host, port, titles, writes, deadline, latencies, errors, seed)
+                           for seed in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(share):
+        return round(latencies[min(len(latencies) - 1, int(share * len(latencies)))] * 1000, 2)
+
+    return {"requests": len(latencies), "errors": len(errors), "seconds": round(elapsed, 2),
+            "requests_per_second": round(len(latencies) / elapsed, 1),
+            "mean_ms": round(statistics.fmean(latencies) * 1000, 2),
+            "p50_ms": percentile(0.50), "p99_ms": percentile(0.99)}
+
+
+def wait_for_port(host, port, timeout=30):
+    async def probe():
+        deadline = time.perf_counter() + timeout
+        while True:
+            try:
+                _, writer = await asyncio.open_connection(host, port)
+                writer.close()
+                return
+            except OSError:
+                if time.perf_counter() > deadline:
+                    raise
+                await asyncio.sleep(0.1)
+    asyncio.run(probe())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the movie http api.")
+    parser.add_argument("--url", help="Server to test, e.g. http://127.0.0.1:8000.")
+    parser.add_argument("--movies", type=int, default=10000, help="Size of the synthetic library (default 10000).")
+    parser.add_argument("--concurrency", type=int, default=32, help="Number of connections (default 32).")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds to run (default 10).")
+    parser.add_argument("--writes", type=float, default=0.05, help="Share of note updates (default 0.05).")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the started server (default 8765).")
+    args = parser.parse_args()
+
+    server = None
+    if args.url:
+        address = urlsplit(args.url)
+        host, port = address.hostname, address.port or 80
+    else:
+        host, port = "127.0.0.1", args.port
+        library = os.path.join(tempfile.mkdtemp(), "movies.json")
+        write_library(library, args.movies)
+        server = subprocess.Popen([sys.executable, "main.py", library, "--journal", "serve", "--port", str(port)],
+                                  cwd=ROOT, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_port(host, port)
+        report = asyncio.run(run_load(host, port, args.concurrency, args.duration, args.writes))
+        print(json.dumps(report, indent=4))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Checks the poster mirror against a local stub poster host (see stub_server.py), no network needed.
+Run from the repository root:  python -m benchmarks.poster_mirror_check [--posters 30] [--workers 6]
+Four runs of PosterMirror over the same posters:
+1. every poster is new: downloaded and resized, posters answering 503 once are retried, posters that are down
+   (500) are retried and then reported as failed;
+2. a rebuild: the mirrored posters aren't asked for at all, only the ones that are down are tried again;
+3. a refresh where nothing changed: every poster is answered with 304 Not Modified and nothing is resized again;
+4. a refresh (with max_age 0 instead of the flag) after one poster changed and one host went down:
+   only the changed one is downloaded again, the one that is down keeps its thumbnail from the earlier run.
+Every run has to reuse its pooled connections. Prints a json report per run and exits with 1 if anything went wrong.
+"""
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from benchmarks.stub_server import StubServer, poster_responder
+from posters import PosterMirror
+
+FLAKY = 4
+DOWN = 2
+RETRIES = 2
+
+
+def poster_image(number, size=(400, 600)):
+    """
+    :return: (bytes) a png with a colour of its own, so every poster has different content
+    """
+    from PIL import Image
+    image = Image.new("RGB", size, ((number * 37) % 256, (number * 91) % 256, (number * 53) % 256))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def mirror_run(stub, urls, work_dir, workers, refresh=False, max_age=None):
+    """
+    mirrors the urls with a new PosterMirror (like a new run of the website build) and counts the stub's answers.
+    """
+    responder = stub.respond
+    answered = len(responder.statuses)
+    connections = stub.connections
+    mirror = PosterMirror(cache_dir=os.path.join(work_dir, "cache"), site_dir=os.path.join(work_dir, "site"),
+                          max_workers=workers, processes=2, retries=RETRIES, backoff=0.05, max_age=max_age)
+    thumbnails = mirror.mirror(urls, refresh=refresh)
+    statuses = {}
+    for _, status in responder.statuses[answered:]:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    missing = [url for url, thumb in thumbnails.items() if not os.path.isfile(os.path.join(work_dir, "site", thumb))]
+    return {**mirror.report, "thumbnails": len(thumbnails), "missing_files": len(missing),
+            "statuses": statuses, "connections": stub.connections - connections}, thumbnails
+
+
+def check(report, expected, workers):
+    problems = [f"{name} {report.get(name)} instead of {value}" for name, value in expected.items()
+                if report.get(name) != value]
+    if report["missing_files"]:
+        problems.append(f"{report['missing_files']} thumbnails point to missing files")
+    if report["connections"] > workers:
+        problems.append(f"{report['connections']} connections for {workers} workers, the pool isn't reused")
+    report["problems"] = problems
+    report["ok"] = not problems
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the poster mirror against a local stub poster host.")
+    parser.add_argument("--posters", type=int, default=30, help="Posters that are always up (default 30).")
+    parser.add_argument("--workers", type=int, default=6, help="Parallel downloads (default 6).")
+    args = parser.parse_args()
+
+    count = args.posters
+    images = {f"/posters/{number}.png": poster_image(number) for number in range(count + FLAKY + DOWN)}
+    paths = list(images)
+    flaky = paths[count:count + FLAKY]
+    down = set(paths[count + FLAKY:])
+    stub = StubServer(poster_responder(images, flaky=flaky, down=down)).start()
+    work_dir = tempfile.mkdtemp(prefix="rateflix-posters-")
+    try:
+        urls = [stub.url + path for path in paths]
+        mirrored = count + FLAKY
+        reports = []
+
+        first, _ = mirror_run(stub, urls, work_dir, args.workers)
+        reports.append(check(first, {"downloaded": mirrored, "resized": mirrored, "failed": DOWN,
+                                     "thumbnails": mirrored,
+                                     "statuses": {"200": mirrored, "503": FLAKY, "500": DOWN * (RETRIES + 1)}},
+                             args.workers))
+
+        rebuild, _ = mirror_run(stub, urls, work_dir, args.workers)
+        reports.append(check(rebuild, {"downloaded": 0, "unchanged": 0, "not_checked": mirrored, "resized": 0,
+                                       "failed": DOWN, "thumbnails": mirrored,
+                                       "statuses": {"500": DOWN * (RETRIES + 1)}},
+                             args.workers))
+
+        refresh, _ = mirror_run(stub, urls, work_dir, args.workers, refresh=True)
+        reports.append(check(refresh, {"downloaded": 0, "unchanged": mirrored, "not_checked": 0, "resized": 0,
+                                       "failed": DOWN, "thumbnails": mirrored,
+                                       "statuses": {"304": mirrored, "500": DOWN * (RETRIES + 1)}},
+                             args.workers))
+
+        images[paths[0]] = poster_image(count + 100)
+        down.add(paths[1])
+        changed, thumbnails = mirror_run(stub, urls, work_dir, args.workers, max_age=0)
+        reports.append(check(changed, {"downloaded": 1, "unchanged": mirrored - 2, "resized": 1,
+                                       "failed": DOWN + 1, "thumbnails": mirrored},
+                             args.workers))
+        if urls[1] not in thumbnails:
+            changed["problems"].append("the poster that went down lost its thumbnail")
+            changed["ok"] = False
+
+        print(json.dumps(reports, indent=4))
+        sys.exit(0 if all(report["ok"] for report in reports) else 1)
+    finally:
+        stub.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
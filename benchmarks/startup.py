@@ -0,0 +1,74 @@
+"""
+Checks the app's start up against a time budget.
+Run from the repository root:  python benchmarks/startup.py [--budget MS] [--runs N]
+Exits with 1 if importing main takes longer than the budget, pulls in one of the heavy libraries
+that should only be imported by the features using them, or leaves files or folders (e.g. logs/)
+in the working directory it was imported from.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("matplotlib", "numpy", "pycountry", "fuzzywuzzy", "Levenshtein", "requests", "dotenv", "PIL")
+
+
+def import_time(module="main"):
+    """
+    :return: (float) milliseconds python -X importtime reports for importing the module, cumulative
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        parts = line.split("|")
+        if len(parts) == 3 and parts[2].strip() == module:
+            return int(parts[1]) / 1000
+    raise RuntimeError(f"{module} not found in the importtime output")
+
+
+def eager_heavy_modules(module="main"):
+    """
+    :return: (list) the heavy modules that are loaded by just importing the module
+    """
+    code = f"import sys, json, {module}; print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def import_leftovers(module="main"):
+    """
+    imports the module from an empty working directory, the way a subcommand is run from anywhere.
+    :return: (list) the files and folders the import left in that directory
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        environment = {**os.environ, "PYTHONPATH": ROOT}
+        subprocess.run([sys.executable, "-c", f"import {module}"], cwd=work_dir, env=environment,
+                       capture_output=True, check=True)
+        return sorted(os.listdir(work_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the start up time of the movie app.")
+    parser.add_argument("--budget", type=float, default=250, help="Maximum median import time in ms (default 250).")
+    parser.add_argument("--runs", type=int, default=5, help="Number of measured imports (default 5).")
+    args = parser.parse_args()
+
+    times = [import_time() for _ in range(args.runs)]
+    median = statistics.median(times)
+    heavy = eager_heavy_modules()
+    leftovers = import_leftovers()
+    print(f"import main: median {median:.1f} ms over {args.runs} runs (budget {args.budget:.0f} ms)")
+    if heavy:
+        print(f"imported at start up: {', '.join(heavy)}")
+    if leftovers:
+        print(f"left in the working directory by the import: {', '.join(leftovers)}")
+    sys.exit(0 if median <= args.budget and not heavy and not leftovers else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Stress test for the file storages' locking: many processes write to one library at the same time
+while others keep reading it.
+Run from the repository root:  python -m benchmarks.stress_locking [--backends json journal csv snapshot] [--writers 8]
+Every writer adds its own movies, notes some of them and deletes some again, and adds batches of movies
+with add_movies (the bulk import's path) now and then, half of the writers use a cached storage. Readers check that every read returns the whole library (the movies nobody touches are
+always there). At the end every write must be in the file: no lost, resurrected or wrongly noted movies.
+Prints a json report per backend and exits with 1 if anything went wrong.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.library import movie_titles, write_library
+
+BASE_MOVIES = 200
+# every BATCH_EVERY steps a writer adds BATCH_SIZE movies in one add_movies call
+BATCH_EVERY = 10
+BATCH_SIZE = 3
+EXTENSIONS = {"csv": ".csv", "snapshot": ".rfx"}
+
+
+def open_storage(backend, file_path, cached):
+    if backend == "csv":
+        from data.storage_csv import StorageCSV
+        return StorageCSV(file_path, cached=cached)
+    if backend == "snapshot":
+        from data.storage_snapshot import StorageSnapshot
+        return StorageSnapshot(file_path)
+    from data.storage_json import StorageJson
+    # a small threshold so the journal is folded into the json file now and then while the others read
+    return StorageJson(file_path, cached=cached, journaled=backend == "journal", compact_threshold=16 * 1024)
+
+
+def batch_titles(number, step):
+    return [f"Stress batch {number}-{step}-{index}" for index in range(BATCH_SIZE)]
+
+
+def writer(backend, file_path, number, operations, results):
+    storage = open_storage(backend, file_path, cached=number % 2 == 0)
+    errors = []
+    for step in range(operations):
+        title = f"Stress {number}-{step}"
+        try:
+            storage.add_movie(title, "7.0", "2001", "N/A", f"tt{number:03d}{step:05d}", "France")
+            if step % 3 == 0:
+                storage.update_movie(title, f"note {number}-{step}")
+            if step % 5 == 0:
+                storage.delete_movie(title)
+            if step % BATCH_EVERY == 0:
+                storage.add_movies({batch_title: {"rating": "6.0", "year": "1999", "poster": "N/A", "note": "",
+                                                  "imdbID": f"tt9{number:02d}{step:05d}{index}", "country": "Italy"}
+                                    for index, batch_title in enumerate(batch_titles(number, step))})
+        except Exception as e:
+            errors.append(f"{title}: {type(e).__name__}: {e}")
+    results.put(("writer", number, errors))
+
+
+def reader(backend, file_path, number, base_titles, done, results):
+    storage = open_storage(backend, file_path, cached=number % 2 == 0)
+    reads, errors = 0, []
+    while not done.is_set():
+        try:
+            movies = storage.list_movies()
+            streamed = set(title for title, _ in storage.iter_movies(fields=("note",)))
+            missing = base_titles - movies.keys() or base_titles - streamed
+            if missing:
+                errors.append(f"read {reads}: {len(missing)} untouched movies missing")
+        except Exception as e:
+            errors.append(f"read {reads}: {type(e).__name__}: {e}")
+        reads += 1
+    results.put(("reader", reads, errors))
+
+
+def expected_library(writers, operations):
+    """
+    :return: (dict) title: note of every movie the writers leave in the library
+    """
+    expected = {}
+    for number in range(writers):
+        for step in range(operations):
+            if step % 5 != 0:
+                expected[f"Stress {number}-{step}"] = f"note {number}-{step}" if step % 3 == 0 else ""
+            if step % BATCH_EVERY == 0:
+                expected.update(dict.fromkeys(batch_titles(number, step), ""))
+    return expected
+
+
+def stress(backend, writers, readers, operations):
+    work_dir = tempfile.mkdtemp(prefix="rateflix-stress-")
+    try:
+        file_path = os.path.join(work_dir, "movies" + EXTENSIONS.get(backend, ".json"))
+        write_library(file_path, BASE_MOVIES)
+        base_titles = set(movie_titles(BASE_MOVIES))
+
+        results = multiprocessing.Queue()
+        done = multiprocessing.Event()
+        reader_processes = [multiprocessing.Process(target=reader, args=(backend, file_path, number, base_titles,
+                                                                         done, results))
+                            for number in range(readers)]
+        writer_processes = [multiprocessing.Process(target=writer, args=(backend, file_path, number, operations,
+                                                                         results))
+                            for number in range(writers)]
+        start = time.perf_counter()
+        for process in reader_processes + writer_processes:
+            process.start()
+        # the queue has to be drained before joining, a process with queued items doesn't exit
+        reports = [results.get() for _ in writer_processes]
+        elapsed = time.perf_counter() - start
+        done.set()
+        reports += [results.get() for _ in reader_processes]
+        for process in reader_processes + writer_processes:
+            process.join()
+
+        movies = open_storage(backend, file_path, cached=False).list_movies()
+        expected = expected_library(writers, operations)
+        stress_titles = {title for title in movies if title.startswith("Stress ")}
+        report = {
+            "backend": backend, "writers": writers, "readers": readers, "operations_per_writer": operations,
+            "seconds": round(elapsed, 2),
+            "writes_per_second": round(sum(1 + (step % 3 == 0) + (step % 5 == 0) + (step % BATCH_EVERY == 0)
+                                           for step in range(operations))
+                                       * writers / elapsed, 1),
+            "reads": sum(count for kind, count, _ in reports if kind == "reader"),
+            "errors": [error for _, _, errors in reports for error in errors][:20],
+            "lost": len(expected.keys() - stress_titles),
+            "resurrected": len(stress_titles - expected.keys()),
+            "wrong_notes": sum(1 for title, note in expected.items()
+                               if title in movies and movies[title].get("note", "") != note),
+            "untouched_missing": len(base_titles - movies.keys()),
+        }
+        report["ok"] = not (report["errors"] or report["lost"] or report["resurrected"] or report["wrong_notes"]
+                            or report["untouched_missing"])
+        return report
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hammer one library file from many processes.")
+    parser.add_argument("--backends", nargs="+", choices=("json", "journal", "csv", "snapshot"),
+                        default=["json", "journal", "csv", "snapshot"])
+    parser.add_argument("--writers", type=int, default=8, help="Writing processes (default 8).")
+    parser.add_argument("--readers", type=int, default=4, help="Reading processes (default 4).")
+    parser.add_argument("--operations", type=int, default=100, help="Movies added per writer (default 100).")
+    args = parser.parse_args()
+
+    reports = [stress(backend, args.writers, args.readers, args.operations) for backend in args.backends]
+    print(json.dumps(reports, indent=4))
+    sys.exit(0 if all(report["ok"] for report in reports) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Local stand-ins for the web services the app talks to (OMDb, poster hosts), used by the checks in benchmarks/
+so they run without network access or an API key.
+"""
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+class StubServer:
+    """
+    Threaded http server on a free local port. Every request is answered by respond(path, query, headers),
+    which returns (status, headers, body). The server keeps count of the requests, the connections they
+    came in on (so a check can tell if connections were reused) and the most requests served at once.
+    Methods:
+        __init__(respond, delay):
+            initialise the server, delay is slept before each answer to make concurrency visible.
+        start() / stop():
+            serve in a background thread / shut down.
+        url:
+            the server's base url, e.g. "http://127.0.0.1:8123".
+    """
+    def __init__(self, respond, delay=0.0):
+        self.respond = respond
+        self.delay = delay
+        self.requests = 0
+        self.request_times = []
+        self.connections = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # keep-alive, so a client with a connection pool sends many requests over one connection
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub._lock:
+                    stub.connections += 1
+
+            def do_GET(self):
+                with stub._lock:
+                    stub.requests += 1
+                    stub.request_times.append(time.monotonic())
+                    stub._in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub._in_flight)
+                try:
+                    time.sleep(stub.delay)
+                    parts = urlsplit(self.path)
+                    status, headers, body = stub.respond(parts.path, parse_qs(parts.query), self.headers)
+                finally:
+                    with stub._lock:
+                        stub._in_flight -= 1
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *arguments):
+                pass
+
+        return Handler
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def omdb_responder(movies, failures=None):
+    """
+    answers OMDb's ?t=<title> and ?i=<imdbID> lookups.
+    :param movies: (list) OMDb answers ({"Title", "imdbID", "Year", ...}), found by case insensitive title or ID
+    :param failures: (dict) title or ID: http status to answer with instead, e.g. 500
+    :return: (function) respond(path, query, headers) for a StubServer
+    """
+    by_key = {}
+    for movie in movies:
+        by_key[("t", movie["Title"].casefold())] = movie
+        by_key[("i", movie["imdbID"])] = movie
+    failures = failures or {}
+
+    def respond(path, query, headers):
+        kind = "t" if "t" in query else "i"
+        value = query.get(kind, [""])[0]
+        if value in failures:
+            return failures[value], {}, b"{}"
+        movie = by_key.get((kind, value.casefold() if kind == "t" else value))
+        answer = {**movie, "Response": "True"} if movie else {"Response": "False", "Error": "Movie not found!"}
+        return 200, {"Content-Type": "application/json"}, json.dumps(answer).encode()
+
+    return respond
+
+
+def omdb_movie(number, title=None):
+    """
+    :return: (dict) an OMDb answer for a made up movie
+    """
+    return {"Title": title or f"Stub Movie {number}", "imdbID": f"tt{7000000 + number}",
+            "Year": str(1950 + number % 70), "imdbRating": f"{5 + number % 50 / 10:.1f}", "Poster": "N/A",
+            "Country": "France, Italy"}
+
+
+def poster_responder(images, flaky=(), down=()):
+    """
+    serves poster images with an ETag and answers 304 Not Modified when the client already has them.
+    :param images: (dict) path: image bytes, can be changed while the server runs
+    :param flaky: (iterable) paths answering 503 to their first request, to exercise retries
+    :param down: (set) paths always answering 500, can be changed while the server runs
+    :return: (function) respond(path, query, headers) for a StubServer, with a "statuses" list of what it answered
+    """
+    failed_once = set()
+    flaky = set(flaky)
+
+    def respond(path, query, headers):
+        if path in down or path not in images:
+            status, body, extra = (500 if path in down else 404), b"", {}
+        elif path in flaky and path not in failed_once:
+            failed_once.add(path)
+            status, body, extra = 503, b"", {}
+        else:
+            etag = '"' + hashlib.sha1(images[path]).hexdigest()[:16] + '"'
+            if headers.get("If-None-Match") == etag:
+                status, body, extra = 304, b"", {"ETag": etag}
+            else:
+                status, body, extra = 200, images[path], {"ETag": etag, "Content-Type": "image/png"}
+        respond.statuses.append((path, status))
+        return status, extra, body
+
+    respond.statuses = []
+    return respond
@@ -0,0 +1,264 @@
+"""
+Times every storage operation and the app's read paths on synthetic libraries (see benchmarks/library.py).
+Run from the repository root:
+    python -m benchmarks.suite --sizes 1000 100000 1000000 --backends json csv --output results.json
+    python -m benchmarks.suite --sizes 1000 100000 --compare results.json
+The menu actions run with input() answered from a script and their output thrown away, the website is
+generated without downloading posters. The results are written as json (the commit, and per backend,
+size and operation the min and median seconds), --compare prints how they changed against an earlier
+results file and exits with 1 if an operation got slower than --threshold times its old median.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+from contextlib import redirect_stdout
+from unittest import mock
+
+from benchmarks.library import movie_titles, write_library
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXTENSIONS = {"json": ".json", "csv": ".csv", "sqlite": ".db", "snapshot": ".rfx"}
+
+
+def consume(iterable):
+    deque(iterable, maxlen=0)
+
+
+def timed(function, repeat):
+    """
+    :return: (list) seconds of every run of the function
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def open_storage(backend, file_path, cached=False):
+    if backend == "json":
+        from data.storage_json import StorageJson
+        return StorageJson(file_path, cached=cached)
+    if backend == "csv":
+        from data.storage_csv import StorageCSV
+        return StorageCSV(file_path, cached=cached)
+    if backend == "snapshot":
+        from data.storage_snapshot import StorageSnapshot
+        return StorageSnapshot(file_path)
+    from data.storage_sqlite import StorageSQLite
+    return StorageSQLite(file_path)
+
+
+def load_benchmarks(backend, file_path, cached, sample, repeat):
+    """
+    times opening the library with a new storage object, as the app does when it starts.
+    :return: (dict) operation name to the seconds of its runs
+    """
+    return {
+        "load": timed(lambda: len(open_storage(backend, file_path, cached).list_movies()), repeat),
+        "load+lookup": timed(lambda: open_storage(backend, file_path, cached).list_movies()[sample], repeat),
+        "load+stats": timed(lambda: open_storage(backend, file_path, cached).columns().stats(), repeat),
+    }
+
+
+def storage_benchmarks(storage, sample, repeat):
+    """
+    :param sample: (str) a title in the library
+    :return: (dict) operation name to the seconds of its runs
+    """
+    results = {
+        "list_movies": timed(storage.list_movies, repeat),
+        "iter_movies": timed(lambda: consume(storage.iter_movies()), repeat),
+        "iter_movies(rating,year)": timed(lambda: consume(storage.iter_movies(fields=("rating", "year"))), repeat),
+        "columns": timed(storage.columns, repeat),
+        "query_movies(rating,year)": timed(lambda: storage.query_movies(min_rating=8, start_year=2000), repeat),
+        "query_movies(title_prefix)": timed(lambda: storage.query_movies(title_prefix=sample[:6]), repeat),
+        "sorted_movies(rating,limit=100)": timed(
+            lambda: consume(storage.sorted_movies("rating", reverse=True, limit=100)), repeat),
+        "sorted_movies(year)": timed(lambda: consume(storage.sorted_movies("year")), repeat),
+    }
+
+    # every run adds a new movie, notes and deletes it again, so the library ends up as it started
+    for name in ("add_movie", "update_movie", "delete_movie"):
+        results[name] = []
+    for run in range(repeat):
+        title = f"Benchmark Movie {run}"
+        for name, arguments in (("add_movie", (title, "7.0", "2001", "N/A", "tt0000000", "France")),
+                                ("update_movie", (title, "benchmark note")),
+                                ("delete_movie", (title,))):
+            results[name] += timed(lambda: getattr(storage, name)(*arguments), 1)
+
+    batches = iter(range(repeat))
+
+    def add_batch():
+        batch = next(batches)
+        storage.add_movies({f"Benchmark Batch {batch}-{number}": {"rating": "6.0", "year": "1999", "poster": "N/A",
+                                                                  "note": "", "imdbID": "tt0000000", "country": "Japan"}
+                            for number in range(100)})
+    results["add_movies(100)"] = timed(add_batch, repeat)
+    return results
+
+
+def run_menu_action(app, action, answers):
+    """
+    runs one menu action with input() answered from answers (then empty lines) and its output discarded.
+    """
+    replies = iter(answers)
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull), \
+            mock.patch("builtins.input", lambda prompt="": next(replies, "")):
+        getattr(app, action)()
+
+
+def app_benchmarks(storage, sample, repeat):
+    """
+    :return: (dict) menu action (with the scripted answers in brackets) to the seconds of its runs
+    """
+    from movie_app import MovieApp
+
+    app = MovieApp(storage)
+    typo = sample.lower()[:-1]
+    actions = [
+        ("stats", []),
+        ("list_movies", []),
+        ("search_movie", [sample]),
+        ("search_movie", [typo]),
+        ("filter_movies", ["8", "2000", ""]),
+        ("movies_sorted_by_rating", []),
+        ("movies_sorted_by_chronological_order", ["Y"]),
+        ("create_histogram_and_save", ["1", "benchmark"]),
+    ]
+    results = {}
+    # no posters are downloaded and the pause after the website is skipped
+    with mock.patch("movie_app.time.sleep"), mock.patch("posters.PosterMirror.mirror", return_value={}):
+        for action, answers in actions:
+            name = f"app.{action}({', '.join(answers)})" if answers else f"app.{action}"
+            results[name] = timed(lambda: run_menu_action(app, action, answers), repeat)
+        results["app.generate_website(first)"] = timed(lambda: run_menu_action(app, "generate_website", []), 1)
+        results["app.generate_website(unchanged)"] = timed(
+            lambda: run_menu_action(app, "generate_website", []), repeat)
+    return results
+
+
+def library_file(data_dir, backend, size, seed):
+    """
+    :return: (str) the generated library, written the first time and then reused
+    """
+    file_path = os.path.join(data_dir, f"movies-{size}-{seed}{EXTENSIONS[backend]}")
+    if not os.path.exists(file_path):
+        os.makedirs(data_dir, exist_ok=True)
+        write_library(file_path + ".tmp" + EXTENSIONS[backend], size, seed)
+        os.replace(file_path + ".tmp" + EXTENSIONS[backend], file_path)
+    return file_path
+
+
+def run_benchmarks(backends, sizes, repeat=3, cached=False, seed=0, data_dir=None, app=True):
+    """
+    runs the benchmarks on a copy of the library in a temporary directory, which is also the working
+    directory of the menu actions (their web/, histograms/ and storage/ folders end up there).
+    :return: (list) one result dictionary per backend, size and operation
+    """
+    data_dir = data_dir or os.path.join(tempfile.gettempdir(), "rateflix-benchmarks")
+    results = []
+    start_dir = os.getcwd()
+    for size in sizes:
+        titles = list(movie_titles(size, seed))
+        sample = titles[len(titles) // 2]
+        del titles
+        for backend in backends:
+            source = library_file(data_dir, backend, size, seed)
+            work_dir = tempfile.mkdtemp(prefix="rateflix-run-")
+            try:
+                file_path = os.path.join(work_dir, os.path.basename(source))
+                shutil.copyfile(source, file_path)
+                os.chdir(work_dir)
+                print(f"{backend} {size}: storage", file=sys.stderr)
+                timings = load_benchmarks(backend, file_path, cached, sample, repeat)
+                timings.update(storage_benchmarks(open_storage(backend, file_path, cached), sample, repeat))
+                if app:
+                    print(f"{backend} {size}: menu actions", file=sys.stderr)
+                    timings.update(app_benchmarks(open_storage(backend, file_path, cached), sample, repeat))
+            finally:
+                os.chdir(start_dir)
+                shutil.rmtree(work_dir, ignore_errors=True)
+            for operation, times in timings.items():
+                results.append({"backend": backend, "size": size, "cached": cached, "operation": operation,
+                                "runs": len(times), "min_s": round(min(times), 6),
+                                "median_s": round(statistics.median(times), 6)})
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old_report, new_report, threshold=1.25):
+    """
+    prints the change of every operation both reports timed.
+    :return: (list) the operations whose median got slower than threshold times the old median
+    """
+    def key(result):
+        return result["backend"], result["size"], result["cached"], result["operation"]
+
+    old = {key(result): result["median_s"] for result in old_report["results"]}
+    regressions = []
+    print(f"{'operation':<60} {'old s':>10} {'new s':>10} {'ratio':>7}")
+    for result in new_report["results"]:
+        if key(result) not in old:
+            continue
+        before, after = old[key(result)], result["median_s"]
+        ratio = after / before if before else float("inf")
+        name = f"{result['backend']} {result['size']} {result['operation']}"
+        slower = ratio > threshold
+        print(f"{name:<60} {before:>10.4f} {after:>10.4f} {ratio:>6.2f}x{'  SLOWER' if slower else ''}")
+        if slower:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the storages and the menu's read paths.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000],
+                        help="Library sizes (default 1000 100000 1000000).")
+    parser.add_argument("--backends", nargs="+", choices=tuple(EXTENSIONS), default=["json", "csv"])
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per operation (default 3).")
+    parser.add_argument("--cached", action="store_true", help="Benchmark the cached json/csv storages.")
+    parser.add_argument("--storage-only", action="store_true", help="Skip the menu actions.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", help="Where the generated libraries are kept between runs.")
+    parser.add_argument("--output", help="Write the json results to this file instead of printing them.")
+    parser.add_argument("--compare", metavar="RESULTS", help="Earlier results file to compare against.")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Slow down factor counted as a regression by --compare (default 1.25).")
+    args = parser.parse_args()
+
+    report = {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform(),
+              "seed": args.seed, "repeat": args.repeat,
+              "results": run_benchmarks(args.backends, args.sizes, args.repeat, args.cached, args.seed,
+                                        args.data_dir, app=not args.storage_only)}
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(report, output_file, indent=4)
+    elif not args.compare:
+        print(json.dumps(report, indent=4))
+
+    if args.compare:
+        with open(args.compare) as old_file:
+            regressions = compare(json.load(old_file), report, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import csv
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from data.identity_index import DuplicateMovieError, check_new_movie, find_existing
+from data.storage_memory import StorageMemory
+from omdb import OMDB_URL, fetch_movie, search_type_for
+
+
+def read_titles(file_path):
+    """
+    reads the titles/IMDb IDs to import from a file.
+    .csv files use the "imdbID" or "title" column (or the first column if there is neither),
+    any other file is read as one title per line, blank lines and lines starting with # are skipped.
+    :param file_path: (str) path of the file
+    :return: (list) titles and IMDb IDs in file order
+    """
+    with open(file_path, mode="r", newline="", encoding="utf-8") as title_file:
+        if file_path.lower().endswith(".csv"):
+            reader = csv.reader(title_file)
+            header = next(reader, [])
+            if "imdbID" in header:
+                column = header.index("imdbID")
+            elif "title" in header:
+                column = header.index("title")
+            else:
+                # no known header so the first line is a title as well
+                column = 0
+                reader = [header] + list(reader)
+            entries = [row[column] for row in reader if len(row) > column]
+        else:
+            entries = [line for line in title_file if not line.lstrip().startswith("#")]
+    return [entry.strip() for entry in entries if entry.strip()]
+
+
+class RateLimiter:
+    """
+    Spaces out calls across threads so no more than `rate` calls start per second.
+    Methods:
+        wait():
+            blocks until the caller is allowed to make the next call.
+    """
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class BulkImporter:
+    """
+    Fetches many movies from OMDb at the same time and adds them to the storage in one go.
+    Methods:
+        __init__(storage, api_key, url, max_workers, rate_limit, cache):
+            initialise the importer, max_workers caps the parallel requests and
+            rate_limit the requests started per second (0 for no limit).
+            titles found in the optional ResponseCache don't call OMDb at all.
+        import_titles(titles):
+            looks up every title/IMDb ID, adds the found movies with a single storage write
+            and returns a report of what was added, skipped and failed.
+        import_file(file_path):
+            reads the titles with read_titles() and imports them.
+    """
+    def __init__(self, storage, api_key, url=OMDB_URL, max_workers=8, rate_limit=5.0, cache=None):
+        self._storage = storage
+        self._cache = cache
+        self.api_key = api_key
+        self.url = url
+        self.max_workers = max_workers
+        self._limiter = RateLimiter(rate_limit)
+        # one connection pool big enough for every worker thread
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def _fetch(self, query):
+        # the limiter only runs before real requests, cached answers don't touch OMDb
+        return fetch_movie(query, self.api_key, self.url, search_type_for(query), session=self._session,
+                           cache=self._cache, before_request=self._limiter.wait)
+
+    def import_titles(self, titles):
+        """
+        :param titles: (list) titles and IMDb IDs
+        :return: (dict) "added": list of added titles,
+                        "skipped": list of entries already in the library,
+                        "failed": dict of entry: error message
+        """
+        # read once, the movies found are added to it so two entries for the same movie are caught as well
+        library = StorageMemory(self._storage.list_movies())
+        report = {"added": [], "skipped": [], "failed": {}}
+
+        to_fetch = []
+        for entry in dict.fromkeys(titles):
+            if find_existing(library.identity_index(), entry) is not None:
+                report["skipped"].append(entry)
+            else:
+                to_fetch.append(entry)
+
+        new_movies = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {entry: executor.submit(self._fetch, entry) for entry in to_fetch}
+            for entry, future in futures.items():
+                try:
+                    title, rating, year, poster, imdb_link, country = future.result()
+                except Exception as e:
+                    report["failed"][entry] = str(e)
+                    continue
+                try:
+                    title = check_new_movie(library.identity_index(), title, year, imdb_link)
+                except DuplicateMovieError:
+                    report["skipped"].append(entry)
+                    continue
+                new_movies[title] = {"rating": rating,
+                                     "year": year,
+                                     "poster": poster,
+                                     "imdbID": imdb_link,
+                                     "country": country,
+                                     }
+                library.add_movies({title: new_movies[title]})
+                report["added"].append(title)
+
+        if new_movies:
+            self._storage.add_movies(new_movies)
+        return report
+
+    def import_file(self, file_path):
+        return self.import_titles(read_titles(file_path))
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from os.path import join
+
+from data.fields import split_countries
+
+# bump when the look of the charts changes so the cached pngs are drawn again
+CHART_VERSION = 1
+CHARTS = ("ratings", "decades", "countries")
+CACHE_DIR = join("storage", "charts")
+# cached pngs kept per chart, older ones are deleted
+KEEP_PER_CHART = 8
+
+
+def chart_data(storage, chart="ratings", bins=5, top=15):
+    """
+    bins the library for a chart, this is the only part that reads the movies.
+    :param chart: (str) "ratings" histogram, movies per "decades" or per "countries"
+    :param bins: (int) number of rating bins
+    :param top: (int) number of countries shown, the ones with the most movies
+    :return: (dict) the chart's "title", axis labels and "counts" with either the bin "edges" or the bar "labels"
+    """
+    if chart == "ratings":
+        counts, edges = storage.columns().histogram(bins=bins)
+        return {"chart": chart, "title": "Movie Ratings Histogram", "xlabel": "Rating", "ylabel": "Number of Movies",
+                "counts": counts.tolist(), "edges": edges.tolist()}
+    if chart == "decades":
+        decades, counts = storage.columns().decade_counts()
+        return {"chart": chart, "title": "Movies per Decade", "xlabel": "Decade", "ylabel": "Number of Movies",
+                "counts": counts.tolist(), "labels": [f"{decade}s" for decade in decades.tolist()]}
+    if chart == "countries":
+        countries = Counter()
+        for _, details in storage.iter_movies(fields=["country"]):
+            countries.update(split_countries(details.get("country")))
+        # most movies first, ties by name so the same library always gives the same chart
+        ranked = sorted(countries.items(), key=lambda item: (-item[1], item[0]))[:top]
+        return {"chart": chart, "title": "Movies per Country", "xlabel": "Country", "ylabel": "Number of Movies",
+                "counts": [count for _, count in ranked], "labels": [name for name, _ in ranked]}
+    raise ValueError(f"Unknown chart {chart!r}, use one of {', '.join(CHARTS)}")
+
+
+def chart_key(data):
+    """
+    :return: (str) hash of the binned data, the same bins always give the same png
+    """
+    text = json.dumps([CHART_VERSION, data], sort_keys=True)
+    return hashlib.blake2b(text.encode(), digest_size=10).hexdigest()
+
+
+def render_chart(data, file_path):
+    """
+    draws the binned data into a png with the Agg backend and its own Figure, so nothing goes through
+    pyplot's global state: no window is opened and the figure is freed once it is written.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(8, 5))
+    FigureCanvasAgg(figure)
+    axes = figure.add_subplot()
+    if "edges" in data:
+        axes.stairs(data["counts"], data["edges"], fill=True, color='blue', edgecolor='black')
+    else:
+        axes.bar(data["labels"], data["counts"], color='blue', edgecolor='black')
+        for label in axes.get_xticklabels():
+            label.set(rotation=45, horizontalalignment="right")
+    axes.set_title(data["title"])
+    axes.set_xlabel(data["xlabel"])
+    axes.set_ylabel(data["ylabel"])
+    figure.tight_layout()
+
+    temp_path = file_path + ".tmp"
+    figure.savefig(temp_path, format="png")
+    os.replace(temp_path, file_path)
+
+
+def _remove_old(cache_dir, chart):
+    cached = [entry for entry in os.scandir(cache_dir) if entry.name.startswith(chart + "-")]
+    cached.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in cached[KEEP_PER_CHART:]:
+        os.remove(entry.path)
+
+
+def save_chart(storage, chart="ratings", file_path=None, bins=5, top=15, cache_dir=CACHE_DIR):
+    """
+    saves a chart of the library as png. The rendered pngs are cached by the hash of the binned data,
+    if the library's bins didn't change the cached png is copied instead of drawing it again
+    (and matplotlib isn't even imported).
+    :param file_path: (str) where to save the png, None to only keep it in the cache
+    :return: (dict) the "path" of the png, whether it came from the "cached" pngs and the data's "key"
+    """
+    data = chart_data(storage, chart, bins, top)
+    key = chart_key(data)
+    cached_path = join(cache_dir, f"{chart}-{key}.png")
+    cached = os.path.exists(cached_path)
+    if not cached:
+        os.makedirs(cache_dir, exist_ok=True)
+        render_chart(data, cached_path)
+        _remove_old(cache_dir, chart)
+    else:
+        # keeps recently used charts from being removed as old ones
+        os.utime(cached_path)
+
+    if file_path is None:
+        return {"path": cached_path, "cached": cached, "key": key}
+    directory = os.path.dirname(file_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(cached_path, "rb") as source, open(file_path, "wb") as target:
+        target.write(source.read())
+    return {"path": file_path, "cached": cached, "key": key}
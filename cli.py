@@ -0,0 +1,411 @@
+import argparse
+import inspect
+import json
+import sys
+import threading
+
+from data.identity_index import DuplicateMovieError, check_new_movie, find_duplicates, find_existing
+from metrics import METRICS
+from omdb import OMDB_URL, OMDbError, ResponseCache, fetch_movie, search_type_for
+from search_index import TrigramIndex, rank_titles
+
+COMMANDS = ("list", "add", "delete", "note", "stats", "search", "filter", "sort", "site", "histogram", "chart",
+            "dedupe")
+# commands whose result is a list of movies, written as one json line per movie
+LISTING_COMMANDS = ("list", "search", "filter", "sort")
+
+
+# the types of the commands' arguments by name, batch lines are converted to them like the subcommands' arguments
+ARGUMENT_TYPES = {"title": str, "note": str, "query": str, "key": str, "country": str, "title_prefix": str,
+                  "chart": str, "output": str, "output_dir": str, "fields": list,
+                  "min_rating": float, "max_rating": float, "start_year": int, "end_year": int, "limit": int,
+                  "offset": int, "bins": int, "top": int, "page_size": int,
+                  "reverse": bool, "dry_run": bool, "posters": bool, "refresh_posters": bool}
+
+
+class CommandError(Exception):
+    """raised when a command can't be carried out, e.g. deleting a movie that isn't in the library"""
+    pass
+
+
+def convert_argument(name, value):
+    """
+    converts a batch argument to its type in ARGUMENT_TYPES: numbers may be given as text like on the command line,
+    fields as a list or comma separated text, text and flags have to be text and true/false.
+    :return: the converted value, None stays None
+    """
+    cast = ARGUMENT_TYPES.get(name)
+    if value is None or cast is None:
+        return value
+    if cast in (int, float) and not isinstance(value, bool) and isinstance(value, (int, float, str)):
+        try:
+            converted = cast(value)
+        except (ValueError, OverflowError):
+            converted = None
+        if converted is not None and (cast is float or converted == float(value)):
+            return converted
+    elif cast is list and isinstance(value, str):
+        return value.split(",")
+    elif cast is list and isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return value
+    elif cast in (str, bool) and isinstance(value, cast):
+        return value
+    raise CommandError(f"Invalid value for {name}: {value!r}")
+
+
+def movie_record(title, details):
+    return {"title": title, **details}
+
+
+class MovieCommands:
+    """
+    The app's features without any prompts, for scripts and cron jobs. Every command takes plain arguments
+    and returns json serialisable data, listings are generators so they can be written out while the
+    storage streams them. One MovieCommands can run any number of commands against the same (cached) storage.
+    Methods:
+        __init__(storage, api_key, url, omdb_cache):
+            initialise the commands with the storage, the OMDb key/url are only needed by add.
+        list(fields, limit, offset) / sort(key, reverse, limit, offset) / filter(...) / search(query, limit):
+            the movies as {"title": title, ...details} dictionaries.
+        match(query, limit):
+            the kind of search match and the matching movies, for the menu's own output.
+        add(title) / delete(title) / note(title, note):
+            change the library and return the changed movie.
+        stats() / histogram(bins) / site(output_dir, page_size, posters, refresh_posters):
+            the numbers behind the menu's stats and histogram, and the website build.
+        chart(chart, output, bins, top):
+            saves a chart png, see charts.py.
+        dedupe(dry_run):
+            removes the movies that are in the library more than once, see identity_index.find_duplicates.
+        run(command, **arguments):
+            runs a command by name with its arguments converted like the subcommands do, used for the batch mode.
+        track_change(title, signature_before):
+            keeps the search index in step with a change made straight to the storage.
+    """
+    def __init__(self, storage, api_key=None, url=OMDB_URL, omdb_cache=None):
+        self._storage = storage
+        self.api_key = api_key
+        self.url = url
+        self._omdb_cache = omdb_cache if omdb_cache is not None else ResponseCache()
+        self._search_index = None
+        # the server runs searches from several threads, the index is loaded and synced by one at a time
+        self._search_index_lock = threading.Lock()
+
+    def list(self, fields=None, limit=None, offset=0):
+        movies = self._storage.iter_movies(fields=fields)
+        for position, (title, details) in enumerate(movies):
+            if limit is not None and position >= offset + limit:
+                break
+            if position >= offset:
+                yield movie_record(title, details)
+
+    def sort(self, key="rating", reverse=False, limit=None, offset=0):
+        if key not in ("rating", "year"):
+            raise CommandError(f"Can't sort by {key!r}, use rating or year")
+        for title, details in self._storage.sorted_movies(key, reverse=reverse, limit=limit, offset=offset):
+            yield movie_record(title, details)
+
+    def filter(self, min_rating=None, max_rating=None, start_year=None, end_year=None, country=None,
+               title_prefix=None):
+        matches = self._storage.query_movies(min_rating=min_rating, max_rating=max_rating, start_year=start_year,
+                                             end_year=end_year, country=country, title_prefix=title_prefix)
+        for title, details in matches.items():
+            yield movie_record(title, details)
+
+    def _get_search_index(self, movies, signature=None):
+        with self._search_index_lock:
+            if self._search_index is None:
+                file_path = getattr(self._storage, "file_path", None)
+                self._search_index = TrigramIndex.load(file_path + ".trigrams") if file_path else TrigramIndex()
+            self._search_index.refresh(movies.keys(), signature)
+            return self._search_index
+
+    def match(self, query, limit=5):
+        """
+        the search behind search() and the menu: an exact title first, then fuzzy matches and then the closest
+        titles by Levenshtein distance, scored on the candidates of the trigram index instead of the whole library.
+        :return: (tuple) "exact", "fuzzy" or "distance" and a list of (title, details, score or distance)
+        """
+        # the signature is taken before reading, so a change made in between is caught by the next search
+        signature = self._storage.signature()
+        movies = self._storage.list_movies()
+        query = query.strip().lower()
+        search_index = self._get_search_index(movies, signature)
+        exact = search_index.exact(query)
+        if exact is not None and exact in movies:
+            return "exact", [(exact, movies[exact], 100)]
+        # on the whole library only if no title shares a trigram with the query
+        candidates = [title for title in search_index.candidates(query) if title in movies]
+        match_type, matches = rank_titles(query, candidates or list(movies), limit=limit)
+        return match_type, [(title, movies[title], value) for title, value in matches]
+
+    def search(self, query, limit=5):
+        """
+        :return: (generator) the exact match with a "score" of 100, or the best fuzzy matches with their "score",
+                 or the closest titles with their Levenshtein "distance"
+        """
+        match_type, matches = self.match(query, limit)
+        for title, details, value in matches:
+            yield {**movie_record(title, details), "distance" if match_type == "distance" else "score": value}
+
+    def add(self, title):
+        from requests.exceptions import RequestException
+
+        # read once for both checks, an uncached storage would read the library for every lookup
+        identity = self._storage.identity_index()
+        existing = find_existing(identity, title)
+        if existing is not None:
+            raise CommandError(f"{existing} is already in the library")
+        try:
+            with METRICS.timer("omdb_lookup"):
+                title, rating, year, poster, imdb_link, country = fetch_movie(
+                    title, self.api_key, self.url, search_type_for(title), cache=self._omdb_cache)
+        except (OMDbError, RequestException) as e:
+            raise CommandError(f"OMDb lookup failed: {e}")
+        try:
+            title = check_new_movie(identity, title, year, imdb_link)
+        except DuplicateMovieError as e:
+            raise CommandError(str(e))
+        self._storage.add_movie(title, rating, year, poster, imdb_link, country)
+        if self._search_index is not None:
+            self._search_index.add(title)
+        return movie_record(title, {"rating": rating, "year": year, "poster": poster, "note": "",
+                                    "imdbID": imdb_link, "country": country})
+
+    def delete(self, title):
+        movies = self._storage.list_movies()
+        if title not in movies:
+            raise CommandError(f"{title} is not in the library")
+        details = movies[title]
+        self._storage.delete_movie(title)
+        if self._search_index is not None:
+            self._search_index.remove(title)
+        return movie_record(title, details)
+
+    def note(self, title, note):
+        movies = self._storage.list_movies()
+        if title not in movies:
+            raise CommandError(f"{title} is not in the library")
+        self._storage.update_movie(title, note)
+        return movie_record(title, {**movies[title], "note": note})
+
+    def stats(self):
+        stats = self._storage.columns().stats()
+        return stats if stats is not None else {"count": 0}
+
+    def histogram(self, bins=5):
+        from data.columns import round_reported
+        counts, edges = self._storage.columns().histogram(bins=bins)
+        return {"counts": counts.tolist(), "edges": [round_reported(edge) for edge in edges]}
+
+    def chart(self, chart="ratings", output=None, bins=5, top=15):
+        from charts import save_chart
+        try:
+            return save_chart(self._storage, chart, output, bins=bins, top=top)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def dedupe(self, dry_run=False):
+        """
+        one-off migration for libraries from before duplicates were rejected: "inception" next to "Inception",
+        or the same IMDb ID under two titles. The first of them is kept and gets the note of a removed one
+        if it has none itself.
+        :param dry_run: (bool) only report what would be removed
+        :return: (dict) "removed": {removed title: kept title}, "notes_merged": kept titles that got a note
+        """
+        movies = self._storage.list_movies()
+        duplicates = find_duplicates(movies)
+        notes = {}
+        for title, kept in duplicates.items():
+            note = movies[title].get("note")
+            if note and not movies[kept].get("note") and kept not in notes:
+                notes[kept] = note
+        if not dry_run:
+            for title in duplicates:
+                self._storage.delete_movie(title)
+                if self._search_index is not None:
+                    self._search_index.remove(title)
+            for kept, note in notes.items():
+                self._storage.update_movie(kept, note)
+        return {"removed": duplicates, "notes_merged": list(notes), "dry_run": dry_run}
+
+    def site(self, output_dir="web", page_size=100, posters=True, refresh_posters=False):
+        from site_generator import build_site
+        return build_site(self._storage, output_dir=output_dir, page_size=page_size, mirror_posters=posters,
+                          refresh_posters=refresh_posters)
+
+    def track_change(self, title, signature_before):
+        """
+        updates the search index for a movie added, deleted or noted without these commands (the server's writer
+        changes its snapshot directly), so the next search doesn't have to sync the whole index.
+        :param title: (str) the changed movie
+        :param signature_before: the storage's signature() from before the change
+        """
+        if self._search_index is None:
+            return
+        if title in self._storage.list_movies():
+            self._search_index.add(title)
+        else:
+            self._search_index.remove(title)
+        # only up to date now if it was before the change, otherwise the next search syncs it
+        if self._search_index.signature == signature_before:
+            self._search_index.signature = self._storage.signature()
+
+    def run(self, command, **arguments):
+        """
+        :param command: (str) name of the command, e.g. "note"
+        :param arguments: the command's arguments by name
+        :return: the command's result, listings as a list
+        """
+        if command not in COMMANDS:
+            raise CommandError(f"Unknown command {command!r}")
+        method = getattr(self, command)
+        # only a call that doesn't fit the command is bad arguments, a TypeError inside it is a bug
+        try:
+            bound = inspect.signature(method).bind(**arguments)
+        except TypeError as e:
+            raise CommandError(f"Bad arguments for {command}: {e}")
+        for name, value in bound.arguments.items():
+            bound.arguments[name] = convert_argument(name, value)
+        result = method(*bound.args, **bound.kwargs)
+        return list(result) if command in LISTING_COMMANDS else result
+
+    def close(self):
+        if self._search_index is not None and self._search_index.dirty:
+            self._search_index.save()
+
+
+def add_subcommands(parser):
+    """
+    adds the subcommands to main.py's argument parser, without a subcommand the interactive menu runs.
+    """
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--format", choices=("ndjson", "json"), default="ndjson",
+                        help="Listings as one json object per line (default) or as a single json array.")
+    subparsers = parser.add_subparsers(dest="command", metavar="COMMAND",
+                                       help="Run one command and print the result as json instead of the menu.")
+
+    list_parser = subparsers.add_parser("list", parents=[output], help="List the movies.")
+    list_parser.add_argument("--fields", type=lambda text: text.split(","), help="Comma separated fields to show.")
+    list_parser.add_argument("--limit", type=int)
+    list_parser.add_argument("--offset", type=int, default=0)
+
+    add_parser = subparsers.add_parser("add", parents=[output], help="Look a title or IMDb ID up on OMDb and add it.")
+    add_parser.add_argument("title")
+    subparsers.add_parser("delete", parents=[output], help="Delete a movie.").add_argument("title")
+    note_parser = subparsers.add_parser("note", parents=[output], help="Set the note of a movie.")
+    note_parser.add_argument("title")
+    note_parser.add_argument("note")
+    subparsers.add_parser("stats", parents=[output], help="Average, median, best and worst rated movies.")
+
+    search_parser = subparsers.add_parser("search", parents=[output], help="Exact, fuzzy or closest matching titles.")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--limit", type=int, default=5)
+
+    filter_parser = subparsers.add_parser("filter", parents=[output],
+                                          help="Movies within a rating/year range, country or title prefix.")
+    filter_parser.add_argument("--min-rating", type=float)
+    filter_parser.add_argument("--max-rating", type=float)
+    filter_parser.add_argument("--start-year", type=int)
+    filter_parser.add_argument("--end-year", type=int)
+    filter_parser.add_argument("--country")
+    filter_parser.add_argument("--title-prefix")
+
+    sort_parser = subparsers.add_parser("sort", parents=[output], help="Movies sorted by rating or year.")
+    sort_parser.add_argument("--by", dest="key", choices=("rating", "year"), default="rating")
+    sort_parser.add_argument("--reverse", action="store_true", help="Highest/latest first.")
+    sort_parser.add_argument("--limit", type=int)
+    sort_parser.add_argument("--offset", type=int, default=0)
+
+    site_parser = subparsers.add_parser("site", parents=[output], help="Generate the website.")
+    site_parser.add_argument("--output-dir", default="web")
+    site_parser.add_argument("--page-size", type=int, default=100)
+    site_parser.add_argument("--no-posters", dest="posters", action="store_false",
+                             help="Link the original posters instead of mirroring them.")
+    site_parser.add_argument("--refresh-posters", action="store_true",
+                             help="Ask the poster hosts if the posters mirrored before changed.")
+
+    histogram_parser = subparsers.add_parser("histogram", parents=[output], help="Rating histogram bins.")
+    histogram_parser.add_argument("--bins", type=int, default=5)
+
+    chart_parser = subparsers.add_parser("chart", parents=[output], help="Save a chart of the library as png.")
+    chart_parser.add_argument("chart", nargs="?", choices=("ratings", "decades", "countries"), default="ratings")
+    chart_parser.add_argument("--output", help="Where to save the png, by default it stays in storage/charts.")
+    chart_parser.add_argument("--bins", type=int, default=5, help="Rating bins (default 5).")
+    chart_parser.add_argument("--top", type=int, default=15, help="Countries shown (default 15).")
+
+    dedupe_parser = subparsers.add_parser("dedupe", parents=[output],
+                                          help="Remove movies that are in the library twice (same IMDb ID or title).")
+    dedupe_parser.add_argument("--dry-run", action="store_true", help="Only show what would be removed.")
+
+    serve_parser = subparsers.add_parser("serve", help="Serve the library as a json http api (see server.py).")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    convert_parser = subparsers.add_parser("convert", help="Copy the library into another file (.json, .csv, "
+                                                           ".db/.sqlite, .rfx or .jsonl for JSON Lines).")
+    convert_parser.add_argument("output", help="The file to write, its extension picks the format.")
+    convert_parser.add_argument("--overwrite", action="store_true", help="Replace the output file if it exists.")
+    convert_parser.add_argument("--batch-size", type=int, default=1000, help="Movies copied at a time (default 1000).")
+    # batch always answers with one json line per command
+    subparsers.add_parser("batch", help="Run the json commands read from stdin, one per line, "
+                                        'e.g. {"command": "note", "title": "Heat", "note": "again"}.')
+
+
+def command_arguments(args):
+    """
+    :return: (dict) the parsed arguments of the subcommand, without the ones main.py uses itself
+    """
+    ignored = {"storage_file", "cache", "journal", "fast", "metrics_file", "profile_dir", "import_file", "workers",
+               "rate", "format", "command"}
+    return {name: value for name, value in vars(args).items() if name not in ignored}
+
+
+def write_result(command, result, output_format="ndjson", out=sys.stdout):
+    if command in LISTING_COMMANDS and output_format == "ndjson":
+        for record in result:
+            out.write(json.dumps(record) + "\n")
+    else:
+        if command in LISTING_COMMANDS:
+            result = list(result)
+        out.write(json.dumps(result) + "\n")
+
+
+def run_batch(commands, lines, out=sys.stdout):
+    """
+    runs one json command per line, blank lines are skipped. Every command gets one line of output:
+    {"ok": true, "result": ...} or {"ok": false, "error": "..."}, so a failing command doesn't stop the batch.
+    :return: (int) number of failed commands
+    """
+    failed = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            arguments = json.loads(line)
+            if not isinstance(arguments, dict):
+                raise CommandError("Each line must be a json object")
+            result = commands.run(arguments.pop("command", None), **arguments)
+            out.write(json.dumps({"ok": True, "result": result}) + "\n")
+        except Exception as e:
+            failed += 1
+            out.write(json.dumps({"ok": False, "error": str(e)}) + "\n")
+    return failed
+
+
+def run_cli(storage, args, api_key=None, url=OMDB_URL):
+    """
+    runs the subcommand parsed by main.py.
+    :return: (int) exit code, 0 if everything worked
+    """
+    commands = MovieCommands(storage, api_key, url)
+    try:
+        if args.command == "batch":
+            return 1 if run_batch(commands, sys.stdin) else 0
+        result = getattr(commands, args.command)(**command_arguments(args))
+        write_result(args.command, result, args.format)
+        return 0
+    except CommandError as e:
+        print(json.dumps({"error": str(e)}))
+        return 1
+    finally:
+        commands.close()
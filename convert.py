@@ -0,0 +1,256 @@
+import csv
+import hashlib
+import json
+import os
+import time
+
+from data.locking import FileLock
+from data.storage_csv import FIELDNAMES, MOVIE_FIELDS
+
+# the checksum is a sum of one hash per movie, so it doesn't depend on the order the movies come in
+CHECKSUM_BITS = 128
+
+
+class ConversionError(Exception):
+    """raised when a library can't be converted, e.g. the target exists or doesn't match the source afterwards"""
+    pass
+
+
+def movie_hash(title, details):
+    """
+    hashes a movie the way every storage can give it back: missing fields, None and "" are the same
+    (e.g. csv has no "missing"), and values are compared as text (csv and sqlite keep ratings as text).
+    :return: (int) the movie's hash
+    """
+    parts = [title]
+    for key in sorted(details):
+        value = details[key]
+        if value is not None and value != "":
+            parts += (key, str(value))
+    text = "\0".join(parts)
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=CHECKSUM_BITS // 8).digest(), "big")
+
+
+class LibraryChecksum:
+    """
+    Count and order independent checksum of a library, fed one movie at a time.
+    Methods:
+        update(title, details):
+            adds a movie.
+        hexdigest():
+            the checksum as hex.
+    """
+    def __init__(self):
+        self.count = 0
+        self._sum = 0
+
+    def update(self, title, details):
+        self.count += 1
+        self._sum = (self._sum + movie_hash(title, details)) % (1 << CHECKSUM_BITS)
+
+    def hexdigest(self):
+        return f"{self._sum:0{CHECKSUM_BITS // 4}x}"
+
+
+class JsonTarget:
+    """
+    writes the movies.json format one movie at a time, the file is the same as json.dump(movies, indent=4) writes.
+    """
+    def __init__(self, file_path):
+        self._file = open(file_path, "w")
+        self._count = 0
+
+    def write(self, movies):
+        for title, details in movies:
+            # the movie as it appears inside the dumped library, without the braces around it
+            entry = json.dumps({title: details}, indent=4, default=dict)[1:-2]
+            self._file.write(("," if self._count else "{") + entry)
+            self._count += 1
+
+    def close(self):
+        self._file.write("\n}" if self._count else "{}")
+        self._file.close()
+
+
+class CsvTarget:
+    """
+    writes the movies.csv format, a compacted file without delta rows.
+    """
+    def __init__(self, file_path):
+        self._file = open(file_path, "w", newline="")
+        self._writer = csv.DictWriter(self._file, fieldnames=FIELDNAMES)
+        self._writer.writeheader()
+
+    def write(self, movies):
+        self._writer.writerows({"title": title, **{field: details.get(field, "") for field in MOVIE_FIELDS},
+                                "op": ""} for title, details in movies)
+
+    def close(self):
+        self._file.close()
+
+
+class SQLiteTarget:
+    """
+    writes the movies into a SQLite database, one transaction per batch.
+    """
+    def __init__(self, file_path):
+        from data.storage_sqlite import StorageSQLite
+        self._storage = StorageSQLite(file_path)
+
+    def write(self, movies):
+        self._storage.add_movies(dict(movies))
+
+    def close(self):
+        self._storage.close()
+
+
+class SnapshotTarget:
+    """
+    writes a .rfx snapshot. The strings go straight to the file, the titles and the numeric columns
+    (about 60 bytes per movie) are kept until the end to sort them.
+    """
+    def __init__(self, file_path):
+        from data.snapshot import SnapshotWriter
+        self._file = open(file_path, "wb")
+        self._writer = SnapshotWriter(self._file)
+
+    def write(self, movies):
+        for title, details in movies:
+            self._writer.add(title, details)
+
+    def close(self):
+        try:
+            self._writer.close()
+        finally:
+            self._file.close()
+
+
+class JsonLinesTarget:
+    """
+    writes one json object per line, {"title": ..., "rating": ..., ...}, like the list command prints.
+    """
+    def __init__(self, file_path):
+        self._file = open(file_path, "w", encoding="utf-8")
+
+    def write(self, movies):
+        for title, details in movies:
+            self._file.write(json.dumps({"title": title, **details}, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+TARGETS = {"json": JsonTarget, "csv": CsvTarget, "sqlite": SQLiteTarget, "snapshot": SnapshotTarget,
+           "jsonl": JsonLinesTarget}
+# the storages locking their file with a FileLock
+LOCKED_TARGETS = ("json", "csv", "snapshot")
+
+
+def read_target(target_type, file_path):
+    """
+    streams a converted file back, to check it.
+    :return: (generator) (title, details) tuples
+    """
+    if target_type == "jsonl":
+        with open(file_path, encoding="utf-8") as lines:
+            for line in lines:
+                details = json.loads(line)
+                yield details.pop("title"), details
+        return
+    if target_type == "sqlite":
+        from data.storage_sqlite import StorageSQLite
+        storage = StorageSQLite(file_path)
+        try:
+            yield from storage.iter_movies()
+        finally:
+            storage.close()
+        return
+    if target_type == "csv":
+        from data.storage_csv import StorageCSV
+        storage = StorageCSV(file_path)
+    elif target_type == "snapshot":
+        from data.storage_snapshot import StorageSnapshot
+        storage = StorageSnapshot(file_path)
+    else:
+        from data.storage_json import StorageJson
+        storage = StorageJson(file_path)
+    yield from storage.iter_movies()
+
+
+def _remove(*file_paths):
+    for file_path in file_paths:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+
+def convert_library(source, target_path, target_type, overwrite=False, batch_size=1000, progress=None,
+                    progress_interval=1.0):
+    """
+    copies every movie of the source storage into a new file, streaming them in batches so only one batch
+    is in memory at a time (the source's iter_movies() streams too, as long as the storage isn't cached).
+    The movies are written to a temporary file next to the target, which is read back and has to hold the
+    same number of movies with the same checksum before it replaces the target.
+    :param source: (IStorage) the library to convert
+    :param target_path: (str) the file to write
+    :param target_type: (str) "json", "csv", "sqlite", "snapshot" or "jsonl"
+    :param overwrite: (bool) replace the target if it already exists
+    :param batch_size: (int) movies read and written at a time
+    :param progress: (function) called with the number of movies written so far and the seconds since the start,
+                     at most every progress_interval seconds and once at the end
+    :return: (dict) "movies", "seconds", "movies_per_second", "bytes" of the target, "checksum" and "verified"
+    """
+    if target_type not in TARGETS:
+        raise ConversionError(f"Can't convert to {target_type!r}, use one of {', '.join(TARGETS)}")
+    if os.path.exists(target_path) and not overwrite:
+        raise ConversionError(f"{target_path} already exists")
+    root, extension = os.path.splitext(target_path)
+    temp_path = f"{root}.converting-{os.getpid()}{extension}"
+
+    start = time.perf_counter()
+    last_report = start
+    checksum = LibraryChecksum()
+    try:
+        target = TARGETS[target_type](temp_path)
+        try:
+            batch = []
+            for title, details in source.iter_movies():
+                batch.append((title, details))
+                checksum.update(title, details)
+                if len(batch) >= batch_size:
+                    target.write(batch)
+                    batch = []
+                    if progress is not None and time.perf_counter() - last_report >= progress_interval:
+                        last_report = time.perf_counter()
+                        progress(checksum.count, last_report - start)
+            target.write(batch)
+        finally:
+            target.close()
+        if progress is not None:
+            progress(checksum.count, time.perf_counter() - start)
+
+        written = LibraryChecksum()
+        for title, details in read_target(target_type, temp_path):
+            written.update(title, details)
+        if written.count != checksum.count:
+            raise ConversionError(f"The {target_type} file holds {written.count} movies instead of {checksum.count}")
+        if written.hexdigest() != checksum.hexdigest():
+            message = f"The {target_type} file doesn't hold the same movies as the source"
+            if target_type in ("csv", "sqlite"):
+                message += f", it only keeps the fields {', '.join(MOVIE_FIELDS)}"
+            raise ConversionError(message)
+
+        # other RateFlix processes using the target library wait until it is replaced
+        with FileLock(target_path if target_type in LOCKED_TARGETS else None).exclusive():
+            os.replace(temp_path, target_path)
+            # a journal left from the library that was there before would be replayed onto the new one
+            if target_type == "json":
+                _remove(target_path + ".journal")
+    finally:
+        _remove(temp_path, temp_path + ".lock", temp_path + "-journal")
+
+    seconds = time.perf_counter() - start
+    return {"movies": checksum.count, "seconds": round(seconds, 3),
+            "movies_per_second": round(checksum.count / seconds, 1) if seconds else None,
+            "bytes": os.path.getsize(target_path), "checksum": checksum.hexdigest(), "verified": True}
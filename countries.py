@@ -0,0 +1,36 @@
+from functools import lru_cache
+
+from data.fields import split_countries
+from metrics import METRICS
+
+
+@lru_cache(maxsize=512)
+def country_code(name):
+    """
+    resolves one country name ("United Kingdom", "Germany") to its ISO alpha-2 code.
+    pycountry's lookup scans every country, so the answers are memoised, a library only
+    has a few hundred different country names.
+    :param name: (str) a single country name
+    :return: (str) the alpha-2 code, None if pycountry doesn't know the name
+    """
+    import pycountry
+    with METRICS.timer("country_lookup"):
+        try:
+            return pycountry.countries.lookup(name).alpha_2
+        except LookupError:
+            return None
+
+
+@lru_cache(maxsize=1024)
+def country_codes(country):
+    """
+    resolves OMDb's comma separated country field to the codes of every country pycountry knows.
+    :param country: (str) e.g. "United States, United Kingdom"
+    :return: (tuple) (name, alpha-2 code) pairs in the order of the field, unknown names are left out
+    """
+    pairs = []
+    for name in split_countries(country):
+        code = country_code(name)
+        if code is not None:
+            pairs.append((name, code))
+    return tuple(pairs)
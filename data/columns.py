@@ -0,0 +1,111 @@
+import numpy as np
+from data.fields import MISSING_YEAR
+from data.movie import rating_of, start_year_of
+
+# float32 keeps about 7 significant digits, rounding a 0-10 rating to 5 decimals gives back the number it
+# was parsed from (7.1 instead of 7.099999904632568) before it is reported
+RATING_DECIMALS = 5
+
+
+def reported_ratings(ratings):
+    """
+    :param ratings: (numpy.ndarray) float32 ratings
+    :return: (numpy.ndarray) the ratings as float64, as they were written in the library
+    """
+    return np.round(ratings.astype(np.float64), RATING_DECIMALS)
+
+
+def round_reported(value):
+    """
+    rounds an average, median or bin edge for reports, one digit more than the ratings themselves have.
+    """
+    return round(float(value), 2)
+
+
+class MovieColumns:
+    """
+    The library as typed numpy columns (title, rating as float32, start year as int16) so stats,
+    filters and histograms are vectorised instead of converting every movie in a Python loop.
+    Movies without a rating have NaN as rating, movies without a year have MISSING_YEAR.
+    Methods:
+        from_movies(movies):
+            class method, builds the columns from a movies dictionary.
+        stats():
+            average, median, highest and lowest rating with their titles.
+        mask(min_rating, max_rating, start_year, end_year):
+            boolean array of the movies matching the filters.
+        histogram(bins):
+            number of rated movies per rating bin.
+        decade_counts():
+            number of movies per decade they started in.
+    """
+    def __init__(self, titles, ratings, years):
+        self.titles = titles
+        self.ratings = ratings
+        self.years = years
+
+    def __len__(self):
+        return len(self.titles)
+
+    @classmethod
+    def from_movies(cls, movies: dict):
+        titles = np.array(list(movies), dtype=object)
+        # fromiter turns a None rating into NaN
+        ratings = np.fromiter((rating_of(details) for details in movies.values()),
+                              dtype=np.float32, count=len(movies))
+        years = np.fromiter((start_year_of(details) or MISSING_YEAR for details in movies.values()),
+                            dtype=np.int16, count=len(movies))
+        return cls(titles, ratings, years)
+
+    def stats(self):
+        """
+        :return: (dict) "count" of rated movies, "average", "median", "highest", "lowest" ratings and
+                 "highest_titles"/"lowest_titles" lists, None instead of the dict if no movie has a rating
+        """
+        rated = ~np.isnan(self.ratings)
+        ratings = reported_ratings(self.ratings[rated])
+        if ratings.size == 0:
+            return None
+        titles = self.titles[rated]
+        highest = ratings.max()
+        lowest = ratings.min()
+        return {"count": int(ratings.size),
+                "average": round_reported(ratings.mean()),
+                "median": round_reported(np.median(ratings)),
+                "highest": float(highest),
+                "lowest": float(lowest),
+                "highest_titles": titles[ratings == highest].tolist(),
+                "lowest_titles": titles[ratings == lowest].tolist()}
+
+    def mask(self, min_rating=None, max_rating=None, start_year=None, end_year=None):
+        """
+        movies without a rating/year never match a rating/year filter, filters left as None are ignored.
+        :return: (numpy.ndarray) bool per movie
+        """
+        mask = np.ones(len(self.titles), dtype=bool)
+        # comparisons with NaN are False so unrated movies drop out by themselves
+        if min_rating is not None:
+            mask &= self.ratings >= np.float32(min_rating)
+        if max_rating is not None:
+            mask &= self.ratings <= np.float32(max_rating)
+        if start_year is not None or end_year is not None:
+            mask &= self.years != MISSING_YEAR
+        if start_year is not None:
+            mask &= self.years >= start_year
+        if end_year is not None:
+            mask &= self.years <= end_year
+        return mask
+
+    def histogram(self, bins=5):
+        """
+        :return: (tuple) counts and bin edges as numpy.histogram returns them, only rated movies are counted
+        """
+        ratings = reported_ratings(self.ratings[~np.isnan(self.ratings)])
+        return np.histogram(ratings, bins=bins)
+
+    def decade_counts(self):
+        """
+        :return: (tuple) decades (e.g. 1990) and the number of movies per decade, movies without a year are left out
+        """
+        years = self.years[self.years != MISSING_YEAR]
+        return np.unique(years // 10 * 10, return_counts=True)
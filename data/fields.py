@@ -0,0 +1,85 @@
+import re
+from functools import lru_cache
+
+YEAR_PATTERN = re.compile(r"\d{4}")
+IMDB_ID_PATTERN = re.compile(r"\btt\d+\b")
+# start year of movies without a year in the numeric columns (numpy columns, snapshot files)
+MISSING_YEAR = -1
+
+
+def parse_rating(rating):
+    """
+    turns a stored rating ("8.8", 8.8 or OMDb's "N/A") into a number.
+    :param rating: (str | float) rating as stored in the library
+    :return: (float) the rating, None if the movie has no rating
+    """
+    try:
+        return float(rating)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_year(year):
+    """
+    turns a stored year ("2010", 2010 or a series range like "2010–2013") into the (start) year.
+    :param year: (str | int) year as stored in the library
+    :return: (int) the year, None if there is no year
+    """
+    if isinstance(year, int):
+        return year
+    if year is None:
+        return None
+    match = YEAR_PATTERN.search(str(year))
+    return int(match.group()) if match else None
+
+
+def split_countries(country):
+    """
+    splits OMDb's comma separated country field ("United States, United Kingdom") into a list of names.
+    :return: (list) country names, empty if there is no country
+    """
+    if not country:
+        return []
+    return [name.strip() for name in country.split(",") if name.strip()]
+
+
+def parse_imdb_id(imdb):
+    """
+    finds the IMDb ID in a stored IMDb link ("https://www.imdb.com/title/tt0111161/") or ID.
+    :return: (str) the ID, e.g. "tt0111161", None if there is none
+    """
+    if not isinstance(imdb, str):
+        return None
+    match = IMDB_ID_PATTERN.search(imdb)
+    return match.group() if match else None
+
+
+def title_key(title):
+    """
+    the title as it is compared when looking for duplicates: casefolded and with its white space collapsed,
+    so "inception", "Inception" and " INCEPTION " are the same title.
+    :return: (str) the title key
+    """
+    return " ".join(title.casefold().split())
+
+
+@lru_cache(maxsize=4096)
+def country_keys(country):
+    """
+    the casefolded country names of a country field, for case insensitive country filters.
+    memoised since the same few hundred country fields repeat across the whole library.
+    :return: (frozenset) casefolded country names
+    """
+    return frozenset(name.casefold() for name in split_countries(country))
+
+
+def project(details, fields=None):
+    """
+    keeps only the requested fields of a movie's details.
+    :param details: (dict) the movie's details
+    :param fields: (list) field names to keep, None keeps every field
+    :return: (dict) the projected details
+    """
+    if fields is None:
+        return details
+    return {field: details.get(field) for field in fields}
@@ -0,0 +1,159 @@
+from data.fields import IMDB_ID_PATTERN, parse_imdb_id, title_key
+
+
+class DuplicateMovieError(Exception):
+    """raised when a movie is already in the library, title is the title it is stored under"""
+    def __init__(self, title):
+        super().__init__(f"{title} is already in the library")
+        self.title = title
+
+
+class IdentityIndex:
+    """
+    Index telling which movie of the library a title or IMDb ID belongs to, so duplicates are found with
+    a dictionary lookup instead of a pass over the library. The movies stay stored under their titles,
+    the IMDb ID is the primary key (one movie per ID) and the casefolded title (see fields.title_key)
+    a secondary one. Libraries from before the index can hold the same key more than once, lookups
+    then give the first of them.
+    Methods:
+        build(movies):
+            class method, creates the index over the movies dictionary.
+        update(title, details):
+            indexes the movie under its new keys, details None removes it.
+        title_for(title) / title_for_imdb(imdb):
+            the stored title with the same title key / IMDb ID, None if there is none.
+        find(title, imdb_id):
+            the stored title matching the IMDb ID, or else the title.
+        imdb_of(title):
+            the IMDb ID of a stored movie, None if it has none.
+    """
+    def __init__(self):
+        self._by_imdb = {}
+        self._by_title = {}
+        self._keys = {}
+
+    def __len__(self):
+        return len(self._keys)
+
+    @classmethod
+    def build(cls, movies):
+        index = cls()
+        for title, details in movies.items():
+            index.update(title, details)
+        return index
+
+    @staticmethod
+    def _add(keys, key, title):
+        if key is not None:
+            # dictionaries as ordered sets, so a duplicate that is removed again leaves the first title in place
+            keys.setdefault(key, {})[title] = None
+
+    @staticmethod
+    def _remove(keys, key, title):
+        titles = keys.get(key)
+        if titles is not None:
+            titles.pop(title, None)
+            if not titles:
+                del keys[key]
+
+    def update(self, title, details):
+        """
+        :param title: (str) title of the changed movie
+        :param details: (dict) the movie's new details, None if it was deleted
+        """
+        if title in self._keys:
+            key, imdb = self._keys.pop(title)
+            self._remove(self._by_title, key, title)
+            self._remove(self._by_imdb, imdb, title)
+        if details is not None:
+            key, imdb = title_key(title), parse_imdb_id(details.get("imdbID"))
+            self._keys[title] = (key, imdb)
+            self._add(self._by_title, key, title)
+            self._add(self._by_imdb, imdb, title)
+
+    def title_for(self, title):
+        titles = self._by_title.get(title_key(title))
+        return next(iter(titles)) if titles else None
+
+    def title_for_imdb(self, imdb):
+        titles = self._by_imdb.get(parse_imdb_id(imdb))
+        return next(iter(titles)) if titles else None
+
+    def find(self, title=None, imdb_id=None):
+        """
+        :param title: (str) a title as the user typed it or OMDb returned it
+        :param imdb_id: (str) an IMDb ID or link
+        :return: (str) the title the movie is stored under, matching the IMDb ID first, None if there is none
+        """
+        if imdb_id is not None:
+            found = self.title_for_imdb(imdb_id)
+            if found is not None:
+                return found
+        return self.title_for(title) if title is not None else None
+
+    def imdb_of(self, title):
+        keys = self._keys.get(title)
+        return keys[1] if keys is not None else None
+
+
+def find_existing(index, query):
+    """
+    looks up what the user asked to add before OMDb is asked for it: "inception" finds "Inception"
+    and an IMDb ID (tt0111161) finds the movie stored with it.
+    :param index: (IdentityIndex) the storage's identity_index()
+    :param query: (str) a title or an IMDb ID
+    :return: (str) the title the movie is stored under, None if it isn't in the library
+    """
+    imdb_id = query.strip() if IMDB_ID_PATTERN.fullmatch(query.strip()) else None
+    return index.find(title=query, imdb_id=imdb_id)
+
+
+def check_new_movie(index, title, year, imdb_link):
+    """
+    decides under which title a movie OMDb found can be added.
+    a movie with the same IMDb ID (or a movie with the same title but without an IMDb ID) is the same movie,
+    a different movie with the same title (a remake) is added with its year, e.g. "Dune (2021)".
+    :param index: (IdentityIndex) the storage's identity_index(), asked for once per movie added
+    :return: (str) the title to add the movie under
+    :raises DuplicateMovieError: if the movie is already in the library
+    """
+    existing = index.find(imdb_id=imdb_link)
+    if existing is not None:
+        raise DuplicateMovieError(existing)
+    existing = index.find(title=title)
+    if existing is None:
+        return title
+    if index.imdb_of(existing) is None:
+        raise DuplicateMovieError(existing)
+    title = f"{title} ({year})"
+    existing = index.find(title=title)
+    if existing is not None:
+        raise DuplicateMovieError(existing)
+    return title
+
+
+def find_duplicates(movies):
+    """
+    finds the movies that are in the library more than once: with the same IMDb ID, or with the same
+    title key where at most one of them has an IMDb ID. The first one in the library is kept.
+    :param movies: (dict) title: details
+    :return: (dict) title of every duplicate: title of the movie it duplicates
+    """
+    duplicates = {}
+    by_imdb = {}
+    by_title = {}
+    for title, details in movies.items():
+        imdb = parse_imdb_id(details.get("imdbID"))
+        key = title_key(title)
+        if imdb is not None and imdb in by_imdb:
+            duplicates[title] = by_imdb[imdb]
+            continue
+        same_title = [other for other, other_imdb in by_title.get(key, [])
+                      if imdb is None or other_imdb is None]
+        if same_title:
+            duplicates[title] = same_title[0]
+            continue
+        by_title.setdefault(key, []).append((title, imdb))
+        if imdb is not None:
+            by_imdb[imdb] = title
+    return duplicates
@@ -1,9 +1,14 @@
 from abc import ABC, abstractmethod
+from data.fields import country_keys, project
+from data.identity_index import IdentityIndex
+from data.movie import SORT_VALUES
 
 
 class IStorage(ABC):
     """
     An Abstract class to allow for more flexibility in our storage options.
+    The query methods (columns, query_movies, sorted_movies, identity_index, find_movie) have default
+    implementations built on list_movies(), storages with indexes override them to push the work down.
     """
     @abstractmethod
     def list_movies(self):
@@ -37,6 +42,135 @@ class IStorage(ABC):
         """
         pass
 
+    def iter_movies(self, fields=None):
+        """
+        go through the movies one at a time, for read only passes (listing, website, exports) that
+        don't need the whole library in memory. Storages override this to read their file lazily.
+        :param fields: (list) only return these fields of each movie, None for every field
+        :return: (iterator) of (title, details) tuples
+        """
+        for title, details in self.list_movies().items():
+            yield title, project(details, fields)
+
+    def add_movies(self, movies):
+        """
+        add several movies in one go, e.g. from a bulk import.
+        the default reads the library once and saves it once instead of once per movie.
+        :param movies: (dict) title: {"rating", "year", "poster", "imdbID", "country"}
+        """
+        library = self.list_movies()
+        library.update(movies)
+        self._save_movies(library)
+
+    def signature(self):
+        """
+        a value that changes whenever the library changes, so data built from it (e.g. the saved search index)
+        can tell if it is stale. Storages that can't tell return None and the data has to be checked instead.
+        :return: (tuple) e.g. the inode, modification time and size of the library file
+        """
+        return None
+
+    def find_movie(self, title=None, imdb_id=None):
+        """
+        looks up which movie of the library a title or IMDb ID belongs to, to keep duplicates out.
+        titles are compared casefolded (see fields.title_key), the IMDb ID can be given as ID or IMDb link.
+        :param title: (str) a title as the user typed it or OMDb returned it
+        :param imdb_id: (str) an IMDb ID or link
+        :return: (str) the title the movie is stored under, matching the IMDb ID first, None if there is none
+        """
+        return self.identity_index().find(title, imdb_id)
+
+    def identity_index(self):
+        """
+        the IdentityIndex over the library. The default reads the library on every call (cached storages
+        keep the index), so a caller with several lookups to do asks for it once and queries it.
+        :return: (IdentityIndex)
+        """
+        return IdentityIndex.build(self.list_movies())
+
+    def columns(self):
+        """
+        the library as numpy columns for vectorised stats, filters and histograms.
+        :return: (MovieColumns)
+        """
+        return self._columns(self.list_movies())
+
+    def _columns(self, movies):
+        """
+        builds the columns for the given movies dictionary (which is what list_movies() returned),
+        cached storages override this to build them only once per change.
+        """
+        # numpy is only imported once a feature needs the columns, it slows down the app's start
+        from data.columns import MovieColumns
+        return MovieColumns.from_movies(movies)
+
+    def query_movies(self, min_rating=None, max_rating=None, start_year=None, end_year=None,
+                     country=None, title_prefix=None):
+        """
+        find the movies matching every given filter, filters left as None are ignored.
+        movies without a rating/year never match a rating/year filter.
+        :param min_rating: (float) lowest rating to include
+        :param max_rating: (float) highest rating to include
+        :param start_year: (int) earliest (start) year to include
+        :param end_year: (int) latest (start) year to include
+        :param country: (str) one of the movie's countries, case insensitive
+        :param title_prefix: (str) start of the title, case insensitive
+        :return: (dict) title: details of the matching movies
+        """
+        if country is not None:
+            country = country.casefold()
+        if title_prefix is not None:
+            title_prefix = title_prefix.casefold()
+
+        movies = self.list_movies()
+        if min_rating is None and max_rating is None and start_year is None and end_year is None:
+            candidates = movies.items()
+        else:
+            candidates = ((title, movies[title])
+                          for title in self._range_candidates(movies, min_rating, max_rating, start_year, end_year))
+
+        matches = {}
+        for title, details in candidates:
+            if country is not None and country not in country_keys(details.get("country")):
+                continue
+            if title_prefix is not None and not title.casefold().startswith(title_prefix):
+                continue
+            matches[title] = details
+        return matches
+
+    def _range_candidates(self, movies, min_rating, max_rating, start_year, end_year):
+        """
+        finds the titles matching the rating and year ranges, the default runs vectorised on the columns.
+        :param movies: (dict) what list_movies() returned
+        :return: (iterable) matching titles
+        """
+        columns = self._columns(movies)
+        return columns.titles[columns.mask(min_rating, max_rating, start_year, end_year)]
+
+    def sorted_movies(self, key="rating", reverse=False, limit=None, offset=0):
+        """
+        list the movies sorted by rating or (start) year, movies without a value always come last.
+        movies with the same value are ordered by title, reverse reverses that order as well.
+        :param key: (str) "rating" or "year"
+        :param reverse: (bool) True for highest/latest first
+        :param limit: (int) maximum number of movies, None for all
+        :param offset: (int) number of movies to skip, e.g. offset=40 limit=20 for the third page of 20
+        :return: (iterator) of (title, details) tuples
+        """
+        value_of = SORT_VALUES[key]
+        with_value = []
+        without_value = []
+        for title, details in self.list_movies().items():
+            value = value_of(details)
+            if value is None:
+                without_value.append((title, details))
+            else:
+                with_value.append((value, title, details))
+        with_value.sort(key=lambda item: (item[0], item[1]), reverse=reverse)
+        without_value.sort(key=lambda item: item[0], reverse=reverse)
+        ordered = [(title, details) for _, title, details in with_value] + without_value
+        return iter(ordered[offset:None if limit is None else offset + limit])
+
     @abstractmethod
     def _save_movies(self, movies):
         pass
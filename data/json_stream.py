@@ -0,0 +1,74 @@
+import json
+import re
+
+WHITESPACE = re.compile(r"\s*")
+
+
+def iter_json_object(json_file, chunk_size=64 * 1024):
+    """
+    yields the (key, value) pairs of the top level object of a json file one at a time,
+    reading the file in chunks instead of loading the whole document into memory.
+    Each value is decoded with json's own decoder, so only one movie has to fit in memory.
+    :param json_file: (file) text file opened for reading
+    :param chunk_size: (int) number of characters read at a time
+    :return: (generator) of (key, value) tuples in file order
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    end_of_file = False
+
+    def read_more():
+        nonlocal buffer, position, end_of_file
+        chunk = json_file.read(chunk_size)
+        if not chunk:
+            end_of_file = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def next_char():
+        """skips white space and returns the next character without consuming it"""
+        nonlocal position
+        while True:
+            position = WHITESPACE.match(buffer, position).end()
+            if position < len(buffer):
+                return buffer[position]
+            if end_of_file:
+                raise ValueError("Unexpected end of json file")
+            read_more()
+
+    def decode():
+        """decodes the value starting at the current position, reading more of the file until it is complete"""
+        nonlocal position
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # a number running into the end of the buffer might continue in the next chunk
+                if end < len(buffer) or end_of_file:
+                    position = end
+                    return value
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+            read_more()
+
+    if next_char() != "{":
+        raise ValueError("Expected a json object at the top level")
+    position += 1
+    if next_char() == "}":
+        return
+    while True:
+        key = decode()
+        if next_char() != ":":
+            raise ValueError(f"Expected ':' after {key!r}")
+        position += 1
+        next_char()
+        value = decode()
+        yield key, value
+        separator = next_char()
+        position += 1
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or '}}' after {key!r}")
+        next_char()
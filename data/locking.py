@@ -0,0 +1,156 @@
+import os
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:
+    # no flock on Windows, the storages still write atomically but processes aren't kept apart
+    fcntl = None
+
+
+class FileLock:
+    """
+    Shared/exclusive lock between processes on a library file, held with flock on a ".lock" file next to it
+    (not on the library itself, which is replaced by a new file on every save).
+    Any number of readers can hold the shared lock at the same time, a writer waits for them and then
+    has the file to itself. The threads of one process share the flock and are kept apart the same way:
+    readers in parallel, a writer alone, waiting writers go before new readers.
+    The lock is reentrant per thread: a write that reads the library first takes the exclusive lock once
+    and its reads run under it. A thread that takes the exclusive lock while it holds the shared one lets
+    the shared one go first, so its write has to read the library again (the write_locked methods do).
+    Methods:
+        __init__(file_path):
+            initialise the lock for the library at file_path, None gives a lock that does nothing.
+        shared():
+            context manager holding the lock for reading.
+        exclusive():
+            context manager holding the lock for writing.
+    """
+    def __init__(self, file_path):
+        self.lock_path = file_path + ".lock" if file_path is not None else None
+        self._condition = threading.Condition()
+        self._fd = None
+        # threads of this process holding the shared lock, the thread holding the exclusive one
+        self._readers = 0
+        self._writer = None
+        self._waiting_writers = 0
+        # what the current thread holds: None, "shared" or "exclusive"
+        self._local = threading.local()
+
+    def _open(self):
+        if self._fd is None:
+            try:
+                self._fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+            except (FileNotFoundError, PermissionError):
+                # no folder for the library yet or a read only one, there is nothing to keep apart
+                return None
+        return self._fd
+
+    def _flock(self, operation):
+        fd = self._open()
+        if fd is not None:
+            fcntl.flock(fd, operation)
+
+    def _acquire(self, exclusive):
+        with self._condition:
+            if exclusive:
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._condition.wait()
+                    self._flock(fcntl.LOCK_EX)
+                finally:
+                    self._waiting_writers -= 1
+                self._writer = threading.get_ident()
+            else:
+                while self._writer is not None or self._waiting_writers:
+                    self._condition.wait()
+                if self._readers == 0:
+                    self._flock(fcntl.LOCK_SH)
+                self._readers += 1
+
+    def _release(self, exclusive):
+        with self._condition:
+            if exclusive:
+                self._writer = None
+                self._flock(fcntl.LOCK_UN)
+            else:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._flock(fcntl.LOCK_UN)
+            self._condition.notify_all()
+
+    @contextmanager
+    def _hold(self, exclusive):
+        if self.lock_path is None or fcntl is None:
+            yield
+            return
+        held = getattr(self._local, "mode", None)
+        if held is None:
+            self._acquire(exclusive)
+        elif exclusive and held == "shared":
+            # flock can't upgrade atomically, another writer may get in between
+            self._release(False)
+            self._acquire(True)
+        self._local.mode = "exclusive" if exclusive or held == "exclusive" else "shared"
+        try:
+            # the thread lock isn't held here, the other threads only wait in _acquire
+            yield
+        finally:
+            self._local.mode = held
+            if held is None:
+                self._release(exclusive)
+            elif exclusive and held == "shared":
+                self._release(True)
+                self._acquire(False)
+
+    def shared(self):
+        return self._hold(exclusive=False)
+
+    def exclusive(self):
+        return self._hold(exclusive=True)
+
+    def __del__(self):
+        if self._fd is not None:
+            os.close(self._fd)
+
+
+def write_locked(method):
+    """
+    decorator for the storage methods that change the library, they run under the storage's exclusive lock
+    so the read-modify-write of two processes can't interleave.
+    """
+    @wraps(method)
+    def locked_method(self, *args, **kwargs):
+        with self._lock.exclusive():
+            return method(self, *args, **kwargs)
+    return locked_method
+
+
+@contextmanager
+def atomic_write(file_path, mode="w", **open_arguments):
+    """
+    opens a temporary file next to file_path for writing and moves it over file_path once the block
+    finished, so readers (and a crash half way) only ever see the old or the complete new file.
+    the new file keeps the permissions of the one it replaces.
+    :param open_arguments: passed on to open(), e.g. newline="" for csv
+    """
+    temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, mode, **open_arguments) as temp_file:
+            yield temp_file
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+        try:
+            os.chmod(temp_path, os.stat(file_path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -0,0 +1,156 @@
+import sys
+from collections.abc import MutableMapping
+from functools import lru_cache
+
+from data.fields import parse_rating, parse_year, split_countries
+
+# the keys of a movie's details as they are stored on disk, with the slot holding each of them
+FIELD_SLOTS = {"rating": "rating_text", "year": "year_text", "poster": "poster", "note": "note",
+               "imdbID": "imdb_link", "country": "country"}
+FIELD_KEYS = frozenset(FIELD_SLOTS)
+
+
+def _intern(text):
+    return sys.intern(text) if type(text) is str else text
+
+
+@lru_cache(maxsize=4096)
+def _rating(rating):
+    # a library only has about a hundred different ratings, so movies share the float objects too
+    return parse_rating(rating)
+
+
+@lru_cache(maxsize=4096)
+def _start_year(year):
+    return parse_year(year)
+
+
+@lru_cache(maxsize=4096)
+def _countries(country):
+    return tuple(sys.intern(name) for name in split_countries(country))
+
+
+class Movie(MutableMapping):
+    """
+    One movie's details, parsed once when a cached storage loads the library. The typed values sit next to
+    the stored text in slots instead of a dictionary per movie, and the text that repeats across the library
+    (ratings, years, countries) is interned so every movie with the same value shares one string.
+    A Movie still reads and writes like the details dictionary ("rating", "year", "poster", "note", "imdbID",
+    "country" and any other key from the file), with the text exactly as stored, so the storages save it
+    unchanged and the rest of the app doesn't need to tell them apart. Keys that aren't there (e.g. a
+    movie without a note) are left out, like in the dictionary it was made from.
+    Attributes:
+        rating: (float) the rating, None for OMDb's "N/A"
+        start_year: (int) the (start) year, None if there is no year
+        countries: (tuple) the country names, interned
+    Methods:
+        from_details(details):
+            class method, makes a Movie from a details dictionary (or another Movie).
+    """
+    __slots__ = ("rating", "start_year", "countries", "rating_text", "year_text", "poster", "note", "imdb_link",
+                 "country", "extra")
+
+    @classmethod
+    def from_details(cls, details):
+        movie = cls.__new__(cls)
+        get = details.get
+        rating = get("rating")
+        year = get("year")
+        country = _intern(get("country"))
+        movie.rating_text = _intern(rating)
+        movie.rating = _rating(rating)
+        movie.year_text = _intern(year)
+        movie.start_year = _start_year(year)
+        movie.country = country
+        movie.countries = _countries(country) if country is not None else ()
+        movie.poster = get("poster")
+        movie.note = get("note")
+        movie.imdb_link = get("imdbID")
+        movie.extra = None
+        if not details.keys() <= FIELD_KEYS:
+            movie.extra = {key: value for key, value in details.items() if key not in FIELD_KEYS}
+        return movie
+
+    def __getitem__(self, key):
+        slot = FIELD_SLOTS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            if value is not None:
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        slot = FIELD_SLOTS.get(key)
+        if slot is not None:
+            value = getattr(self, slot)
+            return default if value is None else value
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __setitem__(self, key, value):
+        if key == "rating":
+            self.rating_text = _intern(value)
+            self.rating = _rating(value)
+        elif key == "year":
+            self.year_text = _intern(value)
+            self.start_year = _start_year(value)
+        elif key == "country":
+            self.country = _intern(value)
+            self.countries = _countries(self.country) if value is not None else ()
+        elif key in FIELD_SLOTS:
+            setattr(self, FIELD_SLOTS[key], value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in FIELD_SLOTS:
+            self[key] = None
+        else:
+            del self.extra[key]
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __iter__(self):
+        for key, slot in FIELD_SLOTS.items():
+            if getattr(self, slot) is not None:
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"Movie({dict(self)!r})"
+
+
+def rating_of(details):
+    """
+    :param details: (Movie | dict) a movie's details
+    :return: (float) the rating, straight from a Movie or parsed from a details dictionary, None if it has none
+    """
+    if type(details) is Movie:
+        return details.rating
+    return parse_rating(details.get("rating"))
+
+
+def start_year_of(details):
+    """
+    :param details: (Movie | dict) a movie's details
+    :return: (int) the (start) year, straight from a Movie or parsed from a details dictionary, None if it has none
+    """
+    if type(details) is Movie:
+        return details.start_year
+    return parse_year(details.get("year"))
+
+
+# fields the library can be sorted and range queried by, with the function giving a movie's value as a number
+SORT_VALUES = {"rating": rating_of, "year": start_year_of}
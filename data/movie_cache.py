@@ -0,0 +1,107 @@
+import os
+
+from data.movie import Movie
+
+
+def file_signature(file_paths):
+    """
+    builds a fingerprint of the files from their inode, modification time and size.
+    the inode changes whenever a save replaced the file, even within the mtime's resolution.
+    :return: (tuple) one (inode, mtime, size) tuple per file, None for files that don't exist
+    """
+    signature = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            signature.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class MovieCache:
+    """
+    Keeps the parsed movie library in memory so the storage file only has to be read once.
+    The movies' details are turned into Movie records when they are put in, so the cached library
+    is parsed once and holds typed values instead of a dictionary of strings per movie.
+    The cached copy is thrown away as soon as one of the watched files changes on disk
+    (modification time or size), e.g. when another process or a text editor touched the library.
+    Methods:
+        __init__(*file_paths):
+            initialise the cache with the file(s) the library is read from.
+        load(reader):
+            return the cached movies, calling reader() to read them from disk when the cache is empty or stale.
+        put(movies):
+            store the movies dictionary and remember the current state of the file(s) on disk.
+        derived(name, build, reader):
+            return data built from the cached movies (e.g. numpy columns), rebuilt after every change.
+        index(name, build, reader):
+            return an index built from the cached movies, kept up to date on changes instead of rebuilt.
+    """
+    def __init__(self, *file_paths):
+        self.file_paths = file_paths
+        self._movies = None
+        self._signature = None
+        self._derived = {}
+        self._indexes = {}
+
+    def _current_signature(self):
+        return file_signature(self.file_paths)
+
+    def load(self, reader):
+        """
+        returns the cached movies if the files on disk haven't changed since they were cached.
+        otherwise the movies are read again with the given reader function and cached.
+        :param reader: (function) reads and returns the movies dictionary from disk
+        :return: (dict) the movies dictionary, shared with the cache so don't change it outside the storage
+        """
+        if self._movies is None or self._signature != self._current_signature():
+            self.put(reader())
+        return self._movies
+
+    def put(self, movies: dict, changed=None):
+        """
+        stores the movies dictionary, should be called right after the storage wrote the file(s)
+        so the cache matches what is on disk.
+        :param movies: (dict) the movies as they are now on disk, their details are replaced by Movies in place
+        :param changed: (list) titles added, deleted or updated since the last put, the indexes are
+                        updated for just these titles. None means anything could have changed.
+        """
+        for title in movies if changed is None else changed:
+            details = movies.get(title)
+            if details is not None and type(details) is not Movie:
+                movies[title] = Movie.from_details(details)
+        self._movies = movies
+        self._signature = self._current_signature()
+        self._derived = {}
+        if changed is None:
+            self._indexes = {}
+        else:
+            for index in self._indexes.values():
+                for title in changed:
+                    index.update(title, movies.get(title))
+
+    def derived(self, name, build, reader):
+        """
+        returns data computed from the cached movies, it is only computed again after the movies changed.
+        :param name: (str) name of the derived data, e.g. "columns"
+        :param build: (function) builds the data from the movies dictionary
+        :param reader: (function) reads the movies from disk if the cache is empty or stale
+        """
+        movies = self.load(reader)
+        if name not in self._derived:
+            self._derived[name] = build(movies)
+        return self._derived[name]
+
+    def index(self, name, build, reader):
+        """
+        returns an index over the cached movies (e.g. a SortedIndex), built once and then updated
+        through put(movies, changed). Indexes need an update(title, details) method.
+        :param name: (str) name of the index, e.g. "rating"
+        :param build: (function) builds the index from the movies dictionary
+        :param reader: (function) reads the movies from disk if the cache is empty or stale
+        """
+        movies = self.load(reader)
+        if name not in self._indexes:
+            self._indexes[name] = build(movies)
+        return self._indexes[name]
@@ -0,0 +1,141 @@
+import json
+import os
+
+
+def apply_record(movies: dict, record: dict):
+    """
+    applies a single journal record to the movies dictionary.
+    records are idempotent so replaying a record twice gives the same library.
+    :param movies: (dict) the movies dictionary to change in place
+    :param record: (dict) {"op": "add"|"delete"|"note", "title": title, ...}
+    """
+    title = record["title"]
+    if record["op"] == "add":
+        movies[title] = record["movie"]
+    elif record["op"] == "delete":
+        movies.pop(title, None)
+    elif record["op"] == "note":
+        if title in movies:
+            movies[title]["note"] = record["note"]
+
+
+def fold_records(records):
+    """
+    folds a sequence of records into one change per title: ("set", details) for added movies,
+    ("delete", None) for deleted ones and ("note", note) for a note on a movie that is only in the snapshot.
+    :param records: (iterable) records in the order they were written
+    :return: (dict) title: (change, value) in the order the titles were first changed
+    """
+    changes = {}
+    for record in records:
+        title = record["title"]
+        if record["op"] == "add":
+            changes[title] = ("set", record["movie"])
+        elif record["op"] == "delete":
+            changes[title] = ("delete", None)
+        elif record["op"] == "note":
+            change, value = changes.get(title, ("note", None))
+            if change == "set":
+                value["note"] = record["note"]
+            elif change == "note":
+                changes[title] = ("note", record["note"])
+    return changes
+
+
+def apply_changes(movies, changes):
+    """
+    applies folded changes while streaming the snapshot's movies.
+    :param movies: (iterable) (title, details) tuples of the snapshot
+    :param changes: (dict) from fold_records(), emptied along the way
+    :return: (generator) of (title, details) tuples of the current library
+    """
+    for title, details in movies:
+        change, value = changes.pop(title, (None, None))
+        if change == "delete":
+            continue
+        if change == "set":
+            details = value
+        elif change == "note":
+            details["note"] = value
+        yield title, details
+    # movies only added after the snapshot
+    for title, (change, value) in changes.items():
+        if change == "set":
+            yield title, value
+
+
+class MovieJournal:
+    """
+    Append-only log of the changes made on top of a movies snapshot file.
+    Every change is written as one json line so an edit only costs the bytes of that one record.
+    Methods:
+        __init__(file_path):
+            initialise the journal with the path of the log file.
+        append(*records):
+            writes the records to the end of the log in one write.
+        replay(movies):
+            applies every record in the log to the given movies dictionary.
+        pending():
+            the final change per title, for applying the log while streaming the snapshot.
+        size():
+            returns the size of the log in bytes.
+        clear():
+            empties the log, used once the records are folded into a new snapshot.
+    """
+    def __init__(self, file_path):
+        self.file_path = file_path
+
+    def append(self, *records: dict):
+        """
+        writes the records and syncs them to disk before returning.
+        a half written last line left by a crash is ended first, so it stays a line of its own that replay skips
+        instead of swallowing the first new record.
+        """
+        text = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with open(self.file_path, "a+b") as journal_file:
+            if journal_file.seek(0, os.SEEK_END) > 0:
+                journal_file.seek(-1, os.SEEK_END)
+                if journal_file.read(1) != b"\n":
+                    text = "\n" + text
+            journal_file.write(text.encode())
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def replay(self, movies: dict):
+        """
+        reads the log and applies the records in order. A half written last line
+        (e.g. the app was killed mid write) is skipped.
+        :return: (dict) the same movies dictionary, changed in place
+        """
+        for record in self._records():
+            apply_record(movies, record)
+        return movies
+
+    def _records(self):
+        try:
+            with open(self.file_path, "r") as journal_file:
+                for line in journal_file:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def pending(self):
+        """
+        :return: (dict) the log folded into one change per title, see fold_records()
+        """
+        return fold_records(self._records())
+
+    def size(self):
+        try:
+            return os.path.getsize(self.file_path)
+        except FileNotFoundError:
+            return 0
+
+    def clear(self):
+        try:
+            os.remove(self.file_path)
+        except FileNotFoundError:
+            pass
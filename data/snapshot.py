@@ -0,0 +1,421 @@
+import json
+import mmap
+import struct
+import sys
+from array import array
+from collections.abc import ItemsView, Mapping, ValuesView
+from io import BytesIO
+
+from data.fields import MISSING_YEAR
+from data.movie import FIELD_KEYS, FIELD_SLOTS, rating_of, start_year_of
+
+MAGIC = b"RATEFLIX"
+VERSION = 1
+# the text fields of a movie in the order they follow its title in the string heap, the last string holds
+# the keys outside of FIELDS (and fields that aren't text) as json. every string ends with a NUL byte.
+FIELDS = tuple(FIELD_SLOTS)
+STRINGS = len(FIELDS) + 2
+EXTRA_FLAG = 1 << len(FIELDS)
+ALL_FIELDS = EXTRA_FLAG - 1
+# header flag: no string contains a NUL itself, so a run of movies can be decoded at once and split at the NULs
+SPLIT_FLAG = 1
+# movies decoded at once when going through the whole snapshot
+CHUNK = 4096
+# magic, version, strings per movie, header flags, number of movies, number of movies with a rating / with a year,
+# then the offsets of the sections: heap, ratings, years, flags, starts, ends, title/rating/year order
+HEADER = struct.Struct("<8sHHIIII9Q")
+# (name, array typecode) of the fixed width sections after the heap, the typecodes are
+# the little endian layout on disk: "f" float32, "h" int16, "B" uint8, "Q" uint64, "I" uint32
+SECTIONS = (("ratings", "f"), ("years", "h"), ("flags", "B"), ("starts", "Q"), ("ends", "I"),
+            ("title_order", "I"), ("rating_order", "I"), ("year_order", "I"))
+
+
+def _section(buffer, offset, typecode, count):
+    """
+    :return: (memoryview | array) count values of a section, a view on the buffer without copying it
+             on little endian machines
+    """
+    size = array(typecode).itemsize * count
+    view = memoryview(buffer)[offset:offset + size]
+    if sys.byteorder == "little":
+        return view.cast(typecode)
+    values = array(typecode, view.tobytes())
+    values.byteswap()
+    return values
+
+
+class SnapshotWriter:
+    """
+    Writes a snapshot file one movie at a time, so a library can be converted without holding it in memory.
+    The strings are written straight to the file, only the numbers (and the titles, to sort them) are kept
+    until close() writes the fixed width sections and the header.
+    Methods:
+        __init__(snapshot_file):
+            initialise the writer on a file opened for binary writing, it has to be seekable.
+        add(title, details):
+            writes one movie.
+        copy(snapshot, start, stop):
+            writes a run of movies of another snapshot as they are, without decoding them.
+        close():
+            finishes the file, raises ValueError if a title was written twice.
+    """
+    def __init__(self, snapshot_file):
+        self._file = snapshot_file
+        self._file.write(bytes(HEADER.size))
+        self._heap_size = 0
+        self._split = True
+        self._titles = []
+        self.ratings = array("f")
+        self.years = array("h")
+        self.flags = array("B")
+        self.starts = array("Q", [0])
+        self.ends = array("I")
+
+    def _write(self, title_bytes, blob, ends, flags, rating, year):
+        self._file.write(blob)
+        self._heap_size += len(blob)
+        self._titles.append(title_bytes)
+        self.ratings.append(rating)
+        self.years.append(year)
+        self.flags.append(flags)
+        self.starts.append(self._heap_size)
+        self.ends.extend(ends)
+
+    def add(self, title, details):
+        flags = 0
+        strings = [title]
+        for bit, field in enumerate(FIELDS):
+            value = details.get(field)
+            if type(value) is str:
+                flags |= 1 << bit
+                strings.append(value)
+            else:
+                strings.append("")
+        extra = {key: value for key, value in details.items()
+                 if key not in FIELD_KEYS or (value is not None and type(value) is not str)}
+        if extra:
+            flags |= EXTRA_FLAG
+        strings.append(json.dumps(extra) if extra else "")
+
+        encoded = [text.encode() for text in strings]
+        if any(b"\0" in text for text in encoded):
+            self._split = False
+        # the end of every string is where its NUL is, the next string starts after it
+        ends, end = [], -1
+        for text in encoded:
+            end += len(text) + 1
+            ends.append(end)
+        rating = rating_of(details)
+        year = start_year_of(details)
+        self._write(encoded[0], b"\0".join(encoded) + b"\0", ends, flags,
+                    float("nan") if rating is None else rating, MISSING_YEAR if year is None else year)
+
+    def copy(self, snapshot, start, stop):
+        """
+        writes the movies start to stop of another snapshot as they are, in one piece.
+        """
+        if start >= stop:
+            return
+        self._split = self._split and snapshot.split
+        base = snapshot.starts[start]
+        self._file.write(snapshot.buffer[snapshot.heap + base:snapshot.heap + snapshot.starts[stop]])
+        self._titles.extend(snapshot.title_bytes(record) for record in range(start, stop))
+        self.ratings.extend(snapshot.ratings[start:stop])
+        self.years.extend(snapshot.years[start:stop])
+        self.flags.extend(snapshot.flags[start:stop])
+        self.starts.extend(self._heap_size + record_start - base for record_start in snapshot.starts[start + 1:stop + 1])
+        self.ends.extend(snapshot.ends[start * STRINGS:stop * STRINGS])
+        self._heap_size += snapshot.starts[stop] - base
+
+    def _orders(self):
+        """
+        :return: (tuple) the record numbers sorted by title, by (rating, title) and by (year, title),
+                 movies without a rating/year come after the others in title order, plus the rated and dated counts
+        """
+        import numpy as np
+
+        titles = self._titles
+        # utf-8 bytes sort like the strings they encode
+        title_order = sorted(range(len(titles)), key=titles.__getitem__)
+        for before, after in zip(title_order, title_order[1:]):
+            if titles[before] == titles[after]:
+                raise ValueError(f"{titles[after].decode()!r} is in the snapshot twice")
+        title_order = np.array(title_order, dtype=np.uint32)
+        rank = np.empty(len(titles), dtype=np.uint32)
+        rank[title_order] = np.arange(len(titles), dtype=np.uint32)
+
+        # lexsort puts NaN after every rating, the missing years are moved behind the others the same way
+        ratings = np.frombuffer(self.ratings, dtype=np.float32)
+        years = np.frombuffer(self.years, dtype=np.int16).astype(np.int32)
+        years[years == MISSING_YEAR] = np.iinfo(np.int32).max
+        rating_order = np.lexsort((rank, ratings)).astype(np.uint32)
+        year_order = np.lexsort((rank, years)).astype(np.uint32)
+        rated = int(np.count_nonzero(~np.isnan(ratings)))
+        dated = int(np.count_nonzero(years != np.iinfo(np.int32).max))
+        return (array("I", title_order.tobytes()), array("I", rating_order.tobytes()),
+                array("I", year_order.tobytes()), rated, dated)
+
+    def close(self):
+        """
+        writes the sections and the header.
+        :return: (int) number of movies written
+        """
+        title_order, rating_order, year_order, rated, dated = self._orders()
+        sections = {"ratings": self.ratings, "years": self.years, "flags": self.flags, "starts": self.starts,
+                    "ends": self.ends, "title_order": title_order, "rating_order": rating_order,
+                    "year_order": year_order}
+        position = HEADER.size + self._heap_size
+        offsets = [HEADER.size]
+        for name, _ in SECTIONS:
+            # every section starts 8 byte aligned, so the views on it are aligned too
+            padding = -position % 8
+            self._file.write(bytes(padding))
+            position += padding
+            offsets.append(position)
+            values = sections[name]
+            if sys.byteorder != "little":
+                values = array(values.typecode, values)
+                values.byteswap()
+            self._file.write(values.tobytes())
+            position += len(values) * values.itemsize
+        self._file.seek(0)
+        self._file.write(HEADER.pack(MAGIC, VERSION, STRINGS, SPLIT_FLAG if self._split else 0, len(self._titles),
+                                     rated, dated, *offsets))
+        self._file.seek(0, 2)
+        return len(self._titles)
+
+
+def write_snapshot(snapshot_file, movies):
+    """
+    writes the movies to a snapshot file opened for binary writing.
+    :param movies: (iterable) (title, details) tuples, e.g. movies.items()
+    :return: (int) number of movies written
+    """
+    writer = SnapshotWriter(snapshot_file)
+    for title, details in movies:
+        writer.add(title, details)
+    return writer.close()
+
+
+def _empty_snapshot():
+    snapshot_file = BytesIO()
+    write_snapshot(snapshot_file, [])
+    return snapshot_file.getvalue()
+
+
+class Snapshot:
+    """
+    Read access to a snapshot file (or bytes in the same format) without parsing it first.
+    The file is mapped into memory: the rating and year columns and the sort orders are read in place,
+    and a movie's strings are only decoded when the movie (or one of its fields) is asked for.
+    Layout: header, string heap (per movie its title, text fields and extra json, each ending with a NUL),
+    then the fixed width sections (ratings float32, years int16, field flags, heap start per movie,
+    string ends per movie, and the record numbers in title, rating and year order).
+    Methods:
+        open(file_path):
+            class method, maps the file, a missing or empty file gives an empty snapshot.
+        title(record) / details(record):
+            decode one movie, record is its position in the file.
+        find(title):
+            record number of the title by binary search on the title order, None if it isn't there.
+        items(fields):
+            yields every (title, details) in file order.
+        ordered(key, reverse, limit, offset):
+            yields a page of record numbers in "title", "rating" or "year" order.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        if len(buffer) < HEADER.size:
+            raise ValueError("Not a RateFlix snapshot, the file is too short")
+        magic, version, strings, flags, self.count, self.rated, self.dated, *offsets = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError("Not a RateFlix snapshot")
+        if version > VERSION or strings != STRINGS:
+            raise ValueError(f"Snapshot format version {version} isn't supported, this RateFlix reads version {VERSION}")
+        self.split = bool(flags & SPLIT_FLAG)
+        self.heap = offsets[0]
+        lengths = {"starts": self.count + 1, "ends": self.count * STRINGS}
+        for (name, typecode), offset in zip(SECTIONS, offsets[1:]):
+            count = lengths.get(name, self.count)
+            if offset + array(typecode).itemsize * count > len(buffer):
+                raise ValueError("The snapshot is truncated")
+            setattr(self, name, _section(buffer, offset, typecode, count))
+        self.offsets = dict(zip(("heap",) + tuple(name for name, _ in SECTIONS), offsets))
+
+    @classmethod
+    def open(cls, file_path):
+        try:
+            with open(file_path, "rb") as snapshot_file:
+                if snapshot_file.seek(0, 2) == 0:
+                    return cls(_empty_snapshot())
+                # the mapping stays valid after the file is closed, and after a save replaced it
+                return cls(mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ))
+        except FileNotFoundError:
+            return cls(_empty_snapshot())
+
+    def record_bytes(self, record):
+        return self.buffer[self.heap + self.starts[record]:self.heap + self.starts[record + 1]]
+
+    def title_bytes(self, record):
+        start = self.heap + self.starts[record]
+        return self.buffer[start:start + self.ends[record * STRINGS]]
+
+    def title(self, record):
+        return self.title_bytes(record).decode()
+
+    def _strings(self, start, stop):
+        """
+        decodes the movies from start to stop. a chunk of movies is decoded at once and split at the NULs,
+        unless a string contains a NUL itself, then every string is cut out at its offsets.
+        :return: (generator) (record, strings) tuples, strings being the title, the text fields and the extra json
+        """
+        for chunk_start in range(start, stop, CHUNK):
+            chunk_stop = min(stop, chunk_start + CHUNK)
+            if self.split:
+                blob = self.buffer[self.heap + self.starts[chunk_start]:self.heap + self.starts[chunk_stop]]
+                parts = blob.decode().split("\0")
+                for position in range(chunk_stop - chunk_start):
+                    yield chunk_start + position, parts[position * STRINGS:(position + 1) * STRINGS]
+                continue
+            for record in range(chunk_start, chunk_stop):
+                blob = self.record_bytes(record)
+                strings, offset = [], 0
+                for end in self.ends[record * STRINGS:(record + 1) * STRINGS]:
+                    strings.append(blob[offset:end].decode())
+                    offset = end + 1
+                yield record, strings
+
+    def _details(self, record, strings):
+        flags = self.flags[record]
+        if flags & ALL_FIELDS == ALL_FIELDS:
+            details = dict(zip(FIELDS, strings[1:]))
+        else:
+            details = {field: strings[position + 1] for position, field in enumerate(FIELDS)
+                       if flags >> position & 1}
+        if flags & EXTRA_FLAG:
+            details.update(json.loads(strings[-1]))
+        return details
+
+    def details(self, record):
+        """
+        :return: (dict) the movie's details as they were written, fields it doesn't have are left out
+        """
+        for _, strings in self._strings(record, record + 1):
+            return self._details(record, strings)
+
+    def find(self, title):
+        try:
+            key = title.encode()
+        except (AttributeError, UnicodeEncodeError):
+            return None
+        order = self.title_order
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.title_bytes(order[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.title_bytes(order[low]) == key:
+            return order[low]
+        return None
+
+    def items(self, fields=None):
+        """
+        :param fields: (list) only return these fields of each movie, None for every field
+        :return: (generator) (title, details) tuples in file order
+        """
+        for record, strings in self._strings(0, self.count):
+            details = self._details(record, strings)
+            if fields is None:
+                yield strings[0], details
+            else:
+                yield strings[0], {field: details.get(field) for field in fields}
+
+    def ordered(self, key="title", reverse=False, limit=None, offset=0):
+        """
+        movies without a rating/year come last, in reverse title order if reverse is True.
+        :return: (generator) record numbers of the page
+        """
+        order = {"title": self.title_order, "rating": self.rating_order, "year": self.year_order}[key]
+        with_value = {"title": self.count, "rating": self.rated, "year": self.dated}[key]
+        stop = self.count if limit is None else min(self.count, offset + limit)
+        for position in range(offset, stop):
+            if not reverse:
+                yield order[position]
+            elif position < with_value:
+                yield order[with_value - 1 - position]
+            else:
+                yield order[self.count - 1 - (position - with_value)]
+
+
+class SnapshotMovies(Mapping):
+    """
+    The movies dictionary of a snapshot, read only. Looking up a title decodes just that movie,
+    going through items() or values() decodes the movies one after another in file order.
+    """
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def __getitem__(self, title):
+        record = self.snapshot.find(title)
+        if record is None:
+            raise KeyError(title)
+        return self.snapshot.details(record)
+
+    def __contains__(self, title):
+        return self.snapshot.find(title) is not None
+
+    def __iter__(self):
+        for record in range(self.snapshot.count):
+            yield self.snapshot.title(record)
+
+    def __len__(self):
+        return self.snapshot.count
+
+    def items(self):
+        return _SnapshotItems(self)
+
+    def values(self):
+        return _SnapshotValues(self)
+
+
+class _SnapshotItems(ItemsView):
+    def __iter__(self):
+        yield from self._mapping.snapshot.items()
+
+
+class _SnapshotValues(ValuesView):
+    def __iter__(self):
+        for _, movie in self._mapping.snapshot.items():
+            yield movie
+
+
+class SnapshotTitles:
+    """
+    The title column of a snapshot for MovieColumns: indexing it with a numpy mask or positions
+    (like the titles array of the other storages) only picks record numbers, titles are decoded
+    when they are read with tolist() or by iterating.
+    """
+    def __init__(self, snapshot, records=None):
+        self.snapshot = snapshot
+        self.records = records
+
+    def __len__(self):
+        return self.snapshot.count if self.records is None else len(self.records)
+
+    def __getitem__(self, key):
+        import numpy as np
+        records = np.arange(self.snapshot.count) if self.records is None else self.records
+        selected = records[key]
+        if np.ndim(selected) == 0:
+            return self.snapshot.title(int(selected))
+        return SnapshotTitles(self.snapshot, selected)
+
+    def __iter__(self):
+        records = range(self.snapshot.count) if self.records is None else self.records
+        for record in records:
+            yield self.snapshot.title(int(record))
+
+    def tolist(self):
+        return list(self)
@@ -0,0 +1,106 @@
+from bisect import bisect_left, bisect_right, insort
+from operator import itemgetter
+
+
+class SortedIndex:
+    """
+    Secondary index keeping the titles sorted by one value (rating or start year).
+    Entries are (value, title) pairs in a sorted list, so adding or removing a movie is a binary
+    search plus a list insert/delete instead of sorting the whole library again.
+    Movies without a value are kept in their own list of titles and always come last.
+    Methods:
+        __init__(value_of):
+            initialise an empty index, value_of(details) gives a movie's value as a number (or None).
+        build(movies, value_of):
+            class method, creates the index over the movies dictionary.
+        update(title, details):
+            puts the movie at its new place, details None removes it.
+        titles(reverse, limit, offset):
+            yields the titles in order, only the requested page is looked at.
+        count(low, high) / range(low, high):
+            number of movies / titles with low <= value <= high, found by bisecting to the matching slice.
+        contains(title, low, high):
+            checks if the movie's value lies between low and high.
+    """
+    def __init__(self, value_of):
+        self.value_of = value_of
+        self._entries = []
+        self._missing = []
+        self._values = {}
+
+    def __len__(self):
+        return len(self._values)
+
+    @classmethod
+    def build(cls, movies: dict, value_of):
+        index = cls(value_of)
+        for title, details in movies.items():
+            value = value_of(details)
+            index._values[title] = value
+            if value is None:
+                index._missing.append(title)
+            else:
+                index._entries.append((value, title))
+        index._entries.sort()
+        index._missing.sort()
+        return index
+
+    def update(self, title, details):
+        """
+        :param title: (str) title of the changed movie
+        :param details: (dict) the movie's new details, None if it was deleted
+        """
+        if title in self._values:
+            value = self._values.pop(title)
+            if value is None:
+                del self._missing[bisect_left(self._missing, title)]
+            else:
+                del self._entries[bisect_left(self._entries, (value, title))]
+        if details is not None:
+            value = self.value_of(details)
+            self._values[title] = value
+            if value is None:
+                insort(self._missing, title)
+            else:
+                insort(self._entries, (value, title))
+
+    def _bounds(self, low, high):
+        """
+        :return: (tuple) start and stop position of the entries with low <= value <= high, None means unbounded
+        """
+        start = 0 if low is None else bisect_left(self._entries, low, key=itemgetter(0))
+        stop = len(self._entries) if high is None else bisect_right(self._entries, high, key=itemgetter(0))
+        return start, max(start, stop)
+
+    def count(self, low=None, high=None):
+        start, stop = self._bounds(low, high)
+        return stop - start
+
+    def range(self, low=None, high=None):
+        """
+        :return: (generator) titles with low <= value <= high in value order, movies without a value never match
+        """
+        start, stop = self._bounds(low, high)
+        for position in range(start, stop):
+            yield self._entries[position][1]
+
+    def contains(self, title, low=None, high=None):
+        value = self._values.get(title)
+        return value is not None and (low is None or value >= low) and (high is None or value <= high)
+
+    def titles(self, reverse=False, limit=None, offset=0):
+        """
+        :param reverse: (bool) True for highest/latest first, movies without a value still come last
+        :param limit: (int) maximum number of titles, None for all
+        :param offset: (int) number of titles to skip
+        :return: (generator) titles in order
+        """
+        entries = len(self._entries)
+        total = entries + len(self._missing)
+        stop = total if limit is None else min(total, offset + limit)
+        for position in range(offset, stop):
+            if position < entries:
+                yield self._entries[entries - 1 - position if reverse else position][1]
+            else:
+                position -= entries
+                yield self._missing[len(self._missing) - 1 - position if reverse else position]
@@ -1,95 +1,285 @@
 from os.path import join
-from data.istorage import IStorage
+from data.storage_file import FileStorage
+from data.movie_cache import MovieCache
+from data.locking import FileLock, atomic_write, write_locked
+from data.movie_journal import apply_record
 import csv
+import locale
 import os
 
+MOVIE_FIELDS = ["rating", "year", "poster", "note", "imdbID", "country"]
+# the op column is empty for the rows of the compacted snapshot, delta rows appended
+# after it say what they change: "add", "delete" (a tombstone) or "note"
+FIELDNAMES = ["title"] + MOVIE_FIELDS + ["op"]
 
-class StorageCSV(IStorage):
+
+class StorageCSV(FileStorage):
     """
-        Child of the Abstract(IStorage) class in order to work with accessing and saving files under csv format.
+        Child of the FileStorage class in order to work with accessing and saving files under csv format.
+        Changes are appended to the end of the file as delta rows (a new movie, a tombstone for a deleted one
+        or a new note) and resolved when the file is read, so an edit only writes one row instead of the whole file.
+        Once the dead rows (tombstones, notes and the rows a later add or delete replaced) pass compact_ratio
+        of all rows the file is compacted, i.e. rewritten with one row per movie. Added movies are live rows,
+        so a library that only grows is never rewritten.
+        Changes run under an exclusive lock and compacting writes a new file that is renamed over the old one,
+        so other processes never read a half written row or file.
         Methods:
-            __init__(file_path):
+            __init__(file_path, cached, compact_ratio):
                 initialise the StorageCsv object with the file_path for the file.
+                if cached is True the parsed movies are kept in memory until the file changes on disk.
             list_movies:
                 read the csv file and return a dictionary to be accesses within the program.
             add_movie(title, rating, year):
                 if the file is not there the file will then be created.
-                reads the csv file, receive the title, rating and
-                year from the user and adds the movie into the dictionary
-                then saves the dictionary back into the json file
+                appends the movie as an "add" row.
+            add_movies(movies):
+                appends several movies in one write, e.g. from a bulk import.
             delete_movie(title):
-                reads the csv file and checks if the given title is in the file. if so the movie is deleted and the file resaved.
-            update_movie(title, rating):
-                reads the csv file if the given title is there it will update the rating and resave the file.
-            _save_movies(movies):
-                writes/saves the movies dictionary back to the movies.csv file.
+                appends a tombstone row for the movie.
+            update_movie(title, note):
+                appends a row with the movie's new note.
+            compact():
+                rewrites the file with only the current movies, dropping the delta and dead rows.
+            _save_movies(movies, changed):
+                writes/saves the movies dictionary back to the movies.csv file,
+                changed lists the titles that changed so the cached indexes only update those.
 
         """
-    def __init__(self, file_path=join("storage", "movies.csv")):
+    def __init__(self, file_path=join("storage", "movies.csv"), cached=False, compact_ratio=0.25):
         self.file_path = file_path
+        self.compact_ratio = compact_ratio
+        self._cache = MovieCache(file_path) if cached else None
+        self._lock = FileLock(file_path)
+        # (file signature, (rows, delta rows, titles of the movies)) of the file as last counted or written
+        self._counts = None
+
+    def _rows(self):
+        try:
+            with open(self.file_path, mode="r", newline="") as csv_file:
+                yield from csv.DictReader(csv_file)
+        except FileNotFoundError:
+            pass
+
+    @staticmethod
+    def _details(row):
+        # files written before the poster, note, imdbID and country columns have them empty
+        return {field: row.get(field) or "" for field in MOVIE_FIELDS}
 
-    def list_movies(self):
+    @staticmethod
+    def _record(row):
+        """
+        turns a delta row into the same record format the json journal uses.
+        """
+        if row["op"] == "add":
+            return {"op": "add", "title": row["title"], "movie": StorageCSV._details(row)}
+        if row["op"] == "note":
+            return {"op": "note", "title": row["title"], "note": row["note"]}
+        return {"op": row["op"], "title": row["title"]}
+
+    def _read_movies(self):
         """
         reads the movies.csv file and returns a dictionary in the correct format to be worked with.
         :return: (dict) "title": title, "rating": rating, "year", year
         """
         movies = {}
+        for row in self._rows():
+            # files written before the op column have no op at all
+            if row.get("op"):
+                apply_record(movies, self._record(row))
+            else:
+                movies[row["title"]] = self._details(row)
+        return movies
+
+    @staticmethod
+    def _lines(binary_file, size):
+        """
+        yields the lines of the first size bytes of the file, rows appended after that are left out.
+        """
+        binary_file.seek(0)
+        encoding = locale.getpreferredencoding(False)
+        read = 0
+        for line in binary_file:
+            read += len(line)
+            if read > size:
+                return
+            yield line.decode(encoding)
+
+    def _iter_file(self):
+        """
+        reads the movies.csv file one row at a time. A first pass notes the row each movie was last added by
+        and the deletes and notes after it, so the second pass can stream the rows with them applied.
+        the lock is only held while the file is opened: rows are only appended at the end and compacting
+        replaces the file, so both passes read the file as it was then without holding up writers.
+        :return: (generator) of (title, details) tuples
+        """
+        with self._lock.shared():
+            counts = self._known_counts()
+            try:
+                csv_file = open(self.file_path, mode="rb")
+            except FileNotFoundError:
+                return
+            size = os.fstat(csv_file.fileno()).st_size
+        with csv_file:
+            # title: number of the row that last added it, title: ("delete"/"note", note) after that row
+            last_added, changes = {}, {}
+            if counts is None or counts[1]:
+                for number, row in enumerate(csv.DictReader(self._lines(csv_file, size))):
+                    title, op = row["title"], row.get("op")
+                    if op == "add":
+                        last_added[title] = number
+                        changes.pop(title, None)
+                    elif op == "delete":
+                        changes[title] = ("delete", None)
+                    elif op == "note" and changes.get(title, (None,))[0] != "delete":
+                        changes[title] = ("note", row["note"])
+            for number, row in enumerate(csv.DictReader(self._lines(csv_file, size))):
+                title, op = row["title"], row.get("op")
+                if op not in ("add", None, "") or last_added.get(title, number) != number:
+                    continue
+                change, note = changes.get(title, (None, None))
+                if change == "delete":
+                    continue
+                details = self._details(row)
+                if change == "note":
+                    details["note"] = note
+                yield title, details
+
+    def _signature(self):
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _known_counts(self):
+        """
+        :return: (tuple) the remembered (rows, delta rows) if the file didn't change since, else None
+        """
+        if self._counts is not None and self._counts[0] == self._signature():
+            return self._counts[1]
+        return None
+
+    def _row_counts(self):
+        """
+        counts the rows and the delta rows of the file and collects the titles of its movies,
+        only read again when the file changed on disk.
+        :return: (tuple) (rows, delta rows, titles), None if the file was written before the op column
+        """
+        signature = self._signature()
+        if self._counts is not None and self._counts[0] == signature:
+            return self._counts[1]
+        rows = deltas = 0
+        titles = set()
+        has_op = True
         try:
             with open(self.file_path, mode="r", newline="") as csv_file:
                 reader = csv.DictReader(csv_file)
+                has_op = reader.fieldnames is None or "op" in reader.fieldnames
                 for row in reader:
-                    movies[row["title"]] = {
-                        "rating": row["rating"],
-                        "year": row["year"],
-                        "poster": row["poster"],
-                        "note": row["note"],
-                        "imdbID": row["imdbID"],
-                        "country": row["country"]
-                    }
+                    rows += 1
+                    if row.get("op"):
+                        deltas += 1
+                    self._count_title(titles, row)
         except FileNotFoundError:
             pass
-        return movies
+        self._counts = (signature, (rows, deltas, titles) if has_op else None)
+        return self._counts[1]
 
-    def update_movie(self, title: str, note: str):
-        movies = self.list_movies()
-        # update the movie rating
-        if title in movies:
-            movies[title]["note"] = note
-            self._save_movies(movies)
+    @staticmethod
+    def _count_title(titles, row):
+        """
+        keeps the set of titles in the library up to date with one more row.
+        """
+        if row.get("op") == "delete":
+            titles.discard(row["title"])
+        elif row.get("op") != "note":
+            titles.add(row["title"])
 
-    def add_movie(self, title: str, rating: float, year: int, poster: str, imdbID: str, country: str):
+    def _append_rows(self, rows):
         """
-        Adds a new movie to the csv file! if the file doesn't exist it will create the file.
+        appends delta rows to the end of the file, creating it (with the header) if needed.
+        :param rows: (list) row dictionaries with every field in FIELDNAMES
         """
-        file_exists = os.path.isfile(self.file_path)
+        counts = self._row_counts()
+        if counts is None:
+            # an older file without the op column, rewrite it once in the new layout
+            self.compact()
+            counts = self._row_counts()
+        write_header = not os.path.isfile(self.file_path) or os.path.getsize(self.file_path) == 0
 
         with open(self.file_path, mode="a", newline="") as csv_file:
-            fieldnames = ["title", "rating", "year", "poster", "imdbID", "country"]
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-
-            if not file_exists:
+            writer = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
+            if write_header:
                 writer.writeheader()
+            writer.writerows(rows)
+
+        titles = counts[2]
+        for row in rows:
+            self._count_title(titles, row)
+        self._counts = (self._signature(), (counts[0] + len(rows), counts[1] + len(rows), titles))
+
+    def _maybe_compact(self):
+        rows, _, titles = self._row_counts()
+        # every row but one per movie is dead
+        if rows - len(titles) > self.compact_ratio * rows:
+            self.compact()
+
+    @write_locked
+    def compact(self):
+        """
+        rewrites the file with the current movies only, the delta rows and the rows they replaced are dropped.
+        """
+        self._save_movies(self.list_movies(), changed=[])
+
+    @write_locked
+    def update_movie(self, title: str, note: str):
+        movies = self.list_movies() if self._cache is not None else None
+        self._append_rows([{"title": title, "note": note, "op": "note"}])
+        if movies is not None:
+            if title in movies:
+                movies[title]["note"] = note
+            self._cache.put(movies, changed=[title])
+        self._maybe_compact()
+
+    def add_movie(self, title: str, rating: float, year: int, poster: str, imdbID: str, country: str):
+        """
+        Adds a new movie to the csv file! if the file doesn't exist it will create the file.
+        """
+        self.add_movies({title: {
+            "rating": str(rating),
+            "year": str(year),
+            "poster": poster,
+            "note": "",
+            "imdbID": imdbID,
+            "country": country
+        }})
 
-            writer.writerow({
-                "title": title,
-                "rating": rating,
-                "year": year,
-                "poster": poster,
-                "imdbID": imdbID,
-                "country": country
-            })
+    @write_locked
+    def add_movies(self, movies):
+        # with the cache on we keep the in memory copy in step with the appended rows
+        library = self.list_movies() if self._cache is not None else None
+        self._append_rows([
+            {"title": title, **{field: info.get(field, "") for field in MOVIE_FIELDS}, "op": "add"}
+            for title, info in movies.items()
+        ])
+        if library is not None:
+            for title, info in movies.items():
+                library[title] = {field: info.get(field, "") for field in MOVIE_FIELDS}
+            self._cache.put(library, changed=list(movies))
+        self._maybe_compact()
 
+    @write_locked
     def delete_movie(self, title: str):
-        movies = self.list_movies()
-        # delete the movie
-        if title in movies:
-            del movies[title]
-            self._save_movies(movies)
-
-    def _save_movies(self, movies: dict):
-        with open(self.file_path, mode="w", newline="") as csv_file:
-            fieldnames = ["title", "rating", "year", "poster", "note", "imdbID", "country"]
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+        movies = self.list_movies() if self._cache is not None else None
+        self._append_rows([{"title": title, "op": "delete"}])
+        if movies is not None:
+            movies.pop(title, None)
+            self._cache.put(movies, changed=[title])
+        self._maybe_compact()
+
+    def _save_movies(self, movies: dict, changed=None):
+        with atomic_write(self.file_path, newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=FIELDNAMES)
             writer.writeheader()
             for title, info in movies.items():
                 writer.writerow({
@@ -97,9 +287,11 @@ class StorageCSV(IStorage):
                     "rating": info["rating"],
                     "year": info["year"],
                     "poster": info["poster"],
-                    "note": info["note"],
+                    "note": info.get("note", ""),
                     "imdbID": info["imdbID"],
                     "country": info["country"],
+                    "op": "",
                 })
-
-
+        self._counts = (self._signature(), (len(movies), 0, set(movies)))
+        if self._cache is not None:
+            self._cache.put(movies, changed)
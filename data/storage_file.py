@@ -0,0 +1,113 @@
+from abc import abstractmethod
+from data.istorage import IStorage
+from data.fields import project
+from data.identity_index import IdentityIndex
+from data.movie import SORT_VALUES
+from data.movie_cache import file_signature
+from data.sorted_index import SortedIndex
+
+
+class FileStorage(IStorage):
+    """
+    Parent of the storages keeping the whole library in one file (json and csv).
+    Adds the optional in-memory cache, and while the cache is on the numpy columns and the sorted
+    rating/year indexes are kept next to the cached movies instead of being rebuilt for every query.
+    Child classes set self.file_path, self._cache (a MovieCache or None) and self._lock (a FileLock) in __init__,
+    implement _read_movies() and _iter_file() and pass the changed titles to self._cache.put() after every write.
+    Reads hold the shared lock, the methods changing the file are decorated with write_locked.
+    Methods:
+        list_movies:
+            returns the cached movies, or reads the file when there is no (valid) cache.
+        iter_movies(fields):
+            streams the movies from the cache, or lazily from the file with _iter_file().
+        sorted_movies(key, reverse, limit, offset):
+            a page of the movies in rating/year order, straight from the sorted index when cached.
+        query_movies(...):
+            when cached, rating and year ranges are answered by bisecting the sorted indexes.
+        find_movie(title, imdb_id):
+            when cached, answered from an IdentityIndex kept next to the sorted indexes.
+        signature():
+            the inode, modification time and size of the file(s) in _watched_files().
+        _load():
+            _read_movies() under the shared lock.
+        _read_movies():
+            reads and returns the movies dictionary from the file.
+        _iter_file():
+            yields the movies from the file one at a time.
+    """
+    def _watched_files(self):
+        """
+        :return: (tuple) the files the library is read from, a change to any of them is a change to the library
+        """
+        return self.file_path,
+
+    def signature(self):
+        return file_signature(self._watched_files())
+
+    def _load(self):
+        with self._lock.shared():
+            return self._read_movies()
+
+    def list_movies(self):
+        if self._cache is not None:
+            with self._lock.shared():
+                return self._cache.load(self._read_movies)
+        return self._load()
+
+    def iter_movies(self, fields=None):
+        if self._cache is not None:
+            # the movies are in memory anyway
+            yield from super().iter_movies(fields)
+            return
+        for title, details in self._iter_file():
+            yield title, project(details, fields)
+
+    def _columns(self, movies):
+        from data.columns import MovieColumns
+        if self._cache is not None:
+            return self._cache.derived("columns", MovieColumns.from_movies, self._load)
+        return MovieColumns.from_movies(movies)
+
+    def _index(self, key):
+        """
+        returns the cached SortedIndex over "rating" or "year", building it on first use.
+        """
+        return self._cache.index(key, lambda movies: SortedIndex.build(movies, SORT_VALUES[key]),
+                                 self._load)
+
+    def identity_index(self):
+        if self._cache is None:
+            return super().identity_index()
+        # kept up to date on every change like the sorted indexes, so a lookup is a dictionary access
+        return self._cache.index("identity", IdentityIndex.build, self._load)
+
+    def sorted_movies(self, key="rating", reverse=False, limit=None, offset=0):
+        if self._cache is None:
+            return super().sorted_movies(key, reverse, limit, offset)
+        movies = self.list_movies()
+        return ((title, movies[title]) for title in self._index(key).titles(reverse, limit, offset))
+
+    def _range_candidates(self, movies, min_rating, max_rating, start_year, end_year):
+        if self._cache is None:
+            return super()._range_candidates(movies, min_rating, max_rating, start_year, end_year)
+        ranges = []
+        if min_rating is not None or max_rating is not None:
+            ranges.append((self._index("rating"), min_rating, max_rating))
+        if start_year is not None or end_year is not None:
+            ranges.append((self._index("year"), start_year, end_year))
+        # walk the smaller slice and check its titles against the other range,
+        # so the cost follows the number of matches instead of the library size
+        ranges.sort(key=lambda item: item[0].count(item[1], item[2]))
+        index, low, high = ranges[0]
+        candidates = index.range(low, high)
+        for other, other_low, other_high in ranges[1:]:
+            candidates = [title for title in candidates if other.contains(title, other_low, other_high)]
+        return candidates
+
+    @abstractmethod
+    def _read_movies(self):
+        pass
+
+    @abstractmethod
+    def _iter_file(self):
+        pass
@@ -1,65 +1,163 @@
 from os.path import join
-from data.istorage import IStorage
+from data.storage_file import FileStorage
+from data.movie_cache import MovieCache
+from data.movie_journal import MovieJournal, apply_changes, apply_record
+from data.json_stream import iter_json_object
+from data.locking import FileLock, atomic_write, write_locked
 import json
 
 
-class StorageJson(IStorage):
+class StorageJson(FileStorage):
     """
-    Child of the Abstract(IStorage) class in order to work with accessing and saving files under json format.
+    Child of the FileStorage class in order to work with accessing and saving files under json format.
+    The file is saved by writing a new file and renaming it over the old one, and every change runs under
+    an exclusive lock, so other processes never read a half written file or lose each other's edits.
     Methods:
-        __init__(file_path):
+        __init__(file_path, cached, journaled, compact_threshold):
             initialise the StorageJson object with the file_path for the file.
+            if cached is True the parsed movies are kept in memory until the file changes on disk.
+            if journaled is True every change is appended to a journal next to the json file
+            instead of rewriting the whole file, once the journal is bigger than compact_threshold
+            bytes it is folded back into the json file.
         list_movies:
             read the json file and return a dictionary to be accesses within the program.
         add_movie(title, rating, year):
             reads the json file, receive the title, rating and
             year from the user and adds the movie into the dictionary
             then saves the dictionary back into the json file
+        add_movies(movies):
+            adds several movies with one save, or one journal write.
         delete_movie(title):
             reads the json file and checks if the given title is in the file.
             If so the movie is deleted and the file resaved.
         update_movie(title, rating):
             reads the json file if the given title is there it will update the rating and resave the file.
-        _save_movies(movies):
-            writes/saves the movies dictionary back to the movies.json file.
+        compact():
+            folds the journal into a fresh json snapshot.
+        _save_movies(movies, changed):
+            writes/saves the movies dictionary back to the movies.json file,
+            changed lists the titles that changed so the cached indexes only update those.
 
     """
-    def __init__(self, file_path=join("storage", "movies.json")):
+    def __init__(self, file_path=join("storage", "movies.json"), cached=False, journaled=False,
+                 compact_threshold=1024 * 1024):
         self.file_path = file_path
+        self.compact_threshold = compact_threshold
+        self._journal = MovieJournal(file_path + ".journal") if journaled else None
+        self._lock = FileLock(file_path)
+        if not cached:
+            self._cache = None
+        else:
+            self._cache = MovieCache(*self._watched_files())
 
-    def list_movies(self):
+    def _watched_files(self):
+        if self._journal is not None:
+            return self.file_path, self._journal.file_path
+        return self.file_path,
+
+    def _read_movies(self):
         try:
             with open(self.file_path, "r") as json_file:
-                return json.load(json_file)
+                movies = json.load(json_file)
         except FileNotFoundError:
-            return {}
+            movies = {}
+        if self._journal is not None:
+            self._journal.replay(movies)
+        return movies
+
+    def _iter_file(self):
+        """
+        streams the movies out of the json file, with the journal's changes applied on the way.
+        the lock is only held until the file is open: a save replaces the file instead of writing
+        into it, so the opened snapshot stays as it was and streaming it doesn't hold up writers.
+        """
+        with self._lock.shared():
+            changes = self._journal.pending() if self._journal is not None else {}
+            try:
+                json_file = open(self.file_path, "r")
+            except FileNotFoundError:
+                json_file = None
+        if json_file is None:
+            yield from apply_changes([], changes)
+            return
+        with json_file:
+            yield from apply_changes(iter_json_object(json_file), changes)
 
+    @write_locked
     def update_movie(self, title: str, note: str):
+        if self._journal is not None:
+            self._log({"op": "note", "title": title, "note": note})
+            return
         movies = self.list_movies()
         # update the movie rating
         if title in movies:
             movies[title]["note"] = note
-            self._save_movies(movies)
+            self._save_movies(movies, changed=[title])
 
+    @write_locked
     def add_movie(self, title: str, rating: float, year: int, poster: str, imdbID: str, country: str):
         """Reads the json file adds a movie into the correct format and then saves the json file"""
+        movie = {"rating": rating,
+                 "year": year,
+                 "poster": poster,
+                 "imdbID": imdbID,
+                 "country": country,
+                 }
+        if self._journal is not None:
+            self._log({"op": "add", "title": title, "movie": movie})
+            return
         movies = self.list_movies()
-        movies[title] = {"rating": rating,
-                         "year": year,
-                         "poster": poster,
-                         "imdbID": imdbID,
-                         "country": country,
-                         }
+        movies[title] = movie
         # save back to file
-        self._save_movies(movies)
+        self._save_movies(movies, changed=[title])
+
+    @write_locked
+    def add_movies(self, movies: dict):
+        if self._journal is not None:
+            self._log(*({"op": "add", "title": title, "movie": dict(details)} for title, details in movies.items()))
+            return
+        library = self.list_movies()
+        library.update(movies)
+        self._save_movies(library, changed=list(movies))
 
+    @write_locked
     def delete_movie(self, title: str):
+        if self._journal is not None:
+            self._log({"op": "delete", "title": title})
+            return
         movies = self.list_movies()
         # delete the movie
         if title in movies:
             del movies[title]
-            self._save_movies(movies)
+            self._save_movies(movies, changed=[title])
+
+    @write_locked
+    def compact(self):
+        """
+        writes the current library (snapshot plus journal) into a fresh json file and empties the journal.
+        """
+        self._save_movies(self.list_movies(), changed=[])
+
+    def _log(self, *records: dict):
+        """
+        appends changes to the journal, keeps the cached movies in step
+        and compacts the journal once it grows past the threshold.
+        """
+        movies = self.list_movies() if self._cache is not None else None
+        self._journal.append(*records)
+        if movies is not None:
+            for record in records:
+                apply_record(movies, record)
+            self._cache.put(movies, changed=[record["title"] for record in records])
+        if self._journal.size() > self.compact_threshold:
+            self.compact()
 
-    def _save_movies(self, movies: dict):
-        with open(self.file_path, "w") as json_file:
-            json.dump(movies, json_file, indent=4)
+    def _save_movies(self, movies: dict, changed=None):
+        with atomic_write(self.file_path) as json_file:
+            # cached movies are Movie records, dict() gives back their details as stored
+            json.dump(movies, json_file, indent=4, default=dict)
+        # the snapshot now holds every change so the journal can start over
+        if self._journal is not None:
+            self._journal.clear()
+        if self._cache is not None:
+            self._cache.put(movies, changed)
@@ -0,0 +1,69 @@
+from data.storage_file import FileStorage
+from data.locking import FileLock
+from data.movie import Movie
+from data.movie_cache import MovieCache
+
+
+class StorageMemory(FileStorage):
+    """
+    Child of the FileStorage class keeping the library in memory only, nothing is written to disk.
+    The movies are always "cached", so the numpy columns and the sorted rating/year indexes are built once
+    and then updated per change like in a cached file storage. Used as the server's read snapshot.
+    Changes replace a movie's details dictionary instead of changing it in place, so details handed
+    out earlier stay as they were.
+    Methods:
+        __init__(movies):
+            initialise the storage with a copy of the given movies dictionary.
+        add_movie(title, rating, year, poster, imdbID, country) / add_movies(movies):
+            adds the movie(s).
+        delete_movie(title):
+            deletes the movie if it is there.
+        update_movie(title, note):
+            sets the note of the movie if it is there.
+        signature():
+            a counter going up with every change.
+        _save_movies(movies, changed):
+            replaces the whole library.
+    """
+    def __init__(self, movies=None):
+        self.file_path = None
+        self._movies = {title: Movie.from_details(details) for title, details in (movies or {}).items()}
+        self._cache = MovieCache()
+        self._lock = FileLock(None)
+        self._cache.put(self._movies)
+        self._version = 0
+
+    def signature(self):
+        return self._version
+
+    def _put(self, changed):
+        self._version += 1
+        self._cache.put(self._movies, changed)
+
+    def _read_movies(self):
+        return self._movies
+
+    def _iter_file(self):
+        yield from self._movies.items()
+
+    def add_movie(self, title: str, rating: float, year: int, poster: str, imdbID: str, country: str):
+        self.add_movies({title: {"rating": rating, "year": year, "poster": poster, "note": "",
+                                 "imdbID": imdbID, "country": country}})
+
+    def add_movies(self, movies):
+        for title, details in movies.items():
+            self._movies[title] = Movie.from_details(details)
+        self._put(list(movies))
+
+    def delete_movie(self, title: str):
+        if self._movies.pop(title, None) is not None:
+            self._put([title])
+
+    def update_movie(self, title: str, note: str):
+        if title in self._movies:
+            self._movies[title] = Movie.from_details({**self._movies[title], "note": note})
+            self._put([title])
+
+    def _save_movies(self, movies: dict, changed=None):
+        self._movies = movies
+        self._put(changed)
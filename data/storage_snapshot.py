@@ -0,0 +1,162 @@
+import os
+from os.path import join
+from data.identity_index import IdentityIndex
+from data.istorage import IStorage
+from data.locking import FileLock, atomic_write, write_locked
+from data.snapshot import Snapshot, SnapshotMovies, SnapshotTitles, SnapshotWriter, write_snapshot
+
+
+class StorageSnapshot(IStorage):
+    """
+    Child of the Abstract(IStorage) class working with a binary snapshot file (see data/snapshot.py).
+    Opening the library maps the file instead of parsing it, so a big library is ready at once:
+    stats, filters, histograms and sorted listings read the rating/year columns and the sort orders
+    in place and only decode the titles and movies they return.
+    The file is never changed in place, every change writes a new snapshot (copying the untouched
+    movies without decoding them) that replaces the old one under the exclusive lock, like the json storage.
+    Methods:
+        __init__(file_path):
+            initialise the StorageSnapshot object with the file_path for the file.
+        list_movies:
+            a read only dictionary of the movies, decoding a movie only when it is looked up.
+        iter_movies(fields):
+            streams the movies in file order, only the asked for fields are decoded.
+        add_movie(title, rating, year, poster, imdbID, country) / add_movies(movies):
+            writes a new snapshot with the movie(s) added, or replaced if the title is already there.
+        delete_movie(title):
+            writes a new snapshot without the movie.
+        update_movie(title, note):
+            writes a new snapshot with the note changed.
+        columns():
+            numpy views on the rating and year columns of the file.
+        sorted_movies(key, reverse, limit, offset):
+            a page of the movies in rating/year order, read from the order stored in the file.
+        find_movie(title, imdb_id):
+            answered from an IdentityIndex built once per version of the file.
+        _save_movies(movies):
+            replaces the whole library with the given movies dictionary.
+    """
+    def __init__(self, file_path=join("storage", "movies.rfx")):
+        self.file_path = file_path
+        self._lock = FileLock(file_path)
+        self._snapshot = None
+        self._signature = None
+        self._columns_cache = None
+        self._identity_cache = None
+
+    def _current_signature(self):
+        try:
+            stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _open(self):
+        """
+        returns the mapped snapshot, mapped again when the file was replaced since.
+        """
+        signature = self._current_signature()
+        if self._snapshot is None or signature != self._signature:
+            with self._lock.shared():
+                self._signature = self._current_signature()
+                self._snapshot = Snapshot.open(self.file_path)
+            self._columns_cache = None
+            self._identity_cache = None
+        return self._snapshot
+
+    def signature(self):
+        return self._current_signature()
+
+    def list_movies(self):
+        return SnapshotMovies(self._open())
+
+    def iter_movies(self, fields=None):
+        yield from self._open().items(fields)
+
+    def columns(self):
+        import numpy as np
+        from data.columns import MovieColumns
+        snapshot = self._open()
+        if self._columns_cache is None:
+            offsets = snapshot.offsets
+            ratings = np.frombuffer(snapshot.buffer, dtype="<f4", count=snapshot.count, offset=offsets["ratings"])
+            years = np.frombuffer(snapshot.buffer, dtype="<i2", count=snapshot.count, offset=offsets["years"])
+            self._columns_cache = MovieColumns(SnapshotTitles(snapshot), ratings, years)
+        return self._columns_cache
+
+    def _columns(self, movies):
+        return self.columns()
+
+    def identity_index(self):
+        snapshot = self._open()
+        if self._identity_cache is None:
+            # only the IMDb IDs are decoded, and only once per version of the file
+            self._identity_cache = IdentityIndex.build(dict(snapshot.items(fields=("imdbID",))))
+        return self._identity_cache
+
+    def sorted_movies(self, key="rating", reverse=False, limit=None, offset=0):
+        snapshot = self._open()
+        records = snapshot.ordered(key, reverse, limit, offset)
+        if limit is not None and limit < snapshot.count // 8:
+            return ((snapshot.title(record), snapshot.details(record)) for record in records)
+        # a big page is decoded in file order in one pass, which is faster than jumping from movie to movie
+        movies = list(snapshot.items())
+        return (movies[record] for record in records)
+
+    def _rewrite(self, changes):
+        """
+        writes a new snapshot with the changes applied, the other movies are copied as they are.
+        :param changes: (dict) title: new details, or None to delete the movie. Changed movies keep their
+                        place, new ones are added at the end.
+        """
+        snapshot = self._open()
+        changed = {}
+        added = {}
+        for title, details in changes.items():
+            record = snapshot.find(title)
+            if record is None:
+                added[title] = details
+            else:
+                changed[record] = (title, details)
+        with atomic_write(self.file_path, "wb") as snapshot_file:
+            writer = SnapshotWriter(snapshot_file)
+            start = 0
+            # the movies between two changed ones are copied in one piece
+            for record in sorted(changed):
+                writer.copy(snapshot, start, record)
+                title, details = changed[record]
+                if details is not None:
+                    writer.add(title, details)
+                start = record + 1
+            writer.copy(snapshot, start, snapshot.count)
+            for title, details in added.items():
+                if details is not None:
+                    writer.add(title, details)
+            writer.close()
+        self._snapshot = None
+
+    @write_locked
+    def add_movie(self, title: str, rating: float, year: int, poster: str, imdbID: str, country: str):
+        self._rewrite({title: {"rating": rating, "year": year, "poster": poster, "imdbID": imdbID,
+                               "country": country}})
+
+    @write_locked
+    def add_movies(self, movies: dict):
+        self._rewrite(movies)
+
+    @write_locked
+    def delete_movie(self, title: str):
+        if title in self.list_movies():
+            self._rewrite({title: None})
+
+    @write_locked
+    def update_movie(self, title: str, note: str):
+        movies = self.list_movies()
+        if title in movies:
+            self._rewrite({title: {**movies[title], "note": note}})
+
+    @write_locked
+    def _save_movies(self, movies: dict):
+        with atomic_write(self.file_path, "wb") as snapshot_file:
+            write_snapshot(snapshot_file, movies.items())
+        self._snapshot = None
@@ -0,0 +1,232 @@
+from os.path import join
+from data.istorage import IStorage
+from data.fields import parse_imdb_id, parse_rating, parse_year, split_countries
+from data.movie_cache import file_signature
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS movies (
+    title TEXT PRIMARY KEY,
+    rating TEXT,
+    year TEXT,
+    poster TEXT,
+    note TEXT NOT NULL DEFAULT '',
+    imdbID TEXT,
+    country TEXT,
+    rating_value REAL,
+    year_value INTEGER
+);
+CREATE TABLE IF NOT EXISTS movie_countries (
+    title TEXT NOT NULL,
+    country TEXT NOT NULL COLLATE NOCASE
+);
+CREATE INDEX IF NOT EXISTS idx_movies_rating_title ON movies (rating_value, title);
+CREATE INDEX IF NOT EXISTS idx_movies_year_title ON movies (year_value, title);
+CREATE INDEX IF NOT EXISTS idx_movies_title_nocase ON movies (title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS idx_movies_imdb ON movies (imdbID);
+CREATE INDEX IF NOT EXISTS idx_movie_countries_country ON movie_countries (country);
+CREATE INDEX IF NOT EXISTS idx_movie_countries_title ON movie_countries (title);
+"""
+
+COLUMNS = ("rating", "year", "poster", "note", "imdbID", "country")
+
+
+class SQLiteIdentityIndex:
+    """
+    The lookups of an IdentityIndex (see data/identity_index.py) answered by indexed queries,
+    so nothing has to be read in advance.
+    """
+    def __init__(self, connection):
+        self._connection = connection
+
+    def _title(self, query, params):
+        row = self._connection.execute(query, params).fetchone()
+        return row[0] if row is not None else None
+
+    def title_for(self, title):
+        # the NOCASE index only folds ascii letters, the exact match covers the rest
+        return self._title("SELECT title FROM movies WHERE title = ? COLLATE NOCASE LIMIT 1",
+                           (" ".join(title.split()),))
+
+    def title_for_imdb(self, imdb):
+        imdb_id = parse_imdb_id(imdb)
+        if imdb_id is None:
+            return None
+        # stored as the link fetch_movie builds, older rows may hold the bare ID
+        return self._title("SELECT title FROM movies WHERE imdbID IN (?, ?) LIMIT 1",
+                           (f"https://www.imdb.com/title/{imdb_id}/", imdb_id))
+
+    def find(self, title=None, imdb_id=None):
+        if imdb_id is not None:
+            found = self.title_for_imdb(imdb_id)
+            if found is not None:
+                return found
+        return self.title_for(title) if title is not None else None
+
+    def imdb_of(self, title):
+        return parse_imdb_id(self._title("SELECT imdbID FROM movies WHERE title = ?", (title,)))
+
+
+class StorageSQLite(IStorage):
+    """
+    Child of the Abstract(IStorage) class in order to work with a SQLite database file.
+    Next to the values as OMDb returns them, the numeric rating and start year are stored in
+    indexed columns and every country gets a row in movie_countries, so filters and sorting run
+    in the database instead of scanning the whole library in Python.
+    Methods:
+        __init__(file_path):
+            initialise the StorageSQLite object and create the tables/indexes if needed.
+        list_movies:
+            read every movie and return a dictionary in the same format as the json storage.
+        iter_movies(fields):
+            streams the movies (or just the given fields) straight from a cursor.
+        add_movie(title, rating, year, poster, imdbID, country):
+            inserts the movie, replacing a movie with the same title.
+        add_movies(movies):
+            inserts several movies (with their notes, if they have one) in a single transaction.
+        delete_movie(title):
+            deletes the movie with the given title.
+        update_movie(title, note):
+            sets the note of the movie with the given title.
+        columns():
+            the numeric rating/year columns read straight from the indexed columns.
+        identity_index():
+            a SQLiteIdentityIndex, answering the duplicate lookups with indexed queries.
+        query_movies(min_rating, max_rating, start_year, end_year, country, title_prefix):
+            indexed lookup of the movies matching every given filter.
+        sorted_movies(key, reverse, limit, offset):
+            a page of the movies ordered by rating or year using the indexes.
+        close():
+            closes the database connection.
+        _save_movies(movies):
+            replaces the whole library with the given movies dictionary.
+    """
+    def __init__(self, file_path=join("storage", "movies.db")):
+        self.file_path = file_path
+        # the connection may be handed to another thread (e.g. the server's writer), never to two at once
+        self._connection = sqlite3.connect(file_path, check_same_thread=False)
+        self._connection.executescript(SCHEMA)
+
+    def _rows_to_movies(self, rows):
+        return {row[0]: dict(zip(COLUMNS, row[1:])) for row in rows}
+
+    def _select(self, where="", params=(), order=""):
+        query = f"SELECT title, {', '.join(COLUMNS)} FROM movies {where} {order}"
+        return self._connection.execute(query, params)
+
+    def _insert(self, title, rating, year, poster, imdbID, country, note=""):
+        self._connection.execute("DELETE FROM movie_countries WHERE title = ?", (title,))
+        self._connection.execute(
+            "INSERT OR REPLACE INTO movies "
+            "(title, rating, year, poster, note, imdbID, country, rating_value, year_value) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (title, rating, year, poster, note, imdbID, country, parse_rating(rating), parse_year(year))
+        )
+        self._connection.executemany(
+            "INSERT INTO movie_countries (title, country) VALUES (?, ?)",
+            [(title, name) for name in split_countries(country)]
+        )
+
+    def list_movies(self):
+        return self._rows_to_movies(self._select())
+
+    def iter_movies(self, fields=None):
+        fields = COLUMNS if fields is None else fields
+        unknown = set(fields).difference(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown movie fields: {', '.join(sorted(unknown))}")
+        columns = ", ".join(("title",) + tuple(fields))
+        for row in self._connection.execute(f"SELECT {columns} FROM movies"):
+            yield row[0], dict(zip(fields, row[1:]))
+
+    def add_movie(self, title: str, rating: float, year: int, poster: str, imdbID: str, country: str):
+        with self._connection:
+            self._insert(title, rating, year, poster, imdbID, country)
+
+    def add_movies(self, movies: dict):
+        with self._connection:
+            for title, info in movies.items():
+                self._insert(title, info.get("rating"), info.get("year"), info.get("poster"),
+                             info.get("imdbID"), info.get("country"), info.get("note") or "")
+
+    def delete_movie(self, title: str):
+        with self._connection:
+            self._connection.execute("DELETE FROM movie_countries WHERE title = ?", (title,))
+            self._connection.execute("DELETE FROM movies WHERE title = ?", (title,))
+
+    def update_movie(self, title: str, note: str):
+        with self._connection:
+            self._connection.execute("UPDATE movies SET note = ? WHERE title = ?", (note, title))
+
+    def columns(self):
+        import numpy as np
+        from data.columns import MISSING_YEAR, MovieColumns
+        rows = self._connection.execute("SELECT title, rating_value, year_value FROM movies").fetchall()
+        titles = np.array([row[0] for row in rows], dtype=object)
+        ratings = np.array([row[1] for row in rows], dtype=np.float64).astype(np.float32)
+        years = np.array([MISSING_YEAR if row[2] is None else row[2] for row in rows], dtype=np.int16)
+        return MovieColumns(titles, ratings, years)
+
+    def identity_index(self):
+        return SQLiteIdentityIndex(self._connection)
+
+    def query_movies(self, min_rating=None, max_rating=None, start_year=None, end_year=None,
+                     country=None, title_prefix=None):
+        conditions = []
+        params = []
+        if min_rating is not None:
+            conditions.append("rating_value >= ?")
+            params.append(min_rating)
+        if max_rating is not None:
+            conditions.append("rating_value <= ?")
+            params.append(max_rating)
+        if start_year is not None:
+            conditions.append("year_value >= ?")
+            params.append(start_year)
+        if end_year is not None:
+            conditions.append("year_value <= ?")
+            params.append(end_year)
+        if country is not None:
+            conditions.append("title IN (SELECT title FROM movie_countries WHERE country = ?)")
+            params.append(country.strip())
+        if title_prefix:
+            # a range on the NOCASE index instead of LIKE, so the prefix needs no escaping
+            conditions.append("title >= ? COLLATE NOCASE AND title < ? COLLATE NOCASE")
+            params.extend([title_prefix, title_prefix + "\U0010ffff"])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._rows_to_movies(self._select(where, params))
+
+    def sorted_movies(self, key="rating", reverse=False, limit=None, offset=0):
+        column = {"rating": "rating_value", "year": "year_value"}[key]
+        direction = "DESC" if reverse else "ASC"
+        # ordering on (value, title) matches the index, so a page only reads the rows it returns
+        page = f"LIMIT {-1 if limit is None else int(limit)} OFFSET {int(offset)}"
+        rows = self._select(f"WHERE {column} IS NOT NULL",
+                            order=f"ORDER BY {column} {direction}, title {direction} {page}").fetchall()
+        if limit is not None and len(rows) == limit:
+            return iter(list(self._rows_to_movies(rows).items()))
+        # the page reaches past the movies with a value into the ones without
+        if rows or offset == 0:
+            missing_offset = 0
+        else:
+            with_value = self._connection.execute(f"SELECT COUNT(*) FROM movies WHERE {column} IS NOT NULL")
+            missing_offset = max(0, offset - with_value.fetchone()[0])
+        missing_limit = -1 if limit is None else limit - len(rows)
+        missing = self._select(f"WHERE {column} IS NULL",
+                               order=f"ORDER BY title {direction} LIMIT {missing_limit} OFFSET {missing_offset}")
+        return iter(list(self._rows_to_movies(rows).items()) + list(self._rows_to_movies(missing).items()))
+
+    def signature(self):
+        # in WAL mode the changes sit in the -wal file until they are checkpointed into the database
+        return file_signature((self.file_path, self.file_path + "-wal"))
+
+    def close(self):
+        self._connection.close()
+
+    def _save_movies(self, movies: dict):
+        with self._connection:
+            self._connection.execute("DELETE FROM movie_countries")
+            self._connection.execute("DELETE FROM movies")
+            for title, info in movies.items():
+                self._insert(title, info.get("rating"), info.get("year"), info.get("poster"),
+                             info.get("imdbID"), info.get("country"), info.get("note") or "")
@@ -1,16 +1,36 @@
 import argparse
+import json
 import os
-from movie_app import MovieApp
+import sys
+from movie_app import MovieApp, OMDb_url, get_api_key
+from omdb import ResponseCache
+from cli import add_subcommands, run_cli
+from metrics import METRICS, InstrumentedStorage, profile_call
 from data.storage_json import StorageJson
 from data.storage_csv import StorageCSV
+from data.storage_sqlite import StorageSQLite
+from data.storage_snapshot import StorageSnapshot
 
 
 class MovieApplicationRun:
-    def __init__(self, storage_type="json"):
+    def __init__(self, storage_type="json", file_path=None, cached=False, journaled=False, fast=False,
+                 metrics_file=None, profile_dir=None):
+        self.fast = fast
+        self.metrics_file = metrics_file
+        self.profile_dir = profile_dir
+        # without a file path every storage falls back to its default file in storage/
+        options = {} if file_path is None else {"file_path": file_path}
         if storage_type == "csv":
-            self.storage = StorageCSV()
+            self.storage = StorageCSV(cached=cached, **options)
+        elif storage_type == "sqlite":
+            self.storage = StorageSQLite(**options)
+        elif storage_type == "snapshot":
+            self.storage = StorageSnapshot(**options)
         else:
-            self.storage = StorageJson()
+            self.storage = StorageJson(cached=cached, journaled=journaled, **options)
+        if metrics_file is not None:
+            # every storage call is timed, the app and the commands only see the wrapper
+            self.storage = InstrumentedStorage(self.storage)
         self.app = MovieApp(self.storage)
         # Initialize a dispatcher dictionary
         self.menu_options = {
@@ -30,12 +50,28 @@ class MovieApplicationRun:
         }
 
     def run(self):
-        self.app.welcome_page()
+        if not self.fast:
+            self.app.welcome_page()
         while True:
             user_input = self.app.main_menu()
             # Call the corresponding function or return if not valid
             func = self.menu_options.get(user_input, self.app.returner_func)
-            func()
+            self.run_action(func)
+
+    def run_action(self, func):
+        """
+        runs one menu action, timed as "action" in the metrics and profiled if a profile_dir is set.
+        the metrics file is written after every action so it is up to date when the app is left.
+        """
+        try:
+            with METRICS.timer("action", action=func.__name__):
+                if self.profile_dir is not None:
+                    profile_call(func, self.profile_dir, func.__name__)
+                else:
+                    func()
+        finally:
+            if self.metrics_file is not None:
+                METRICS.dump(self.metrics_file)
 
 
 def determine_storage_type(file_path: str) -> str:
@@ -47,14 +83,40 @@ def determine_storage_type(file_path: str) -> str:
         return "json"
     elif extension == ".csv":
         return "csv"
+    elif extension in (".db", ".sqlite", ".sqlite3"):
+        return "sqlite"
+    elif extension == ".rfx":
+        return "snapshot"
     else:
-        raise ValueError("Unsupported file type. At this time we only support .json and .csv files.")
+        raise ValueError("Unsupported file type. At this time we only support .json, .csv, .db/.sqlite "
+                         "and .rfx snapshot files.")
 
 
 def main():
     # set up argument parsing
     parser = argparse.ArgumentParser(description="Run the movie application with a specified storage file.")
-    parser.add_argument("storage_file", type=str, help="Path to the storage file (JSON or CSV).")
+    parser.add_argument("storage_file", type=str, help="Path to the storage file (JSON, CSV, SQLite or .rfx snapshot).")
+    parser.add_argument("--cache", action="store_true",
+                        help="Keep the library in memory between menu actions instead of re-reading the file.")
+    parser.add_argument("--journal", action="store_true",
+                        help="Append changes to a journal next to the JSON file instead of rewriting it on every edit.")
+    parser.add_argument("--fast", action="store_true",
+                        help="Skip the welcome animation and go straight to the menu.")
+
+    parser.add_argument("--metrics", dest="metrics_file", metavar="FILE",
+                        help="Time the storage calls, OMDb requests and menu actions and write the counters and "
+                             "latency histograms to FILE, as json for a .json file and in the Prometheus text format "
+                             "otherwise.")
+    parser.add_argument("--profile", dest="profile_dir", metavar="DIR",
+                        help="Profile every menu action with cProfile, one .prof file per action in DIR.")
+
+    parser.add_argument("--import", dest="import_file", metavar="TITLES_FILE",
+                        help="Import every title/IMDb ID listed in a text or CSV file and exit.")
+    parser.add_argument("--workers", type=int, default=8,
+                        help="Number of parallel OMDb requests for --import (default 8).")
+    parser.add_argument("--rate", type=float, default=5.0,
+                        help="Maximum OMDb requests per second for --import, 0 for no limit (default 5).")
+    add_subcommands(parser)
 
     # Parse arguments
     args = parser.parse_args()
@@ -66,9 +128,67 @@ def main():
         print(f"Error: {e}")
         return
 
-    # run the app
-    app = MovieApplicationRun(storage_type=storage_type)
-    app.run()
+    # run the app, subcommands keep the library loaded between the commands of a batch
+    # convert streams the library instead, a cache would read it all into memory
+    app = MovieApplicationRun(storage_type=storage_type, file_path=args.storage_file,
+                              cached=args.cache or args.command not in (None, "convert"), journaled=args.journal, fast=args.fast,
+                              metrics_file=args.metrics_file, profile_dir=args.profile_dir)
+    try:
+        if args.import_file:
+            run_import(app.storage, args.import_file, args.workers, args.rate)
+            return
+        if args.command == "serve":
+            from server import serve
+            serve(app.storage, args.host, args.port, api_key=get_api_key(), url=OMDb_url)
+            return
+        if args.command == "convert":
+            sys.exit(run_convert(app.storage, args.output, args.overwrite, args.batch_size))
+        if args.command is not None:
+            sys.exit(run_cli(app.storage, args, api_key=get_api_key(), url=OMDb_url))
+        app.run()
+    finally:
+        if args.metrics_file is not None:
+            METRICS.dump(args.metrics_file)
+
+
+def run_import(storage, file_path, workers, rate):
+    """imports the titles in file_path and prints what happened to each of them"""
+    from bulk_import import BulkImporter
+    omdb_cache = ResponseCache()
+    importer = BulkImporter(storage, get_api_key(), OMDb_url, max_workers=workers, rate_limit=rate, cache=omdb_cache)
+    try:
+        report = importer.import_file(file_path)
+    except FileNotFoundError as e:
+        print(f"Error: {e}")
+        return
+    print(f"Imported {len(report['added'])} movies, "
+          f"skipped {len(report['skipped'])} already in the library, {len(report['failed'])} failed.")
+    for entry, error in report["failed"].items():
+        print(f"\t{entry}: {error}")
+    cache_stats = omdb_cache.stats()
+    print(f"OMDb cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses.")
+
+
+def run_convert(storage, file_path, overwrite, batch_size):
+    """
+    copies the library into file_path, prints the progress to stderr and the report as json.
+    :return: (int) exit code, 1 if the conversion failed
+    """
+    from convert import ConversionError, convert_library
+
+    def progress(count, seconds):
+        print(f"{count} movies copied, {count / seconds if seconds else 0:.0f} movies/s", file=sys.stderr)
+
+    try:
+        extension = os.path.splitext(file_path)[1].lower()
+        target_type = "jsonl" if extension in (".jsonl", ".ndjson") else determine_storage_type(file_path)
+        report = convert_library(storage, file_path, target_type, overwrite=overwrite, batch_size=batch_size,
+                                 progress=progress)
+    except (ValueError, ConversionError) as e:
+        print(json.dumps({"error": str(e)}))
+        return 1
+    print(json.dumps(report))
+    return 0
 
 
 if __name__ == '__main__':
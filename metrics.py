@@ -0,0 +1,215 @@
+import bisect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from types import GeneratorType
+
+# upper bounds in seconds of the latency histogram buckets, from a cached lookup to a big website build
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# the storage methods InstrumentedStorage times, everything else is passed through untouched
+STORAGE_METHODS = ("list_movies", "iter_movies", "add_movie", "add_movies", "delete_movie", "update_movie",
+                   "query_movies", "sorted_movies", "columns")
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, like a Prometheus histogram: counts per bucket plus the sum,
+    the number of observations and the fastest and slowest one.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def cumulative(self):
+        """
+        :return: (list) (upper bound, number of observations up to it) pairs, the last bound is "+Inf"
+        """
+        pairs, total = [], 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def as_dict(self):
+        return {"count": self.count, "sum": round(self.sum, 6), "min": self.min, "max": self.max,
+                "mean": round(self.sum / self.count, 6) if self.count else None,
+                "buckets": {str(bound): count for bound, count in self.cumulative()}}
+
+
+class Metrics:
+    """
+    In memory counters and latency histograms, keyed by a name and labels (e.g. "storage_call", method="add_movie").
+    Thread safe, the bulk import and the server record from several threads.
+    Methods:
+        increment(name, amount, **labels):
+            adds to a counter.
+        observe(name, seconds, **labels):
+            records one latency.
+        timer(name, **labels):
+            context manager recording how long its block took, an exception also counts in name + "_errors".
+        as_dict() / to_prometheus(prefix):
+            everything recorded as json serialisable data or in the Prometheus text format.
+        dump(file_path):
+            writes as_dict() to a .json file, or the Prometheus text to any other file.
+        reset():
+            forgets everything recorded.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name, amount=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            # sys.exit() from the menu's exit isn't an error
+            if not isinstance(e, (SystemExit, KeyboardInterrupt, GeneratorExit)):
+                self.increment(name + "_errors", error=type(e).__name__, **labels)
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def as_dict(self):
+        with self._lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            histograms = [{"name": name, "labels": dict(labels), **histogram.as_dict()}
+                          for (name, labels), histogram in sorted(self._histograms.items())]
+        return {"counters": counters, "histograms": histograms}
+
+    def to_prometheus(self, prefix="rateflix"):
+        def escape(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        def label_text(labels, extra=()):
+            pairs = [f'{name}="{escape(value)}"' for name, value in list(labels) + list(extra)]
+            return "{" + ",".join(pairs) + "}" if pairs else ""
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for (counter_name, labels), value in sorted(self._counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{prefix}_{name}_total{label_text(labels)} {value}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {prefix}_{name}_seconds histogram")
+                for (histogram_name, labels), histogram in sorted(self._histograms.items()):
+                    if histogram_name != name:
+                        continue
+                    for bound, count in histogram.cumulative():
+                        lines.append(f"{prefix}_{name}_seconds_bucket{label_text(labels, [('le', bound)])} {count}")
+                    lines.append(f"{prefix}_{name}_seconds_sum{label_text(labels)} {histogram.sum:.6f}")
+                    lines.append(f"{prefix}_{name}_seconds_count{label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, file_path):
+        directory = os.path.dirname(file_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "w") as metrics_file:
+            if file_path.endswith(".json"):
+                json.dump(self.as_dict(), metrics_file, indent=4)
+            else:
+                metrics_file.write(self.to_prometheus())
+        os.replace(temp_path, file_path)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+# the app's metrics, recorded by the storages' proxy, the OMDb lookups and the menu actions
+METRICS = Metrics()
+
+
+def _timed_generator(generator, metrics, name, labels, start):
+    """
+    passes a generator through and records the time from the call until it is used up (or closed),
+    so streamed listings are timed for the reading they do and not only for creating the generator.
+    """
+    try:
+        yield from generator
+    finally:
+        metrics.observe(name, time.perf_counter() - start, **labels)
+
+
+class InstrumentedStorage:
+    """
+    Wraps a storage and records the latency of every storage method call in metrics as
+    "storage_call" with the method as label. Any other attribute is the wrapped storage's own.
+    """
+    def __init__(self, storage, metrics=METRICS):
+        self._storage = storage
+        self._metrics = metrics
+
+    def __getattr__(self, name):
+        attribute = getattr(self._storage, name)
+        if name not in STORAGE_METHODS:
+            return attribute
+        metrics = self._metrics
+
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception as e:
+                metrics.increment("storage_call_errors", method=name, error=type(e).__name__)
+                metrics.observe("storage_call", time.perf_counter() - start, method=name)
+                raise
+            if isinstance(result, GeneratorType):
+                return _timed_generator(result, metrics, "storage_call", {"method": name}, start)
+            metrics.observe("storage_call", time.perf_counter() - start, method=name)
+            return result
+        return timed_method
+
+
+def profile_call(function, output_dir, name):
+    """
+    runs the function under cProfile and writes the stats to output_dir/<name>-<time>.prof,
+    they can be read with python -m pstats or snakeviz.
+    :return: what the function returned
+    """
+    import cProfile
+
+    os.makedirs(output_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function)
+    finally:
+        profiler.dump_stats(os.path.join(output_dir, f"{name}-{time.time_ns()}.prof"))
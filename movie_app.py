@@ -3,28 +3,53 @@ import os
 import time
 from os.path import join
 
-import pycountry
-from fuzzywuzzy import process
-import Levenshtein
-import matplotlib.pyplot as plt
 import random
 import sys
 from colorama import Fore, Style, Back, init
-import requests
-from requests.exceptions import HTTPError, ConnectionError, Timeout, RequestException
+from cli import CommandError, MovieCommands
+from data.movie import rating_of, start_year_of
+from omdb import OMDB_URL, ResponseCache
 init(autoreset=True)
+# matplotlib, pycountry, fuzzywuzzy, Levenshtein, requests, numpy and pillow are imported
+# inside the features that use them, together they take most of a second to import
 
-# access environment variable for api_key
-from dotenv import load_dotenv
-load_dotenv()
+# access environment variable for api_key, the .env file is only read if it isn't set
 api_key = os.getenv("API_KEY")
-OMDb_url = "http://www.omdbapi.com/?apikey="
+OMDb_url = OMDB_URL
+
+
+def get_api_key():
+    """
+    :return: (str) the OMDb api key from the environment or the .env file
+    """
+    global api_key
+    if api_key is None:
+        from dotenv import load_dotenv
+        load_dotenv()
+        api_key = os.getenv("API_KEY")
+    return api_key
+
 
 # Error Logs
 import logging
+
+
+class ErrorLogHandler(logging.FileHandler):
+    """
+    FileHandler creating the log's folder when the first error is written, so importing the app
+    (every subcommand, batch run and server start) doesn't leave a logs folder in the working directory.
+    """
+    def __init__(self, file_path):
+        super().__init__(file_path, delay=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
 logging.basicConfig(
     level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s', handlers=[
-        logging.FileHandler('logs/app_errors.log'),
+        ErrorLogHandler(join("logs", "app_errors.log")),
         logging.StreamHandler()
     ]
 )
@@ -37,6 +62,8 @@ class MovieApp:
     Allows the user to interact with a collection of movies providing
     functionalities such as listing, adding, deleting
     updating movies, generating statistics and much more.
+    The menu only asks and prints, the features themselves are the cli.MovieCommands the
+    subcommands, batch mode and server use, so duplicate checks and the search index work the same everywhere.
 
     Methods:
     __init__(storage):
@@ -63,20 +90,24 @@ class MovieApp:
         Prompts the user for a search term and displays matching movies from the collection.
     movie_sort():
         Sorts movies by a chosen attribute (e.g., title, rating) and displays the sorted list.
-    generate_histogram():
-        Generates a histogram based on movie ratings to visualize rating distribution.
+    create_histogram_and_save():
+        Saves a rating histogram, movies per decade or per country chart as png.
     save_and_exit():
         Saves the current movie data to storage and exits the application.
     download_poster():
         Prompts the user for a movie title and attempts to download its poster image from an external source.
 
     """
-    def __init__(self, storage):
+    def __init__(self, storage, omdb_cache=None):
         """
         initializing the Movie App with the storage instance to manage data.
         :param storage: (Storage(class)) instance of the storage class to retrieve and save data.
+        :param omdb_cache: (ResponseCache) cache for OMDb answers, defaults to storage/omdb_cache.db
         """
         self._storage = storage
+        self._omdb_cache = omdb_cache if omdb_cache is not None else ResponseCache()
+        # the api key (and url) are only looked up when a movie is added, reading .env takes a while
+        self._commands = MovieCommands(storage, omdb_cache=self._omdb_cache)
 
     def welcome_page(self):
         """
@@ -176,15 +207,17 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
     def list_movies(self):
         """
         this function will print a list of every movie in the Dictionary of movies.
+        the movies are streamed from the storage one at a time, so the count is printed at the end.
         then run the 'returner' function.
         :return:
         """
-        movies = self._storage.list_movies()
-        print(f"\nThere are {len(movies.keys())} movies currently in the PopcornPicker library.")
-        for movie, details in movies.items():
+        count = 0
+        for movie, details in self._storage.iter_movies(fields=("rating", "year")):
             print(Fore.CYAN + movie)
             print(f"\thas a rating of {Fore.YELLOW}{details['rating']}")
             print(f"\twas released in {Fore.YELLOW}{details['year']}\n")
+            count += 1
+        print(f"There are {count} movies currently in the PopcornPicker library.")
         self.returner_func()
 
     def update_movie(self):
@@ -199,7 +232,7 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
         if update_movie_name in movies:
             notes = input("What note would you like to add?\n>>> ")
             if notes.strip():
-                self._storage.update_movie(update_movie_name, notes)
+                self._commands.note(update_movie_name, notes)
                 print("Note successfully added!")
                 self.returner_func()
             else:
@@ -215,21 +248,20 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
         using try, except, if and else statements to get as much error handling as possible.
         :return: returning to our dictionary. Key - String and Value - Integer
         """
-        movies = self._storage.list_movies()
         try:
             movie_to_add = input(Fore.LIGHTGREEN_EX + "What Movie would you like to add to the PopcornPicker library?\n>>> ")
             if not movie_to_add:
                 raise ValueError("You didn't type a movie name")
 
-            if movie_to_add in movies:
-                print(Fore.CYAN + "Movie is already in the Library.\n"
-                                  "Taking you back to the main menu")
+            self._commands.api_key, self._commands.url = get_api_key(), OMDb_url
+            try:
+                movie = self._commands.add(movie_to_add)
+            except CommandError as e:
+                print(Fore.CYAN + f"{e}.\nTaking you back to the main menu")
                 self.returner_func()
                 return
-            movie_to_add, movie_rating, movie_year, movie_poster, imdb_full_link, country = self.api_extraction(movie_to_add, api_key, OMDb_url)
-            self._storage.add_movie(movie_to_add, movie_rating, movie_year, movie_poster, imdb_full_link, country)
-            print(f"{movie_to_add} successfully added to the PopcornPicker Library. "
-                  f"Released in {movie_year} it has a imdb rating of {movie_rating}")
+            print(f"{movie['title']} successfully added to the PopcornPicker Library. "
+                  f"Released in {movie['year']} it has a imdb rating of {movie['rating']}")
         except Exception as e:
             print(f"Error occurred: {e}")
 
@@ -242,14 +274,12 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
         Otherwise the function follows through with the task and deletes the chosen item from the dictionary.
         :return: Formatted Print statement.
         """
-        movies = self._storage.list_movies()
         movie_to_delete = input(Fore.LIGHTGREEN_EX + "Enter the movie you would like to delete: \n >>> ")
         try:
-            if movie_to_delete in movies:
-                self._storage.delete_movie(movie_to_delete)
-                print(f"{Fore.YELLOW}{movie_to_delete}{Fore.RESET} was deleted from the PopcornPicker library.")
-            else:
-                print(f"{Fore.YELLOW}{movie_to_delete}{Fore.RESET} is not in the PopcornPicker library.")
+            self._commands.delete(movie_to_delete)
+            print(f"{Fore.YELLOW}{movie_to_delete}{Fore.RESET} was deleted from the PopcornPicker library.")
+        except CommandError:
+            print(f"{Fore.YELLOW}{movie_to_delete}{Fore.RESET} is not in the PopcornPicker library.")
         except Exception as e:
             logging.error(e)
             print(f"{Fore.RED + Back.BLACK}Oh oh! Something went wrong.\nError message: {e}")
@@ -258,43 +288,28 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
     def stats(self):
         """
         Access the movies.json file to make the required calculations to provide the statistics needed for our print statements
+        The numbers are calculated on the storage's numpy columns, movies without a rating are left out.
         :return: (F-string) print statistics = Average and Mean plus the Best and Worst movies
         """
-        movies = self._storage.list_movies()
+        stats = self._commands.stats()
 
         # calculate average
-        ratings = [float(movie["rating"]) for movie in movies.values()]
-        if ratings:
-            average = sum(ratings) / len(ratings)
-            print(f"The Average rating is: {Fore.YELLOW}{average:.2f}")
-        else:
+        if stats["count"] == 0:
             print(Fore.RED + "No movies to calculate average.")
             return
+        print(f"The Average rating is: {Fore.YELLOW}{stats['average']:.2f}")
 
         # calculate mean
-        sorted_ratings = sorted(ratings)
-        num_movies = len(sorted_ratings)
-
-        if num_movies % 2 == 1:
-            median = sorted_ratings[num_movies // 2]
-        else:
-            median = (sorted_ratings[num_movies // 2 - 1] + sorted_ratings[num_movies // 2]) / 2
-        print(f"The Median rating is: {Fore.YELLOW}{median:.2f}")
+        print(f"The Median rating is: {Fore.YELLOW}{stats['median']:.2f}")
 
         # find highest and lowest rating
-        ratings = [movies[title]["rating"] for title in movies]
-        highest_rating = max(ratings)
-        lowest_rating = min(ratings)
-        highest_rated_movies = [title for title in movies if movies[title]["rating"] == highest_rating]
-        lowest_rated_movies = [title for title in movies if movies[title]["rating"] == lowest_rating]
-
         print("Highest Rated Movies:")
-        for movie in highest_rated_movies:
-            print(f"\t{Fore.YELLOW}{movie}{Fore.RESET} - Rating: {Fore.YELLOW}{highest_rating}")
+        for movie in stats["highest_titles"]:
+            print(f"\t{Fore.YELLOW}{movie}{Fore.RESET} - Rating: {Fore.YELLOW}{stats['highest']}")
 
         print("\nLowest Rated Movies:")
-        for movie in lowest_rated_movies:
-            print(f"\t{Fore.YELLOW}{movie}{Fore.RESET} - Rating: {Fore.YELLOW}{lowest_rating}")
+        for movie in stats["lowest_titles"]:
+            print(f"\t{Fore.YELLOW}{movie}{Fore.RESET} - Rating: {Fore.YELLOW}{stats['lowest']}")
 
         self.returner_func()
 
@@ -314,86 +329,76 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
         asking for user input to search the dictionary. stripping and lowercasing to remove case sensitivity and space amounts.
          firstly we search for an exact match, then we move to fuzzy method to check for partial matches.
          lastly move to the Levenshtein distance to pick up any other possible matches.
+         the fuzzy and Levenshtein scoring only run on the candidates the trigram index finds, not the whole library.
         :return: a Formatted string with the title and rating taken from the movies' dictionary.
         """
-        movies = self._storage.list_movies()
-        search_item = input(Fore.LIGHTGREEN_EX + "Please type what movie your searching for? \n >>> ").strip().lower()
-        lower_movies = {title.lower(): title for title in movies.keys()}
+        search_item = input(Fore.LIGHTGREEN_EX + "Please type what movie your searching for? \n >>> ")
+        match_type, matches = self._commands.match(search_item)
 
         # Exact user input
-        if search_item in lower_movies:
-            exact_search = lower_movies[search_item]
+        if match_type == "exact":
+            exact_search, details, _ = matches[0]
             print(
-                f"{Fore.YELLOW}{exact_search.capitalize()}{Fore.RESET}, released in {Fore.YELLOW}{movies[exact_search]["year"]}{Fore.RESET} has a rating of {Fore.YELLOW}{movies[exact_search]["rating"]}")
+                f"{Fore.YELLOW}{exact_search.capitalize()}{Fore.RESET}, released in {Fore.YELLOW}{details["year"]}{Fore.RESET} has a rating of {Fore.YELLOW}{details["rating"]}")
             self.returner_func()
+            return
 
-        # Fuzzy matching
-        movies_list = list(movies.keys())
-        fuzzy_matches = process.extract(search_item, movies_list, limit=5)
-        fuzzy_results = [(title, score) for title, score in fuzzy_matches if score > 50]
-
-        if fuzzy_results:
+        if match_type == "fuzzy":
             print(Fore.CYAN + "Found the following fuzzy movies: ")
-            for title, score in fuzzy_results:
+            for title, details, score in matches:
                 print(
-                    f"{Fore.YELLOW}{title}{Fore.RESET} released in {Fore.YELLOW}{movies[title]["year"]}{Fore.RESET} has a rating of {Fore.YELLOW}{movies[title]["rating"]}")
+                    f"{Fore.YELLOW}{title}{Fore.RESET} released in {Fore.YELLOW}{details["year"]}{Fore.RESET} has a rating of {Fore.YELLOW}{details["rating"]}")
 
         # If Fuzzy cant match it goes to the levenshtein distance.
         else:
-            distances = [
-                (title, Levenshtein.distance(search_item, title.lower()))
-                for title in movies.keys()
-            ]
-            sorted_distances = sorted(distances, key=lambda x: x[1])
-
-            top_matches = sorted_distances[:5]
-
-            if top_matches:
+            if matches:
                 print(Fore.CYAN + "Found the following movies: ")
-                for title, distance in top_matches:
+                for title, details, distance in matches:
                     print(
-                        f"{Fore.YELLOW}{title}{Fore.RESET} released in {Fore.YELLOW}{movies[title]["year"]}{Fore.RESET} has a rating of {Fore.YELLOW}{movies[title]}")
+                        f"{Fore.YELLOW}{title}{Fore.RESET} released in {Fore.YELLOW}{details["year"]}{Fore.RESET} has a rating of {Fore.YELLOW}{details["rating"]}")
             else:
                 print(Fore.RED + "No movies found matching your search.")
         self.returner_func()
 
     def movies_sorted_by_rating(self):
         """
-        Here we just sort the dictionary of movies by its values from highest to lowest using the key=lambda function and
-        reverse to make sure it starts with the highest rated movie to the lowest
+        Here we ask the storage for the movies sorted by rating from highest to lowest,
+        storages with an index on the rating do the sorting for us
         :return: Formatted print statement
         """
-        movies = self._storage.list_movies()
-        sorted_movies = dict(sorted(movies.items(), key=lambda item: item[1]["rating"], reverse=True))
+        sorted_movies = self._storage.sorted_movies("rating", reverse=True)
 
         print(Fore.CYAN + "Movies sorted by rating:")
-        for movie, details in sorted_movies.items():
+        for movie, details in sorted_movies:
             print(
                 f"{Fore.YELLOW}{movie}{Fore.RESET}: Rating: {Fore.YELLOW}{details["rating"]}{Fore.RESET}, Year: {Fore.YELLOW}{details["year"]}")
         self.returner_func()
 
     def create_histogram_and_save(self):
         """
-        Here we turn all dictionary values into a list and using matplotlib library and the hist() function we create a histogram.
-        Then ask the user under what name they would like the histogram to be saved under.
-        :return: saved Histogram .png file
+        Here we let the user pick a chart (rating histogram, movies per decade or per country) and
+        ask under what name it should be saved in the histograms folder.
+        The chart is drawn off screen by the charts module, an unchanged library reuses the cached png.
+        :return: saved chart .png file
         """
-        movies = self._storage.list_movies()
-        movie_ratings = [val["rating"] for val in movies.values()]
+        from charts import CHARTS, save_chart
 
-        plt.hist(movie_ratings, bins=5, color='blue', edgecolor='black')
-        plt.title("Movie Ratings Histogram")
-        plt.xlabel("Rating")
-        plt.ylabel("Number of Movies")
+        print(Fore.CYAN + "Which chart would you like?")
+        for number, chart in enumerate(CHARTS, start=1):
+            print(f"{number}. {chart}")
+        choice = input(Fore.LIGHTGREEN_EX + "Enter choice (press enter for ratings): \n >>> ").strip()
+        chart = CHARTS[int(choice) - 1] if choice in ("1", "2", "3") else "ratings"
 
         filename = input("Please enter a file name to save the histogram.\n>>> ")
         if not filename.endswith(".png"):
             filename += ".png"
-        plt.savefig(join("histograms", filename))
-
-        plt.show()
+        result = save_chart(self._storage, chart, join("histograms", filename))
+        reused = " (library unchanged, reused the cached chart)" if result["cached"] else ""
+        print(Fore.GREEN + f"Chart saved to {result['path']}{reused}")
+        self.returner_func()
 
     def exit_program(self):
+        self._commands.close()
         print("Thanks for using the PopcornPicker app!")
         print("Have a wonderful day")
         print(r""" 
@@ -413,23 +418,22 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
         if "N" earliest to latest.
         :return: F-String of the movies
         """
-        movies = self._storage.list_movies()
         while True:
             user_input = input(
                 Fore.LIGHTGREEN_EX + "Would you like not to see the movies from latest movies first? Y/N\n>>> ").upper()
             if user_input == "Y":
                 # sort latest to earliest
-                sorted_movies = dict(sorted(movies.items(), key=lambda item: item[1]["year"], reverse=True))
+                sorted_movies = self._storage.sorted_movies("year", reverse=True)
                 break
             elif user_input == "N":
                 # sort earliest to latest
-                sorted_movies = dict(sorted(movies.items(), key=lambda item: item[1]["year"], reverse=False))
+                sorted_movies = self._storage.sorted_movies("year", reverse=False)
                 break
             else:
                 print("Invalid Input, please enter 'Y' or 'N'.")
 
         print(Fore.CYAN + "Movies sorted by rating:")
-        for movie, details in sorted_movies.items():
+        for movie, details in sorted_movies:
             print(
                 f"{Fore.YELLOW}{movie}{Fore.RESET}: Rating: {Fore.YELLOW}{details["rating"]}{Fore.RESET}, Year: {Fore.YELLOW}{details["year"]}")
         self.returner_func()
@@ -439,8 +443,8 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
         This function filters movies based on minimum rating, start year, and end year.
         If any input is left blank, it is considered as no filter for that criterion.
         It also handles invalid input types.
+        The filtering itself is done by the storage so indexed storages don't have to scan every movie.
         """
-        movies = self._storage.list_movies()
 
         def validate_input(prompt, cast_type):
             """
@@ -461,17 +465,14 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
         start_year = validate_input("Enter start year (leave blank for no start year)\n>>> ", int)
         end_year = validate_input("Enter end year (leave blank for no start year)\n>>> ", int)
 
-        # access movies
+        # Apply filters, empty inputs are passed as None and ignored by the storage
+        matches = self._storage.query_movies(min_rating=min_rating, start_year=start_year, end_year=end_year)
         filtered_movies = []
-        for movie, details in movies.items():
-            rating = float(details["rating"])
-            year = int(details["year"])
-
-            # Apply filters, respecting empty inputs
-            if (min_rating is None or rating >= min_rating) and \
-                    (start_year is None or year >= start_year) and \
-                    (end_year is None or year <= end_year):
-                filtered_movies.append(f"{movie} ({year}): {rating:.2f}")
+        for movie, details in matches.items():
+            rating = rating_of(details)
+            year = start_year_of(details)
+            rating_text = f"{rating:.2f}" if rating is not None else "N/A"
+            filtered_movies.append(f"{movie} ({year if year is not None else 'N/A'}): {rating_text}")
 
         # output
         if filtered_movies:
@@ -482,105 +483,13 @@ ____    __    ____  _______  __        ______   ______   .___  ___.  _______
             print(Fore.RED + "No movies found matching the criteria")
         self.returner_func()
 
-    def api_extraction(self, title, api, url, search_type="&t="):
+    def generate_website(self):
         """
-        searches the OMDb database for given Title movie and returns the movie title, rating, year and poster URL
-        :param title: (str)
-        :param api: (str) Api key for OMDb
-        :param url: (str) Url for OMDb
-        :param search_type: (str) search type keyword set for Movie title search
-        :return: movie name, movie rating, movie year of release and the Poster URL
+        writes the website into web/ as pages of cards, in library order and sorted by rating and by year.
+        only the pages whose movies changed since the last run are written again.
+        the posters are mirrored into web/posters first so the cards show local thumbnails.
         """
-        try:
-            response = requests.get(url + api + search_type + title)
-            response.raise_for_status()
-            movie_info = response.json()
-            movie = movie_info["Title"]
-            rating = movie_info["imdbRating"]
-            year = movie_info["Year"]
-            poster_url = movie_info["Poster"]
-            imdb_id = movie_info["imdbID"]
-            imdb_full_link = f"https://www.imdb.com/title/{imdb_id}/"
-            country = movie_info["Country"]
-            return movie, rating, year, poster_url, imdb_full_link, country
-        except HTTPError as e:
-            print(f"HTTP error occurred: {e} - Status Code: {response.status_code}")
-        except ConnectionError as e:
-            print(f"Connection Error: unable to connect to API {e}")
-        except Timeout:
-            print(f"Error request has timed out")
-        except RequestException as e:
-            print(f"Ann error occurred: {e}")
-
-    def generate_website(self):
-        movies = self._storage.list_movies()
-        html_content = """
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <link rel="stylesheet" href="style.css"/>
-            <title>PopcornPicker</title>
-        </head>
-        <body>
-        <main>
-            <div class="list-movies-title">
-                <h1>PopcornPicker Movie Library</h1>
-            </div>
-            <div class="list">
-        """
-        # add all movies to html list
-        for title, details in movies.items():
-            country_code = self.get_country_code_from_name(details.get('country'))
-            html_content += f"""
-                <div class="movie">
-                    <a href="{details.get("imdbID")}" target="_blank">
-                        <div class="flag-container">
-                            <img class="country-flag" src="https://flagsapi.com/{country_code}/flat/64.png" alt="{details.get('country')} Flag">
-                        </div>
-                            <img class="movie-poster" src="{details.get("poster")}">
-                    </a>
-                    <div class="text">
-                        <div class="movie-title">{title}</div>
-                        <div class="movie-year">{details.get("year")}</div>
-                        <div class="movie-rating">iMDb Rating: {details.get("rating")}</div>
-                        <div class="movie-note">{details.get("note", "")}</div>
-                    </div>
-                </div>
-        """
-
-        # closing tags
-        html_content += """
-            </div>
-        </main>
-        </body>
-        </html>
-        """
-
-        with open(join("web", "index.html"), "w") as file:
-            file.write(html_content)
-
-        print("Website was generated successfully")
+        report = self._commands.site()
+        print(f"Website was generated successfully "
+              f"({report['written']} of {report['pages']} pages updated, {report['removed']} removed)")
         time.sleep(2)
-
-    def get_country_code_from_name(self, country):
-        if country and "," in country:
-            countries = [c.strip() for c in country.split(",")]
-            country_codes = []
-            for country in countries:
-                try:
-                    country_objects = pycountry.countries.lookup(country)
-                    country_codes.append(country_objects.alpha_2)
-                except LookupError:
-                    pass
-            return country_codes[0]  # change later to show all flags
-        elif country:
-            try:
-                country = pycountry.countries.lookup(country)
-                return country.alpha_2
-            except LookupError as e:
-                print(f"LookupError: {e}")
-                return None
-        else:
-            return None
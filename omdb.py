@@ -0,0 +1,178 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from os.path import join
+from urllib.parse import quote
+
+from metrics import METRICS
+
+OMDB_URL = "http://www.omdbapi.com/?apikey="
+IMDB_ID_PATTERN = re.compile(r"^tt\d+$")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class OMDbError(Exception):
+    """raised when OMDb answers the request but has no movie for it (e.g. "Movie not found!")"""
+    pass
+
+
+def search_type_for(query):
+    """
+    picks the OMDb search parameter for the query, IMDb IDs (tt0111161) are looked up by id and everything else by title.
+    :return: (str) "&i=" or "&t="
+    """
+    return "&i=" if IMDB_ID_PATTERN.match(query.strip()) else "&t="
+
+
+def get_session():
+    """
+    returns the requests.Session shared by every OMDb call so requests reuse pooled keep-alive
+    connections instead of opening a new TCP connection each time.
+    """
+    global _session
+    # requests is imported on the first OMDb call, answers from the ResponseCache never need it
+    import requests
+    from requests.adapters import HTTPAdapter
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=16)
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+        return _session
+
+
+def cache_key(query, search_type="&t="):
+    """
+    builds the cache key for a lookup, titles are case folded with the white space collapsed
+    so "the  Mask" and "The Mask" share an entry.
+    :return: (str) "i:<imdbID>" or "t:<normalised title>"
+    """
+    if search_type == "&i=":
+        return "i:" + query.strip()
+    return "t:" + " ".join(query.casefold().split())
+
+
+class ResponseCache:
+    """
+    On-disk cache of OMDb answers (a small SQLite file) so titles we looked up before don't cost
+    API quota or a network round trip. Each answer is stored under the looked up title, the title
+    OMDb returned and its imdbID.
+    Entries older than ttl seconds are treated as missing, and once there are more than
+    max_entries the least recently used ones are evicted.
+    Methods:
+        __init__(file_path, ttl, max_entries):
+            initialise the cache, the file is only opened on first use.
+        get(key):
+            returns the cached OMDb answer for the key or None, counting hits and misses.
+        put(keys, movie_info):
+            stores the OMDb answer under every given key and evicts the oldest entries if needed.
+        stats():
+            returns the hit/miss counters and the number of entries.
+    """
+    def __init__(self, file_path=join("storage", "omdb_cache.db"), ttl=30 * 24 * 3600, max_entries=10000):
+        self.file_path = file_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        # the bulk importer calls the cache from several threads
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.file_path, check_same_thread=False)
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    payload TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+            """)
+        return self._connection
+
+    def get(self, key):
+        """
+        :param key: (str) key from cache_key()
+        :return: (dict) the OMDb answer, None if it isn't cached or has expired
+        """
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT payload, fetched_at FROM responses WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            with connection:
+                connection.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, keys, movie_info):
+        """
+        :param keys: (list) keys from cache_key() to store the answer under
+        :param movie_info: (dict) the OMDb answer
+        """
+        with self._lock:
+            connection = self._connect()
+            now = time.time()
+            payload = json.dumps(movie_info)
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO responses (key, payload, fetched_at, last_used) VALUES (?, ?, ?, ?)",
+                    [(key, payload, now, now) for key in keys]
+                )
+                count = connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+                if count > self.max_entries:
+                    connection.execute(
+                        "DELETE FROM responses WHERE key IN "
+                        "(SELECT key FROM responses ORDER BY last_used LIMIT ?)",
+                        (count - self.max_entries,)
+                    )
+
+    def stats(self):
+        with self._lock:
+            entries = self._connect().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
+
+
+def fetch_movie(title, api_key, url=OMDB_URL, search_type="&t=", session=None, timeout=10, cache=None,
+                before_request=None):
+    """
+    requests one movie from OMDb and returns it in the format the storages expect.
+    errors are raised instead of printed, so callers can report them their own way (menu, cli, server, per title).
+    :param title: (str) movie title or IMDb ID
+    :param api_key: (str) Api key for OMDb
+    :param url: (str) Url for OMDb, can point to a local stub server
+    :param search_type: (str) "&t=" to search by title, "&i=" to search by IMDb ID
+    :param session: (requests.Session) session to reuse connections, the shared get_session() if None
+    :param timeout: (float) seconds to wait for OMDb
+    :param cache: (ResponseCache) cache to answer from before asking OMDb, None to always ask OMDb
+    :param before_request: (function) called right before a request goes out, e.g. a rate limiter
+    :return: (tuple) movie name, rating, year, poster URL, IMDb link, country
+    """
+    key = cache_key(title, search_type)
+    movie_info = cache.get(key) if cache is not None else None
+    if movie_info is None:
+        if before_request is not None:
+            before_request()
+        http = session if session is not None else get_session()
+        with METRICS.timer("omdb_request"):
+            response = http.get(url + str(api_key) + search_type + quote(title.strip()), timeout=timeout)
+            response.raise_for_status()
+        movie_info = response.json()
+        if movie_info.get("Response") == "False":
+            raise OMDbError(movie_info.get("Error", "Movie not found!"))
+        if cache is not None:
+            keys = {key, cache_key(movie_info["Title"]), cache_key(movie_info["imdbID"], "&i=")}
+            cache.put(keys, movie_info)
+    imdb_full_link = f"https://www.imdb.com/title/{movie_info['imdbID']}/"
+    return (movie_info["Title"], movie_info["imdbRating"], movie_info["Year"], movie_info["Poster"],
+            imdb_full_link, movie_info["Country"])
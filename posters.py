@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from os.path import join
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+THUMBNAIL_SIZE = (300, 445)
+# answers worth asking again for, a poster host that is overloaded or restarting usually recovers in a moment
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+EXTENSIONS = {"WEBP": ".webp", "JPEG": ".jpg"}
+
+
+def make_thumbnail(source, target, size=THUMBNAIL_SIZE, image_format="WEBP"):
+    """
+    resizes one downloaded poster into a thumbnail, runs in a worker process so the resizing
+    of many posters uses every cpu core.
+    :param source: (str) path of the downloaded poster
+    :param target: (str) path of the thumbnail to write
+    :return: (bool) True if the thumbnail was written, False if the file isn't an image pillow can read
+    """
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        with Image.open(source) as image:
+            image.thumbnail(size)
+            if image_format == "JPEG" and image.mode != "RGB":
+                image = image.convert("RGB")
+            temp_target = target + ".tmp"
+            image.save(temp_target, image_format)
+        os.replace(temp_target, target)
+        return True
+    except (UnidentifiedImageError, OSError):
+        return False
+
+
+class PosterMirror:
+    """
+    Keeps local copies of the poster images so the website doesn't hotlink every full size poster.
+    Posters are downloaded into cache_dir by a pool of threads, resized into thumbnails inside
+    site_dir/posters by a pool of processes, and a manifest remembers each poster's ETag and content hash
+    so unchanged posters are neither downloaded (304 Not Modified) nor resized again.
+    A poster that already has its thumbnail isn't asked for at all until it is max_age seconds old
+    or a refresh is asked for, so rebuilding the site costs no requests for the posters it already has.
+    Methods:
+        __init__(cache_dir, site_dir, max_workers, processes, size, image_format, timeout, retries, backoff, max_age):
+            initialise the mirror, max_workers caps the parallel downloads and processes the resizing workers.
+            max_age None never checks a mirrored poster again unless mirror() is asked to refresh.
+            failed connections and RETRY_STATUSES answers are retried up to retries times, the first retry
+            right away and every further one after twice the wait of the one before (backoff * 2, * 4, ...).
+        mirror(urls, refresh):
+            mirrors the posters that are new (or all of them with refresh) and returns where their thumbnails are.
+    """
+    def __init__(self, cache_dir=join("storage", "posters"), site_dir="web", max_workers=8, processes=None,
+                 size=THUMBNAIL_SIZE, image_format="WEBP", timeout=10, retries=3, backoff=0.5,
+                 max_age=None):
+        self.cache_dir = cache_dir
+        self.site_dir = site_dir
+        self.thumb_dir = join(site_dir, "posters")
+        self.max_workers = max_workers
+        self.processes = processes
+        self.size = size
+        self.image_format = image_format
+        self.timeout = timeout
+        self.max_age = max_age
+        self.manifest_path = join(cache_dir, "manifest.json")
+        self.report = {}
+        self._session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_workers, max_retries=retry)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                return json.load(manifest_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(temp_path, self.manifest_path)
+
+    def _thumb_name(self, url):
+        return hashlib.sha1(url.encode()).hexdigest()[:20] + EXTENSIONS[self.image_format]
+
+    def _download(self, url, entry):
+        """
+        downloads one poster unless the server (ETag) or its content hash says it didn't change.
+        :param entry: (dict) the poster's manifest entry from the last run, None if it is new
+        :return: (tuple) the new manifest entry and True if a new thumbnail has to be made
+        """
+        headers = {"If-None-Match": entry["etag"]} if entry and entry.get("etag") else {}
+        response = self._session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304:
+            return {**entry, "checked": time.time()}, False
+        response.raise_for_status()
+
+        content_hash = hashlib.sha256(response.content).hexdigest()
+        new_entry = {"etag": response.headers.get("ETag"), "hash": content_hash, "thumb": self._thumb_name(url),
+                     "checked": time.time()}
+        if entry and entry.get("hash") == content_hash:
+            return new_entry, False
+
+        source = join(self.cache_dir, content_hash)
+        with open(source, "wb") as poster_file:
+            poster_file.write(response.content)
+        return new_entry, True
+
+    def _remove_unused(self, manifest):
+        """
+        deletes downloaded posters and thumbnails no manifest entry points to anymore, e.g. of deleted movies.
+        """
+        posters = {entry["hash"] for entry in manifest.values()} | {"manifest.json"}
+        thumbs = {entry["thumb"] for entry in manifest.values()}
+        for directory, names in ((self.cache_dir, posters), (self.thumb_dir, thumbs)):
+            for name in os.listdir(directory):
+                if name not in names:
+                    os.remove(join(directory, name))
+
+    def _is_fresh(self, entry, now):
+        """
+        :return: (bool) True if the poster was mirrored, its thumbnail is there and it isn't max_age old yet
+        """
+        if entry is None or not os.path.isfile(join(self.thumb_dir, entry["thumb"])):
+            return False
+        return self.max_age is None or now - entry.get("checked", 0) < self.max_age
+
+    def mirror(self, urls, refresh=False):
+        """
+        :param urls: (iterable) poster urls, OMDb's "N/A" and other non http values are ignored
+        :param refresh: (bool) ask the poster hosts about every poster, not only the new or max_age old ones
+        :return: (dict) url: thumbnail path relative to site_dir, posters that couldn't be mirrored are left out
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        os.makedirs(self.thumb_dir, exist_ok=True)
+        old_manifest = self._load_manifest()
+        urls = list(dict.fromkeys(url for url in urls if url and url.startswith(("http://", "https://"))))
+        manifest = {}
+        to_resize = []
+        self.report = {"downloaded": 0, "unchanged": 0, "failed": 0, "resized": 0, "not_checked": 0}
+
+        if not refresh:
+            now = time.time()
+            to_check = []
+            for url in urls:
+                if self._is_fresh(old_manifest.get(url), now):
+                    manifest[url] = old_manifest[url]
+                    self.report["not_checked"] += 1
+                else:
+                    to_check.append(url)
+            urls = to_check
+
+        def download(url):
+            try:
+                return self._download(url, old_manifest.get(url))
+            except (requests.RequestException, OSError):
+                return None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for url, result in zip(urls, executor.map(download, urls)):
+                if result is None:
+                    self.report["failed"] += 1
+                    # keep serving the thumbnail of an earlier run while the poster host is unreachable
+                    if url in old_manifest:
+                        manifest[url] = old_manifest[url]
+                    continue
+                entry, changed = result
+                manifest[url] = entry
+                thumb_path = join(self.thumb_dir, entry["thumb"])
+                if changed or not os.path.isfile(thumb_path):
+                    to_resize.append((url, join(self.cache_dir, entry["hash"]), thumb_path))
+                    self.report["downloaded" if changed else "unchanged"] += 1
+                else:
+                    self.report["unchanged"] += 1
+
+        if to_resize:
+            with ProcessPoolExecutor(max_workers=self.processes) as executor:
+                done = executor.map(make_thumbnail, [source for _, source, _ in to_resize],
+                                    [target for _, _, target in to_resize], repeat(self.size),
+                                    repeat(self.image_format))
+                for (url, _, _), success in zip(to_resize, done):
+                    if success:
+                        self.report["resized"] += 1
+                    else:
+                        self.report["failed"] += 1
+                        manifest.pop(url, None)
+
+        self._save_manifest(manifest)
+        self._remove_unused(manifest)
+        return {url: "posters/" + entry["thumb"] for url, entry in manifest.items()
+                if os.path.isfile(join(self.thumb_dir, entry["thumb"]))}
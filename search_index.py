@@ -0,0 +1,226 @@
+import json
+import os
+from array import array
+from collections import Counter
+
+INDEX_VERSION = 2
+
+
+def normalise(text):
+    return " ".join(text.casefold().split())
+
+
+def trigrams(text):
+    """
+    splits normalised text into overlapping 3 letter pieces, padded so short words and word starts count too.
+    "mask" -> {"  m", " ma", "mas", "ask", "sk "}
+    """
+    padded = f"  {normalise(text)} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def rank_titles(query, titles, limit=5, min_score=50):
+    """
+    scores titles against the query with fuzzywuzzy, when no title scores above min_score
+    the titles closest by Levenshtein distance are returned instead.
+    :param query: (str) lower case search text
+    :param titles: (list) the titles to score, e.g. the candidates of a TrigramIndex
+    :return: (tuple) "fuzzy" and (title, score) pairs best first,
+             or "distance" and (title, distance) pairs closest first
+    """
+    from fuzzywuzzy import process
+    import Levenshtein
+
+    fuzzy_results = [(title, score) for title, score in process.extract(query, titles, limit=limit)
+                     if score > min_score]
+    if fuzzy_results:
+        return "fuzzy", fuzzy_results
+    distances = [(title, Levenshtein.distance(query, title.lower())) for title in titles]
+    return "distance", sorted(distances, key=lambda x: x[1])[:limit]
+
+
+def as_tuple(value):
+    """
+    turns the lists json made of a saved signature back into the tuples IStorage.signature() returns.
+    """
+    if isinstance(value, list):
+        return tuple(as_tuple(item) for item in value)
+    return value
+
+
+class TrigramIndex:
+    """
+    Inverted index from title trigrams to titles, used to narrow a search down to a hundred or so
+    candidate titles before the (slow) fuzzy scoring runs.
+    Titles get a numeric id, each trigram keeps an array of the ids containing it. Deleted titles
+    leave their id behind in the arrays and are skipped, save() writes the index without them.
+    The file is a json line with the titles and trigrams followed by the raw id arrays, so loading a file
+    someone else put next to the library can't run any code (unlike a pickle).
+    Methods:
+        __init__(file_path):
+            initialise an empty index, file_path is where save() writes the index (None to keep it in memory only).
+        load(file_path):
+            class method, reads a saved index or returns an empty one if there is none or it is unreadable.
+        add(title) / remove(title):
+            keep the index in step with the library.
+        sync(titles):
+            adds and removes titles so the index holds exactly the given titles, returns True if anything changed.
+        refresh(titles, signature):
+            syncs the index unless the library is unchanged since the last refresh, it is only marked dirty.
+        exact(query):
+            returns the title matching the query ignoring case and spacing, or None.
+        candidates(query, limit):
+            returns the titles sharing the most trigrams with the query.
+        save():
+            writes the index to file_path, the owner calls it once when it is done and the index is dirty.
+    """
+    def __init__(self, file_path=None):
+        self.file_path = file_path
+        self._titles = []
+        self._ids = {}
+        self._normalised = {}
+        self._postings = {}
+        # the library's signature (IStorage.signature()) the index was last synced at
+        self.signature = None
+        self.dirty = False
+
+    def __len__(self):
+        return len(self._ids)
+
+    @classmethod
+    def load(cls, file_path):
+        index = cls(file_path)
+        try:
+            with open(file_path, "rb") as index_file:
+                header = json.loads(index_file.readline())
+                postings = index_file.read()
+            if header.get("version") != INDEX_VERSION:
+                return index
+            for title in header["titles"]:
+                index._ids[title] = len(index._titles)
+                index._normalised.setdefault(normalise(title), []).append(title)
+                index._titles.append(title)
+            offset = 0
+            for gram, length in zip(header["grams"], header["lengths"]):
+                ids = array("I")
+                ids.frombytes(postings[offset:offset + length * ids.itemsize])
+                index._postings[gram] = ids
+                offset += length * ids.itemsize
+            if offset != len(postings) or len(index._postings) != len(header["grams"]):
+                raise ValueError("The trigram index file is cut off")
+            index.signature = as_tuple(header.get("signature"))
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # a missing or broken index is simply rebuilt by sync()
+            index = cls(file_path)
+        return index
+
+    def add(self, title):
+        if title in self._ids:
+            return
+        title_id = len(self._titles)
+        self._titles.append(title)
+        self._ids[title] = title_id
+        self._normalised.setdefault(normalise(title), []).append(title)
+        for gram in trigrams(title):
+            self._postings.setdefault(gram, array("I")).append(title_id)
+        self.dirty = True
+
+    def remove(self, title):
+        title_id = self._ids.pop(title, None)
+        if title_id is None:
+            return
+        self._titles[title_id] = None
+        # several titles can normalise to the same text ("Mask" and "mask")
+        key = normalise(title)
+        self._normalised[key].remove(title)
+        if not self._normalised[key]:
+            del self._normalised[key]
+        self.dirty = True
+
+    def sync(self, titles):
+        titles = set(titles)
+        missing = titles.difference(self._ids)
+        extra = set(self._ids).difference(titles)
+        for title in extra:
+            self.remove(title)
+        for title in missing:
+            self.add(title)
+        return bool(missing or extra)
+
+    def refresh(self, titles, signature=None):
+        """
+        brings the index in step with the library. Comparing the library's signature instead of its size
+        also catches a delete plus an add, or a rename, made by another process.
+        :param titles: (iterable) the titles of the library
+        :param signature: the library's signature, None if the storage can't tell (then it always syncs)
+        """
+        if signature is not None and signature == self.signature:
+            return
+        if self.sync(titles) or signature != self.signature:
+            self.signature = signature
+            self.dirty = True
+
+    def exact(self, query):
+        matches = self._normalised.get(normalise(query))
+        return matches[0] if matches else None
+
+    def candidates(self, query, limit=100, scan_budget=50000):
+        """
+        ranks titles by the number of trigrams they share with the query.
+        trigrams are looked at from the rarest to the most common, very common ones (" th", "the")
+        are skipped once scan_budget ids have been counted so a query stays fast on huge libraries.
+        :param query: (str) search text
+        :param limit: (int) maximum number of titles to return
+        :param scan_budget: (int) rough maximum of posting entries to count
+        :return: (list) titles, best match first
+        """
+        postings = sorted((self._postings[gram] for gram in trigrams(query) if gram in self._postings), key=len)
+        counts = Counter()
+        scanned = 0
+        for ids in postings:
+            if scanned and scanned + len(ids) > scan_budget:
+                break
+            counts.update(ids)
+            scanned += len(ids)
+        result = []
+        # deleted ids can still be in the counts, ask for enough extra to cover them
+        deleted = len(self._titles) - len(self._ids)
+        for title_id, _ in counts.most_common(limit + deleted):
+            title = self._titles[title_id]
+            if title is not None:
+                result.append(title)
+                if len(result) == limit:
+                    break
+        return result
+
+    def save(self):
+        """
+        writes the live titles (ids renumbered without the deleted ones) and their trigrams to file_path.
+        """
+        if self.file_path is None:
+            return
+        live = [title for title in self._titles if title is not None]
+        if len(live) != len(self._titles):
+            self._rebuild(live)
+        grams = list(self._postings)
+        header = {"version": INDEX_VERSION,
+                  "signature": self.signature,
+                  "titles": self._titles,
+                  "grams": grams,
+                  "lengths": [len(self._postings[gram]) for gram in grams]}
+        temp_path = self.file_path + ".tmp"
+        with open(temp_path, "wb") as index_file:
+            # json escapes line breaks inside the titles, so the header is exactly one line
+            index_file.write(json.dumps(header).encode() + b"\n")
+            for gram in grams:
+                index_file.write(self._postings[gram].tobytes())
+        os.replace(temp_path, self.file_path)
+        self.dirty = False
+
+    def _rebuild(self, titles):
+        self._titles = []
+        self._ids = {}
+        self._normalised = {}
+        self._postings = {}
+        for title in titles:
+            self.add(title)
@@ -0,0 +1,317 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from cli import MovieCommands, movie_record
+from data.identity_index import DuplicateMovieError, check_new_movie, find_existing
+from data.storage_memory import StorageMemory
+from omdb import OMDB_URL, OMDbError, ResponseCache, fetch_movie, search_type_for
+
+STATUS_TEXT = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 500: "Internal Server Error", 502: "Bad Gateway"}
+
+
+class RequestError(Exception):
+    """raised by a handler to answer with an error status and {"error": message}"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def query_value(query, name, cast=str, default=None):
+    """
+    :param query: (dict) the parsed query string, parse_qs style
+    :return: the first value of the parameter cast to the given type, default if it isn't there
+    """
+    if name not in query:
+        return default
+    try:
+        return cast(query[name][0])
+    except ValueError:
+        raise RequestError(400, f"Invalid value for {name}: {query[name][0]!r}")
+
+
+class MovieServer:
+    """
+    Small HTTP/JSON api over any storage, built on asyncio streams.
+    Reads are answered from an in memory snapshot of the library (a StorageMemory with its own cached
+    indexes). Listings, searches, filters and stats run in a thread pool, so a slow search doesn't hold up
+    the event loop and the other connections. Writes go through a queue to a single writer task which writes
+    them to the storage in a one thread executor and then applies them to the snapshot while no read runs,
+    so the storage only ever sees one write at a time and a read never sees the snapshot half changed.
+    OMDb lookups for new movies run in a thread pool and don't hold up the writer.
+    Routes:
+        GET /movies?limit=&offset=&fields=a,b       POST /movies {"title": ...}
+        GET /movies/<title>    DELETE /movies/<title>    PATCH /movies/<title> {"note": ...}
+        GET /search?q=&limit=    GET /filter?min_rating=&max_rating=&start_year=&end_year=&country=&title_prefix=
+        GET /sort?by=rating|year&reverse=1&limit=&offset=    GET /stats
+    Methods:
+        __init__(storage, api_key, url, omdb_cache, lookup_workers, read_workers):
+            initialise the server, the snapshot is read from the storage right away.
+        start(host, port):
+            starts the writer task and listens for connections, returns the asyncio server.
+        handle(method, target, body):
+            answers one request, returns the status and the json payload.
+    """
+    def __init__(self, storage, api_key=None, url=OMDB_URL, omdb_cache=None, lookup_workers=8, read_workers=4):
+        self._storage = storage
+        self._snapshot = StorageMemory(storage.list_movies())
+        self._reads = MovieCommands(self._snapshot)
+        self.api_key = api_key
+        self.url = url
+        self._omdb_cache = omdb_cache if omdb_cache is not None else ResponseCache()
+        self._lookups = ThreadPoolExecutor(max_workers=lookup_workers)
+        self._disk = ThreadPoolExecutor(max_workers=1)
+        self._reading = ThreadPoolExecutor(max_workers=read_workers)
+        self._writes = None
+        self._writer = None
+        # reads running in the pool, the writer waits for none to run before it changes the snapshot
+        self._running_reads = 0
+        self._no_reads = None
+        self._not_applying = None
+
+    async def start(self, host="127.0.0.1", port=8000):
+        self._writes = asyncio.Queue()
+        self._no_reads = asyncio.Event()
+        self._no_reads.set()
+        self._not_applying = asyncio.Event()
+        self._not_applying.set()
+        self._writer = asyncio.create_task(self._write_loop())
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def _write_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            check, operation, arguments, future = await self._writes.get()
+            try:
+                # checked here against the snapshot, which already holds every earlier write
+                check()
+                await loop.run_in_executor(self._disk, partial(getattr(self._storage, operation), *arguments))
+                # new reads wait until the change is applied, the running ones are let finish first
+                self._not_applying.clear()
+                try:
+                    await self._no_reads.wait()
+                    signature = self._snapshot.signature()
+                    getattr(self._snapshot, operation)(*arguments)
+                    # every write names its movie first, the read side's search index follows the snapshot
+                    self._reads.track_change(arguments[0], signature)
+                finally:
+                    self._not_applying.set()
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+
+    async def _write(self, check, operation, *arguments):
+        """
+        queues a storage method call for the writer task and waits until it is written.
+        :param check: (function) raises a RequestError if the write isn't possible (anymore)
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._writes.put((check, operation, arguments, future))
+        await future
+
+    async def _read(self, command, **arguments):
+        """
+        runs a read command of the snapshot's MovieCommands in the read pool.
+        :return: the command's result, listings as a list
+        """
+        await self._not_applying.wait()
+        self._running_reads += 1
+        self._no_reads.clear()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._reading, partial(self._reads.run, command, **arguments))
+        finally:
+            self._running_reads -= 1
+            if self._running_reads == 0:
+                self._no_reads.set()
+
+    def _movie(self, title):
+        movies = self._snapshot.list_movies()
+        if title not in movies:
+            raise RequestError(404, f"{title} is not in the library")
+        return movie_record(title, movies[title])
+
+    def _require_absent(self, title):
+        existing = find_existing(self._snapshot.identity_index(), title)
+        if existing is not None:
+            raise RequestError(409, f"{existing} is already in the library")
+
+    def _require_new(self, title, year, imdb_link, expected=None):
+        """
+        :param expected: (str) the title the movie was going to be added under, it must still be free
+        :return: (str) the title to add the movie OMDb found under, see identity_index.check_new_movie
+        """
+        try:
+            new_title = check_new_movie(self._snapshot.identity_index(), title, year, imdb_link)
+        except DuplicateMovieError as e:
+            raise RequestError(409, str(e))
+        if expected is not None and new_title != expected:
+            raise RequestError(409, f"{expected} is already in the library")
+        return new_title
+
+    async def _add(self, body):
+        title = body.get("title") if isinstance(body, dict) else None
+        if not isinstance(title, str) or not title.strip():
+            raise RequestError(400, 'Expected {"title": ...}')
+        self._require_absent(title)
+
+        from requests.exceptions import RequestException
+        lookup = partial(fetch_movie, title, self.api_key, self.url, search_type_for(title), cache=self._omdb_cache)
+        try:
+            title, rating, year, poster, imdb_link, country = await asyncio.get_running_loop().run_in_executor(
+                self._lookups, lookup)
+        except OMDbError as e:
+            raise RequestError(404, f"OMDb could not find the movie: {e}")
+        except RequestException as e:
+            raise RequestError(502, f"OMDb lookup failed: {e}")
+
+        new_title = self._require_new(title, year, imdb_link)
+        await self._write(partial(self._require_new, title, year, imdb_link, new_title), "add_movie",
+                          new_title, rating, year, poster, imdb_link, country)
+        title = new_title
+        return self._movie(title)
+
+    async def _delete(self, title):
+        movie = self._movie(title)
+        await self._write(partial(self._movie, title), "delete_movie", title)
+        return movie
+
+    async def _update(self, title, body):
+        note = body.get("note") if isinstance(body, dict) else None
+        if not isinstance(note, str):
+            raise RequestError(400, 'Expected {"note": ...}')
+        self._movie(title)
+        await self._write(partial(self._movie, title), "update_movie", title, note)
+        return self._movie(title)
+
+    async def handle(self, method, target, body=b""):
+        """
+        :param method: (str) http method
+        :param target: (str) request target, path and query string
+        :param body: (bytes) request body, json for POST and PATCH
+        :return: (tuple) status code and json payload
+        """
+        try:
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+            parts = [unquote(part) for part in url.path.strip("/").split("/")]
+            payload = json.loads(body) if body else {}
+
+            if parts[0] == "movies" and len(parts) == 1:
+                if method == "GET":
+                    fields = query_value(query, "fields", lambda text: text.split(","))
+                    return 200, await self._read("list", fields=fields, limit=query_value(query, "limit", int),
+                                                 offset=query_value(query, "offset", int, 0))
+                if method == "POST":
+                    return 201, await self._add(payload)
+            elif parts[0] == "movies" and len(parts) == 2:
+                if method == "GET":
+                    return 200, self._movie(parts[1])
+                if method == "DELETE":
+                    return 200, await self._delete(parts[1])
+                if method in ("PATCH", "PUT"):
+                    return 200, await self._update(parts[1], payload)
+            elif parts == ["search"]:
+                if method != "GET":
+                    raise RequestError(405, f"{method} is not allowed on {url.path}")
+                search_query = query_value(query, "q")
+                if not search_query:
+                    raise RequestError(400, "Missing q")
+                return 200, await self._read("search", query=search_query, limit=query_value(query, "limit", int, 5))
+            elif parts == ["filter"]:
+                if method != "GET":
+                    raise RequestError(405, f"{method} is not allowed on {url.path}")
+                return 200, await self._read("filter", min_rating=query_value(query, "min_rating", float),
+                                             max_rating=query_value(query, "max_rating", float),
+                                             start_year=query_value(query, "start_year", int),
+                                             end_year=query_value(query, "end_year", int),
+                                             country=query_value(query, "country"),
+                                             title_prefix=query_value(query, "title_prefix"))
+            elif parts == ["sort"]:
+                if method != "GET":
+                    raise RequestError(405, f"{method} is not allowed on {url.path}")
+                key = query_value(query, "by", default="rating")
+                if key not in ("rating", "year"):
+                    raise RequestError(400, "by must be rating or year")
+                return 200, await self._read("sort", key=key, reverse=query_value(query, "reverse", int, 0) == 1,
+                                             limit=query_value(query, "limit", int),
+                                             offset=query_value(query, "offset", int, 0))
+            elif parts == ["stats"]:
+                if method != "GET":
+                    raise RequestError(405, f"{method} is not allowed on {url.path}")
+                return 200, await self._read("stats")
+            else:
+                raise RequestError(404, f"No route for {url.path}")
+            raise RequestError(405, f"{method} is not allowed on {url.path}")
+        except RequestError as e:
+            return e.status, {"error": str(e)}
+        except json.JSONDecodeError:
+            return 400, {"error": "The request body isn't valid json"}
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+    async def _handle_connection(self, reader, writer):
+        """
+        reads requests from one connection until the client closes it, connections are kept alive.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self.handle(method, target, body)
+                data = json.dumps(payload).encode()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                             f"Content-Type: application/json\r\n"
+                             f"Content-Length: {len(data)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # client went away or sent something that isn't http
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.cancel()
+        self._lookups.shutdown(wait=False)
+        self._reading.shutdown(wait=True)
+        self._disk.shutdown(wait=True)
+        self._reads.close()
+
+
+def serve(storage, host="127.0.0.1", port=8000, api_key=None, url=OMDB_URL):
+    """
+    runs the server until it is stopped with Ctrl+C.
+    """
+    movie_server = MovieServer(storage, api_key, url)
+
+    async def run():
+        server = await movie_server.start(host, port)
+        print(f"Serving the library on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        movie_server.close()
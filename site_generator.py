@@ -0,0 +1,228 @@
+import hashlib
+import json
+import os
+from itertools import islice
+from os.path import join
+
+from countries import country_codes
+from metrics import METRICS
+
+# bump when the page layout or the cards change so every page is written again
+SITE_VERSION = 1
+
+# (file name prefix, sort key, label) of every listing, a sort key of None keeps the storage order
+ORDERS = (
+    ("index", None, "Library"),
+    ("rating", "rating", "Best rated"),
+    ("year", "year", "Newest"),
+)
+
+HTML_HEADER = """
+        <!DOCTYPE html>
+        <html lang="en">
+        <head>
+            <meta charset="UTF-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+            <link rel="stylesheet" href="style.css"/>
+            <title>PopcornPicker</title>
+        </head>
+        <body>
+        <main>
+            <div class="list-movies-title">
+                <h1>PopcornPicker Movie Library</h1>
+            </div>
+"""
+
+HTML_FOOTER = """
+            </div>
+        </main>
+        </body>
+        </html>
+        """
+
+
+def page_name(prefix, number):
+    """
+    :return: (str) file name of a page, the first page of a listing is just prefix.html
+    """
+    return f"{prefix}.html" if number == 1 else f"{prefix}-{number}.html"
+
+
+def movie_hash(title, details):
+    """
+    :return: (bytes) content hash of one movie, changes whenever anything shown on its card changes
+    """
+    return hashlib.blake2b(repr((title, sorted(details.items()))).encode(), digest_size=16).digest()
+
+
+def movie_card(title, details):
+    """
+    :return: (str) the html card of one movie for the website
+    """
+    flags = "".join(
+        f"""
+                            <img class="country-flag" src="https://flagsapi.com/{code}/flat/64.png" alt="{name} Flag">"""
+        for name, code in country_codes(details.get('country'))
+    )
+    return f"""
+                <div class="movie">
+                    <a href="{details.get("imdbID")}" target="_blank">
+                        <div class="flag-container">{flags}
+                        </div>
+                            <img class="movie-poster" src="{details.get("poster")}">
+                    </a>
+                    <div class="text">
+                        <div class="movie-title">{title}</div>
+                        <div class="movie-year">{details.get("year")}</div>
+                        <div class="movie-rating">iMDb Rating: {details.get("rating")}</div>
+                        <div class="movie-note">{details.get("note", "")}</div>
+                    </div>
+                </div>
+        """
+
+
+def build_site(storage, output_dir="web", page_size=100, mirror_posters=True, refresh_posters=False):
+    """
+    mirrors the posters (see posters.PosterMirror) and then writes the pages that changed.
+    :param mirror_posters: (bool) False keeps the cards pointing at the original poster urls
+    :param refresh_posters: (bool) ask the poster hosts if the posters mirrored before changed
+    :return: (dict) the report of SiteGenerator.generate()
+    """
+    posters = None
+    if mirror_posters:
+        from posters import PosterMirror
+        with METRICS.timer("site_posters"):
+            movies = storage.iter_movies(fields=("poster",))
+            posters = PosterMirror(site_dir=output_dir).mirror((details.get("poster") for _, details in movies),
+                                                              refresh=refresh_posters)
+    with METRICS.timer("site_pages"):
+        return SiteGenerator(storage, output_dir=output_dir, page_size=page_size, posters=posters).generate()
+
+
+class SiteGenerator:
+    """
+    Writes the website as pages of page_size cards, for the storage order and sorted by rating and by year.
+    A manifest next to the pages keeps a hash of every page (made from the content hashes of its movies),
+    so a rerun only renders and writes the pages whose cards changed and removes pages that are gone.
+    Methods:
+        __init__(storage, render_card, output_dir, page_size, posters):
+            initialise the generator, render_card(title, details) returns the html of one card (movie_card by default).
+            posters maps poster urls to local thumbnails the cards should show instead.
+        generate():
+            writes the changed pages and the manifest, returns what was done.
+    """
+    def __init__(self, storage, render_card=movie_card, output_dir="web", page_size=100, posters=None):
+        self._storage = storage
+        self._posters = posters or {}
+        self._render_card = render_card
+        self.output_dir = output_dir
+        self.page_size = page_size
+        self.manifest_path = join(output_dir, "manifest.json")
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        if manifest.get("version") != SITE_VERSION or manifest.get("page_size") != self.page_size:
+            return {}
+        return manifest.get("pages", {})
+
+    def _write(self, name, write_content):
+        """
+        writes a file through a temporary file so a page is never left half written.
+        """
+        path = join(self.output_dir, name)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w") as file:
+            write_content(file)
+        os.replace(temp_path, path)
+
+    def _pages(self, key):
+        """
+        splits a listing into pages, one page is looked ahead so each page knows if there is a next one.
+        :return: (generator) of (page number, list of (title, details), has next page)
+        """
+        if key is None:
+            movies = iter(self._storage.iter_movies())
+        else:
+            movies = iter(self._storage.sorted_movies(key, reverse=True))
+        if self._posters:
+            movies = ((title, self._local_poster(details)) for title, details in movies)
+        page = list(islice(movies, self.page_size))
+        number = 1
+        while True:
+            next_page = list(islice(movies, self.page_size))
+            yield number, page, bool(next_page)
+            if not next_page:
+                return
+            page, number = next_page, number + 1
+
+    def _local_poster(self, details):
+        poster = self._posters.get(details.get("poster"))
+        return details if poster is None else dict(details, poster=poster)
+
+    def _navigation(self, prefix, number, has_next):
+        links = [
+            f'<a class="{"active" if order == prefix else ""}" href="{page_name(order, 1)}">{label}</a>'
+            for order, _, label in ORDERS
+        ]
+        pages = []
+        if number > 1:
+            pages.append(f'<a href="{page_name(prefix, number - 1)}">&laquo; Previous</a>')
+        pages.append(f'<span>Page {number}</span>')
+        if has_next:
+            pages.append(f'<a href="{page_name(prefix, number + 1)}">Next &raquo;</a>')
+        return f"""
+            <nav class="pages">
+                <div class="sort-links">{" ".join(links)}</div>
+                <div class="page-links">{" ".join(pages)}</div>
+            </nav>
+            <div class="list">
+"""
+
+    def generate(self):
+        """
+        :return: (dict) "pages": number of pages, "written": pages written, "removed": stale pages deleted
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        old_pages = self._load_manifest()
+        pages = {}
+        written = 0
+        # every movie is on one page of each listing, hash it only once
+        hashes = {}
+
+        for prefix, key, _ in ORDERS:
+            for number, movies, has_next in self._pages(key):
+                name = page_name(prefix, number)
+                digest = hashlib.blake2b(f"{SITE_VERSION}:{name}:{has_next}".encode(), digest_size=16)
+                for title, details in movies:
+                    if title not in hashes:
+                        hashes[title] = movie_hash(title, details)
+                    digest.update(hashes[title])
+                pages[name] = digest.hexdigest()
+                if old_pages.get(name) == pages[name] and os.path.isfile(join(self.output_dir, name)):
+                    continue
+
+                def write_page(file):
+                    file.write(HTML_HEADER)
+                    file.write(self._navigation(prefix, number, has_next))
+                    for title, details in movies:
+                        file.write(self._render_card(title, details))
+                    file.write(HTML_FOOTER)
+
+                self._write(name, write_page)
+                written += 1
+
+        removed = 0
+        for name in old_pages.keys() - pages.keys():
+            try:
+                os.remove(join(self.output_dir, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+
+        self._write("manifest.json", lambda file: json.dump(
+            {"version": SITE_VERSION, "page_size": self.page_size, "pages": pages}, file))
+        return {"pages": len(pages), "written": written, "removed": removed}